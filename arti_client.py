@@ -0,0 +1,430 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import base64
+import email.utils
+import http.client
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.parse
+
+import curation_metrics
+
+### GLOBALS ###
+DEFAULT_POOL_SIZE = 8
+DEFAULT_TIMEOUT = 300
+# Read size used when a response body is streamed and thrown away.
+STREAM_CHUNK_SIZE = 64 * 1024
+# Number of paths looked up per AQL query by find_existing().
+AQL_BATCH_SIZE = 500
+# Requests per second allowed to one Artifactory host across every client and thread of a run (0 for no cap), and
+# how many can be sent back to back after an idle spell.
+RATE_LIMIT = float(os.environ.get('curate_rate_limit', '500'))
+RATE_BURST = int(os.environ.get('curate_rate_burst', '100'))
+# Upper bound of the adaptive window of requests in flight to one host.  The window starts here, halves when the
+# host sheds load and grows back by about one request per window of successes.
+MAX_CONCURRENCY = int(os.environ.get('curate_max_concurrency', '16'))
+MIN_CONCURRENCY = 1
+# Tries for an idempotent request that fails with a transient error, and the exponential backoff between them.
+RETRY_ATTEMPTS = int(os.environ.get('curate_retry_attempts', '5'))
+RETRY_BASE_DELAY = float(os.environ.get('curate_retry_base_seconds', '0.5'))
+RETRY_MAX_DELAY = 30.0
+# The longest Retry-After that is honoured, so one misconfigured proxy can't park a run for hours.
+RETRY_AFTER_MAX = 120.0
+# Statuses worth retrying: the host (or a proxy in front of it) is overloaded or briefly unavailable.
+RETRY_STATUSES = (429, 502, 503, 504)
+# Statuses that mean the host is shedding load, which shrink the window of requests in flight.  A gateway error or a
+# dropped connection says nothing about the host's load, so those are only retried.
+THROTTLE_STATUSES = (429, 503)
+# NOTE: DELETE is left out on purpose, a delete that went through before its connection dropped would be retried
+#       against whatever was put at the path since.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'OPTIONS')
+# Time to the response headers, smoothed, above this multiple of the best seen counts as the host slowing down.
+SLOWDOWN_FACTOR = 3.0
+# Window decreases are at least this far apart, so a burst of rejections of requests sent under the old window
+# only counts once.
+DECREASE_INTERVAL = 1.0
+
+# One client per Artifactory URL/user so every puller in a run shares the same connection pool.
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
+# One limiter per host, shared by every client that talks to it.
+_LIMITERS = {}
+_LIMITERS_LOCK = threading.Lock()
+
+### FUNCTIONS ###
+def get_client(login_data, pool_size = DEFAULT_POOL_SIZE):
+    tmp_key = (login_data['arti_url'], login_data['user'])
+    with _CLIENTS_LOCK:
+        if tmp_key not in _CLIENTS:
+            _CLIENTS[tmp_key] = ArtifactoryClient(login_data, pool_size = pool_size)
+        return _CLIENTS[tmp_key]
+
+def get_limiter(scheme, netloc):
+    with _LIMITERS_LOCK:
+        if (scheme, netloc) not in _LIMITERS:
+            _LIMITERS[(scheme, netloc)] = HostLimiter(netloc, RATE_LIMIT, RATE_BURST, MAX_CONCURRENCY)
+        return _LIMITERS[(scheme, netloc)]
+
+def quote_path(input_path):
+    # For the path of a URL only.  '+' is left alone there, but it means a space in a query string.
+    return urllib.parse.quote(input_path, safe = "/:@+=,")
+
+def quote_query(input_value):
+    return urllib.parse.quote(input_value, safe = "/")
+
+def retry_after(input_headers):
+    # Seconds asked for by a Retry-After header, either delta-seconds or an HTTP date, or None.
+    tmp_value = None
+    for tmp_name, tmp_header in input_headers.items():
+        if tmp_name.lower() == 'retry-after':
+            tmp_value = tmp_header.strip()
+    if not tmp_value:
+        return None
+    if tmp_value.isdigit():
+        return min(float(tmp_value), RETRY_AFTER_MAX)
+    try:
+        tmp_date = email.utils.parsedate_to_datetime(tmp_value)
+    except (TypeError, ValueError):
+        return None
+    return min(max(0.0, tmp_date.timestamp() - time.time()), RETRY_AFTER_MAX)
+
+def backoff_delay(input_attempt, input_retry_after = None):
+    # Full jitter: uniform in [0, base * 2^attempt], capped, so threads that failed together don't retry together.
+    # A Retry-After from the server is the floor.
+    tmp_delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** input_attempt)))
+    if input_retry_after is not None:
+        tmp_delay = max(tmp_delay, input_retry_after)
+    return tmp_delay
+
+### CLASSES ###
+class ArtiResponse:
+    def __init__(self, method, url, status, body = b'', headers = None, error = None, size = None):
+        self.method = method
+        self.url = url
+        self.status = status
+        self.body = body
+        self.headers = headers if headers is not None else {}
+        # Number of body bytes received, which differs from len(body) when the body was discarded while streaming.
+        self.size = size if size is not None else len(body)
+        # NOTE: 'error' is only set when the request never got an HTTP response (connection refused, timeout...).
+        self.error = error
+
+    @property
+    def ok(self):
+        return 200 <= self.status < 300
+
+    @property
+    def conflict(self):
+        # '409: Conflict' is what Artifactory returns when the target of a copy already exists.
+        return self.status == 409
+
+    @property
+    def not_found(self):
+        return self.status == 404
+
+    @property
+    def not_modified(self):
+        # '304: Not Modified' answers a conditional GET (If-None-Match) whose ETag still matches.
+        return self.status == 304
+
+    def header(self, input_name, default = None):
+        # HTTP header names are case insensitive.
+        for tmp_name, tmp_value in self.headers.items():
+            if tmp_name.lower() == input_name.lower():
+                return tmp_value
+        return default
+
+    def text(self):
+        return self.body.decode(errors = 'replace')
+
+    def json(self):
+        return json.loads(self.body.decode())
+
+    def __repr__(self):
+        if self.error is not None:
+            return "<ArtiResponse {} {} error={}>".format(self.method, self.url, self.error)
+        return "<ArtiResponse {} {} status={} bytes={}>".format(self.method, self.url, self.status, self.size)
+
+class ConnectionPool:
+    def __init__(self, scheme, netloc, maxsize = DEFAULT_POOL_SIZE, timeout = DEFAULT_TIMEOUT):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize = maxsize)
+
+    def _new_connection(self):
+        self.logger.debug("Opening a new connection to: %s://%s", self.scheme, self.netloc)
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.netloc, timeout = self.timeout)
+        return http.client.HTTPConnection(self.netloc, timeout = self.timeout)
+
+    def get(self):
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            return self._new_connection(), False
+
+    def put(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+class HostLimiter:
+    # Admission control for one host: a token bucket caps the request rate, and an AIMD window caps the requests in
+    # flight.  The window halves on a throttling status, shrinks a little when responses slow down well past the
+    # best seen (the shared instance is queueing) and otherwise grows additively, so throughput settles just below
+    # the point where the host starts pushing back.  A Retry-After pauses every request to the host.
+    def __init__(self, netloc, rate, burst, max_concurrency, min_concurrency = MIN_CONCURRENCY):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.netloc = netloc
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max(min_concurrency, max_concurrency)
+        self.min_concurrency = min_concurrency
+        self.window = float(self.max_concurrency)
+        self.in_flight = 0
+        self.throttled = 0
+        self.slowdowns = 0
+        self._tokens = float(self.burst)
+        self._refilled = time.monotonic()
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._latency = None
+        self._best_latency = None
+        self._cond = threading.Condition()
+
+    def _refill(self, input_now):
+        self._tokens = min(self.burst, self._tokens + (input_now - self._refilled) * self.rate)
+        self._refilled = input_now
+
+    def acquire(self):
+        with self._cond:
+            while True:
+                tmp_now = time.monotonic()
+                if tmp_now < self._paused_until:
+                    self._cond.wait(self._paused_until - tmp_now)
+                    continue
+                if self.in_flight >= int(self.window):
+                    self._cond.wait()
+                    continue
+                if self.rate > 0:
+                    self._refill(tmp_now)
+                    if self._tokens < 1:
+                        self._cond.wait((1 - self._tokens) / self.rate)
+                        continue
+                    self._tokens -= 1
+                self.in_flight += 1
+                return
+
+    def _decrease(self, input_now, input_factor, input_reason):
+        if input_now - self._last_decrease < DECREASE_INTERVAL:
+            return
+        self._last_decrease = input_now
+        tmp_window = max(self.min_concurrency, self.window * input_factor)
+        if int(tmp_window) < int(self.window):
+            self.logger.info("Lowering the requests in flight to '%s' to %d (%s)", self.netloc, int(tmp_window), input_reason)
+        self.window = tmp_window
+
+    def release(self, input_status, input_latency = None, input_retry_after = None):
+        # input_status None means the request got no usable response (a stale pooled connection, a timeout, a body
+        # cut short), which says nothing about the host's load.  A Retry-After on any status is the host asking
+        # for less.
+        with self._cond:
+            self.in_flight -= 1
+            tmp_now = time.monotonic()
+            if input_status in THROTTLE_STATUSES or (input_status is not None and input_retry_after):
+                self.throttled += 1
+                if input_retry_after:
+                    self._paused_until = max(self._paused_until, tmp_now + input_retry_after)
+                self._decrease(tmp_now, 0.5, "status {}".format(input_status))
+            elif input_status is not None and input_latency is not None:
+                if self._latency is None:
+                    self._latency = self._best_latency = input_latency
+                self._latency = 0.8 * self._latency + 0.2 * input_latency
+                # The best drifts up towards the current latency, so a host that has become slower for good is
+                # eventually taken as the new normal instead of shrinking the window forever.
+                self._best_latency = min(self._latency, self._best_latency + 0.01 * (self._latency - self._best_latency))
+                if self._latency > SLOWDOWN_FACTOR * self._best_latency and self._latency - self._best_latency > 0.05:
+                    self.slowdowns += 1
+                    self._decrease(tmp_now, 0.9, "responses slowed to {:.0f}ms".format(self._latency * 1000))
+                else:
+                    self.window = min(self.max_concurrency, self.window + 1.0 / self.window)
+            self._cond.notify_all()
+
+    def __repr__(self):
+        return "<HostLimiter {} window={} in_flight={} throttled={} slowdowns={}>".format(
+            self.netloc, int(self.window), self.in_flight, self.throttled, self.slowdowns
+        )
+
+class ArtifactoryClient:
+    def __init__(self, login_data, pool_size = DEFAULT_POOL_SIZE, timeout = DEFAULT_TIMEOUT):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.login_data = login_data
+        self.pool_size = pool_size
+        self.timeout = timeout
+        tmp_url = urllib.parse.urlsplit(login_data['arti_url'])
+        self.scheme = tmp_url.scheme
+        self.netloc = tmp_url.netloc
+        self.base_path = tmp_url.path.rstrip('/')
+        tmp_auth = "{}:{}".format(login_data['user'], login_data['apikey'])
+        self._auth_header = "Basic {}".format(base64.b64encode(tmp_auth.encode()).decode())
+        self._pools = {}
+        self._pools_lock = threading.Lock()
+        self.limiter = get_limiter(self.scheme, self.netloc)
+        self.retry_attempts = max(1, RETRY_ATTEMPTS)
+
+    def _pool_for(self, scheme, netloc):
+        with self._pools_lock:
+            if (scheme, netloc) not in self._pools:
+                self._pools[(scheme, netloc)] = ConnectionPool(scheme, netloc, self.pool_size, self.timeout)
+            return self._pools[(scheme, netloc)]
+
+    def url_for(self, input_path):
+        return "{}://{}{}/{}".format(self.scheme, self.netloc, self.base_path, input_path.lstrip('/'))
+
+    def _read_body(self, input_resp, discard_body):
+        # Error bodies are always kept, they are small and carry Artifactory's error message.
+        if not discard_body or not 200 <= input_resp.status < 300:
+            tmp_body = input_resp.read()
+            return tmp_body, len(tmp_body)
+        tmp_size = 0
+        while True:
+            tmp_chunk = input_resp.read(STREAM_CHUNK_SIZE)
+            if not tmp_chunk:
+                return b'', tmp_size
+            tmp_size += len(tmp_chunk)
+
+    def request(self, method, input_path, body = None, headers = None, discard_body = False, idempotent = None):
+        # Transient failures (throttling, gateway errors, dropped connections) of idempotent requests are retried
+        # with backoff.  POSTs are only retried when the caller says repeating them is safe.
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+        tmp_attempts = self.retry_attempts if idempotent else 1
+        for tmp_attempt in range(tmp_attempts):
+            tmp_response = self._send(method, input_path, body, headers, discard_body)
+            if tmp_response.status not in RETRY_STATUSES + (0,) or tmp_attempt + 1 == tmp_attempts:
+                return tmp_response
+            tmp_delay = backoff_delay(tmp_attempt, retry_after(tmp_response.headers))
+            self.logger.info("Retrying %s %s in %.1fs after %s (attempt %d of %d)", method, tmp_response.url, tmp_delay,
+                             tmp_response.error or tmp_response.status, tmp_attempt + 2, tmp_attempts)
+            curation_metrics.count_retry()
+            time.sleep(tmp_delay)
+
+    def _send(self, method, input_path, body, headers, discard_body):
+        tmp_url = self.url_for(input_path)
+        tmp_target = "{}/{}".format(self.base_path, input_path.lstrip('/'))
+        tmp_headers = {'Authorization': self._auth_header, 'Connection': 'keep-alive'}
+        if headers:
+            tmp_headers.update(headers)
+        if body is None and method in ('PUT', 'POST'):
+            body = b''
+        tmp_pool = self._pool_for(self.scheme, self.netloc)
+        # A pooled connection may have been closed by the server while idle, so a reused connection gets one
+        # retry on a fresh socket before the error is reported.
+        for tmp_attempt in range(2):
+            tmp_conn, tmp_reused = tmp_pool.get()
+            self.limiter.acquire()
+            tmp_latency = None
+            try:
+                tmp_start = time.monotonic()
+                tmp_conn.request(method, tmp_target, body = body, headers = tmp_headers)
+                tmp_resp = tmp_conn.getresponse()
+                tmp_latency = time.monotonic() - tmp_start
+                tmp_body, tmp_size = self._read_body(tmp_resp, discard_body)
+            except (http.client.HTTPException, OSError) as tmp_err:
+                tmp_conn.close()
+                self.limiter.release(None)
+                if tmp_reused and tmp_attempt == 0:
+                    self.logger.debug("  Stale pooled connection, retrying: %s", tmp_err)
+                    continue
+                self.logger.debug("  %s %s failed: %s", method, tmp_url, tmp_err)
+                curation_metrics.count_request(0)
+                return ArtiResponse(method, tmp_url, 0, error = str(tmp_err))
+            self.limiter.release(tmp_resp.status, tmp_latency, retry_after(dict(tmp_resp.getheaders())))
+            if tmp_resp.will_close:
+                tmp_conn.close()
+            else:
+                tmp_pool.put(tmp_conn)
+            tmp_response = ArtiResponse(method, tmp_url, tmp_resp.status, tmp_body, dict(tmp_resp.getheaders()), size = tmp_size)
+            self.logger.debug("  %s", tmp_response)
+            curation_metrics.count_request(tmp_size)
+            return tmp_response
+
+    def get(self, input_path, headers = None):
+        return self.request('GET', quote_path(input_path), headers = headers)
+
+    def fetch(self, input_path, headers = None):
+        # GET that streams the body and throws it away, e.g. to make a remote repo cache an artifact without
+        # holding the whole file in memory.
+        return self.request('GET', quote_path(input_path), headers = headers, discard_body = True)
+
+    def head(self, input_path, headers = None):
+        return self.request('HEAD', quote_path(input_path), headers = headers)
+
+    def put(self, input_path, body = None, headers = None):
+        return self.request('PUT', quote_path(input_path), body = body, headers = headers)
+
+    def post(self, input_path, body = None, headers = None):
+        return self.request('POST', quote_path(input_path), body = body, headers = headers)
+
+    def delete(self, input_path):
+        return self.request('DELETE', quote_path(input_path))
+
+    def copy(self, input_from, input_to):
+        self.logger.debug("Copying artifact from: %s to: %s", input_from, input_to)
+        tmp_path = "api/copy/{}?to=/{}".format(quote_path(input_from.lstrip('/')), quote_query(input_to.lstrip('/')))
+        # Repeating a copy is safe: if an earlier try went through, the retry gets a '409: Conflict'.
+        tmp_response = self.request('POST', tmp_path, idempotent = True)
+        if tmp_response.conflict:
+            self.logger.debug("  Already present in the target: %s", input_to)
+        return tmp_response
+
+    def aql(self, input_query):
+        return self.request('POST', 'api/search/aql', body = input_query.encode(), headers = {'Content-Type': 'text/plain'},
+                            idempotent = True)
+
+    def find_existing(self, input_repo, input_paths):
+        # Returns the subset of input_paths (relative to input_repo) that already exist, using one AQL query per
+        # AQL_BATCH_SIZE paths.  None means the lookup failed and the caller should assume nothing is present.
+        tmp_present = set()
+        tmp_paths = sorted(set(tmp_path.strip('/') for tmp_path in input_paths))
+        for tmp_idx in range(0, len(tmp_paths), AQL_BATCH_SIZE):
+            tmp_terms = []
+            for tmp_path in tmp_paths[tmp_idx:tmp_idx + AQL_BATCH_SIZE]:
+                tmp_dir, _, tmp_name = tmp_path.rpartition('/')
+                tmp_terms.append({'$and': [{'path': tmp_dir if tmp_dir else '.'}, {'name': tmp_name}]})
+            tmp_query = 'items.find({}).include("repo","path","name")'.format(
+                json.dumps({'repo': input_repo, 'type': 'file', '$or': tmp_terms})
+            )
+            tmp_response = self.aql(tmp_query)
+            if not tmp_response.ok:
+                self.logger.warning("AQL lookup in '%s' failed: %s %s", input_repo, tmp_response.status,
+                                    tmp_response.error or tmp_response.text())
+                return None
+            for tmp_item in tmp_response.json().get('results', []):
+                if tmp_item['path'] in ('.', ''):
+                    tmp_present.add(tmp_item['name'])
+                else:
+                    tmp_present.add("{}/{}".format(tmp_item['path'], tmp_item['name']))
+        self.logger.debug("  %d of %d paths already in '%s'", len(tmp_present), len(tmp_paths), input_repo)
+        return tmp_present
+
+    def close(self):
+        with self._pools_lock:
+            for tmp_pool in self._pools.values():
+                tmp_pool.close()
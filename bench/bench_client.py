@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import arti_client
+from stub_artifactory import StubArtifactoryServer
+
+### FUNCTIONS ###
+def run_curl(login_data, count):
+    # Same command shape the curators used before moving to arti_client.
+    for tmp_idx in range(count):
+        curl_cmd = "curl -f -XPOST -u{}:{} {}/api/copy/{}?to=/{}".format(
+            login_data['user'], login_data['apikey'], login_data['arti_url'],
+            "remote-cache/pkg-{}".format(tmp_idx), "local/pkg-{}".format(tmp_idx)
+        )
+        subprocess.run(curl_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+
+def run_client(login_data, count):
+    tmp_client = arti_client.ArtifactoryClient(login_data)
+    for tmp_idx in range(count):
+        tmp_client.copy("remote-cache/pkg-{}".format(tmp_idx), "local/pkg-{}".format(tmp_idx))
+    tmp_client.close()
+
+### MAIN ###
+def main():
+    tmp_parser = argparse.ArgumentParser(description = "Compare curl subprocesses with the pooled arti_client")
+    tmp_parser.add_argument('--count', type = int, default = 400)
+    tmp_parser.add_argument('--latency', type = float, default = 0.0)
+    tmp_args = tmp_parser.parse_args()
+    logging.basicConfig(format = "%(message)s", level = logging.INFO)
+
+    tmp_server = StubArtifactoryServer(('127.0.0.1', 0), latency = tmp_args.latency)
+    tmp_server.start()
+    tmp_login_data = {'user': 'bench', 'apikey': 'bench', 'arti_url': tmp_server.url}
+
+    for tmp_name, tmp_func in (('curl', run_curl), ('arti_client', run_client)):
+        tmp_start = time.monotonic()
+        tmp_func(tmp_login_data, tmp_args.count)
+        tmp_elapsed = time.monotonic() - tmp_start
+        logging.info("%-12s %5d copies in %7.3fs (%8.1f req/s)", tmp_name, tmp_args.count, tmp_elapsed,
+                     tmp_args.count / tmp_elapsed)
+    tmp_server.shutdown()
+
+if __name__ == "__main__":
+    main()
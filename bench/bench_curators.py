@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import mock_fixtures
+from stub_artifactory import StubArtifactoryServer
+
+### GLOBALS ###
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+ECOSYSTEMS = ['docker', 'maven', 'pypi', 'rpm']
+
+### FUNCTIONS ###
+def parse_assignments(input_values):
+    tmp_env = {}
+    for tmp_value in input_values or []:
+        tmp_name, _, tmp_setting = tmp_value.partition('=')
+        tmp_env[tmp_name] = tmp_setting
+    return tmp_env
+
+def run_curator(ecosystem, server, scenario_env, workdir, extra_env):
+    # Run curate_<ecosystem>.py once against the stub, the way the pipeline step runs it.  The ledger and caches
+    # live in workdir, so a run is cold unless it reuses the workdir of an earlier one.
+    tmp_env = dict(os.environ)
+    tmp_env.update(scenario_env)
+    tmp_env.update({
+        'int_artifactory_user': 'bench',
+        'int_artifactory_apikey': 'bench',
+        'int_artifactory_url': server.url,
+        'curate_ledger': os.path.join(workdir, 'ledger.sqlite'),
+        'curate_cache_root': os.path.join(workdir, 'cache'),
+        'curate_metrics_report': os.path.join(workdir, 'curation_report.json'),
+    })
+    tmp_env.update(extra_env)
+    tmp_before = server.stats()
+    tmp_start = time.monotonic()
+    tmp_output = subprocess.run([sys.executable, os.path.join(REPO_ROOT, "curate_{}.py".format(ecosystem))],
+                                cwd = workdir, env = tmp_env, stdout = subprocess.PIPE, stderr = subprocess.STDOUT)
+    tmp_elapsed = time.monotonic() - tmp_start
+    tmp_after = server.stats()
+    with open(os.path.join(workdir, 'curation_log.txt'), 'ab') as tmp_log:
+        tmp_log.write(tmp_output.stdout)
+    tmp_report = {}
+    if os.path.isfile(tmp_env['curate_metrics_report']):
+        with open(tmp_env['curate_metrics_report'], 'r', encoding='utf-8') as tmp_file:
+            tmp_report = json.load(tmp_file)
+    tmp_requests = sum(tmp_after['requests'].values()) - sum(tmp_before['requests'].values())
+    return {
+        'ecosystem': ecosystem,
+        'returncode': tmp_output.returncode,
+        'elapsed': tmp_elapsed,
+        'requests': tmp_requests,
+        'requests_per_second': tmp_requests / tmp_elapsed if tmp_elapsed else 0.0,
+        'errors_injected': sum(tmp_after['errors'].values()) - sum(tmp_before['errors'].values()),
+        'copied': tmp_after['copied'],
+        'routes': dict((tmp_route, tmp_count - tmp_before['requests'].get(tmp_route, 0))
+                       for tmp_route, tmp_count in tmp_after['requests'].items()),
+        'stages': tmp_report.get('totals', {}),
+    }
+
+def log_result(input_label, input_result):
+    logging.info("%-8s %-34s %7.2fs %6d req %8.1f req/s %5d copied %4d injected  rc=%d", input_result['ecosystem'],
+                 input_label, input_result['elapsed'], input_result['requests'], input_result['requests_per_second'],
+                 input_result['copied'], input_result['errors_injected'], input_result['returncode'])
+    for tmp_stage, tmp_total in input_result['stages'].items():
+        logging.info("%-8s %-34s   %-8s %5d x %8.3fs total %7.3fs max %4d failed", '', '', tmp_stage,
+                     tmp_total['count'], tmp_total['duration'], tmp_total['duration_max'], tmp_total['failed'])
+
+### MAIN ###
+def main():
+    tmp_parser = argparse.ArgumentParser(
+        description = "Run the curators end to end against a mock Artifactory and compare wall clock and requests/sec"
+    )
+    tmp_parser.add_argument('ecosystems', nargs = '*', metavar = 'ECOSYSTEM', help = "any of {} (default: all)".format(", ".join(ECOSYSTEMS)))
+    tmp_parser.add_argument('--scale', choices = sorted(mock_fixtures.SCALES), default = 'small')
+    tmp_parser.add_argument('--repeat', type = int, default = 1, help = "cold runs per setting")
+    tmp_parser.add_argument('--warm', action = 'store_true',
+                            help = "follow each cold run with a rerun that keeps the ledger, caches and repo state")
+    tmp_parser.add_argument('--env', action = 'append', metavar = 'NAME=VALUE', help = "setting for every run")
+    tmp_parser.add_argument('--sweep', metavar = 'NAME=V1,V2,...', help = "compare the runs for each value")
+    tmp_parser.add_argument('--latency', type = float, default = 0.005, help = "seconds added to every response")
+    tmp_parser.add_argument('--jitter', type = float, default = 0.0, help = "up to this many more seconds, at random")
+    tmp_parser.add_argument('--error-rate', type = float, default = 0.0, help = "fraction of requests that fail")
+    tmp_parser.add_argument('--error-status', type = int, default = 503)
+    tmp_parser.add_argument('--retry-after', type = int, help = "Retry-After seconds sent with injected errors")
+    tmp_parser.add_argument('--error-routes', help = "comma separated routes errors are limited to, e.g. copy,aql")
+    tmp_parser.add_argument('--json', help = "also write every result to this file")
+    tmp_parser.add_argument('--keep', action = 'store_true', help = "keep the work directories (logs, reports)")
+    tmp_args = tmp_parser.parse_args()
+    logging.basicConfig(format = "%(message)s", level = logging.INFO)
+    for tmp_ecosystem in tmp_args.ecosystems:
+        if tmp_ecosystem not in ECOSYSTEMS:
+            tmp_parser.error("unknown ecosystem '{}'".format(tmp_ecosystem))
+
+    tmp_settings = [('default', {})]
+    if tmp_args.sweep:
+        tmp_name, _, tmp_values = tmp_args.sweep.partition('=')
+        tmp_settings = [("{}={}".format(tmp_name, tmp_value), {tmp_name: tmp_value}) for tmp_value in tmp_values.split(',')]
+    tmp_base_env = parse_assignments(tmp_args.env)
+    tmp_results = []
+    tmp_root = tempfile.mkdtemp(prefix = 'curation-bench-')
+    for tmp_ecosystem in tmp_args.ecosystems or ECOSYSTEMS:
+        tmp_content, tmp_scenario_env = mock_fixtures.build_scenario(tmp_ecosystem, tmp_args.scale)
+        logging.info("%s: %d files, %d manifests, %d index pages (%s)", tmp_ecosystem, len(tmp_content.files),
+                     len(tmp_content.manifests), len(tmp_content.simple), tmp_args.scale)
+        for tmp_label, tmp_setting in tmp_settings:
+            for tmp_run in range(tmp_args.repeat):
+                # A fresh server per cold run, so nothing is cached or curated yet.
+                tmp_server = StubArtifactoryServer(
+                    ('127.0.0.1', 0), tmp_args.latency, content = tmp_content, jitter = tmp_args.jitter,
+                    error_rate = tmp_args.error_rate, error_status = tmp_args.error_status,
+                    retry_after = tmp_args.retry_after,
+                    error_routes = tmp_args.error_routes.split(',') if tmp_args.error_routes else None, seed = tmp_run
+                )
+                tmp_server.start()
+                tmp_workdir = tempfile.mkdtemp(prefix = "{}-".format(tmp_ecosystem), dir = tmp_root)
+                tmp_env = dict(tmp_base_env)
+                tmp_env.update(tmp_setting)
+                tmp_phases = ['cold', 'warm'] if tmp_args.warm else ['cold']
+                for tmp_phase in tmp_phases:
+                    tmp_result = run_curator(tmp_ecosystem, tmp_server, tmp_scenario_env, tmp_workdir, tmp_env)
+                    tmp_result.update({'setting': tmp_label, 'run': tmp_run, 'phase': tmp_phase, 'workdir': tmp_workdir})
+                    log_result("{} #{} {}".format(tmp_label, tmp_run, tmp_phase), tmp_result)
+                    tmp_results.append(tmp_result)
+                tmp_server.shutdown()
+                tmp_server.server_close()
+    if tmp_args.json:
+        with open(tmp_args.json, 'w', encoding='utf-8') as tmp_file:
+            json.dump(tmp_results, tmp_file, indent = 2)
+    if tmp_args.keep:
+        logging.info("Work directories kept under %s", tmp_root)
+    else:
+        shutil.rmtree(tmp_root, ignore_errors = True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import base64
+import gzip
+import hashlib
+import io
+import json
+import zipfile
+
+### GLOBALS ###
+DOCKER_REMOTE = "bench-dockerhub"
+MAVEN_REMOTE = "demo-maven"
+PYPI_REMOTE = "bench-pypi"
+RPM_REMOTE = "bench-rpm"
+# Payload sizes per scale.  'small' is a quick smoke run, 'large' models the big images, deep Maven trees and long
+# requirement sets that the concurrency and caching work is measured on.
+SCALES = {
+    'small': {
+        'docker': {'images': 2, 'platforms': 2, 'layers': 5, 'shared_layers': 2, 'layer_size': 8 * 1024 * 1024},
+        'maven': {'depth': 3, 'width': 4, 'fanout': 2},
+        'pypi': {'projects': 12, 'requested': 4, 'fanout': 2},
+        'rpm': {'packages': 40, 'requested': 5, 'fanout': 3},
+    },
+    'large': {
+        'docker': {'images': 8, 'platforms': 4, 'layers': 30, 'shared_layers': 6, 'layer_size': 512 * 1024 * 1024},
+        'maven': {'depth': 8, 'width': 25, 'fanout': 4},
+        'pypi': {'projects': 300, 'requested': 120, 'fanout': 4},
+        'rpm': {'packages': 2000, 'requested': 150, 'fanout': 5},
+    },
+}
+DOCKER_MANIFEST_LIST_TYPE = "application/vnd.docker.distribution.manifest.list.v2+json"
+DOCKER_MANIFEST_TYPE = "application/vnd.docker.distribution.manifest.v2+json"
+DOCKER_PLATFORMS = [
+    {'os': 'linux', 'architecture': 'amd64'},
+    {'os': 'linux', 'architecture': 'arm64', 'variant': 'v8'},
+    {'os': 'linux', 'architecture': 'ppc64le'},
+    {'os': 'linux', 'architecture': 's390x'},
+]
+
+### FUNCTIONS ###
+def _digest(input_seed):
+    return "sha256:{}".format(hashlib.sha256(input_seed.encode()).hexdigest())
+
+def _artifact_digest(input_digest):
+    # Artifactory stores Docker blobs and manifests under 'sha256__<hex>'.
+    return "__".join(input_digest.split(':'))
+
+def _platform_string(input_platform):
+    return "/".join(input_platform[tmp_key] for tmp_key in ('os', 'architecture', 'variant') if tmp_key in input_platform)
+
+def docker_images(content, remote, images, platforms, layers, shared_layers, layer_size):
+    # Multi-platform images whose first shared_layers layers are the same base on every image, like images built
+    # FROM one base.  Returns the payload image names.
+    tmp_names = []
+    for tmp_idx in range(images):
+        tmp_image = "image-{}".format(tmp_idx)
+        tmp_list = {'schemaVersion': 2, 'mediaType': DOCKER_MANIFEST_LIST_TYPE, 'manifests': []}
+        for tmp_platform in DOCKER_PLATFORMS[:platforms]:
+            tmp_arch = _platform_string(tmp_platform)
+            tmp_layers = []
+            for tmp_layer in range(layers):
+                if tmp_layer < shared_layers:
+                    tmp_seed = "base/{}/{}".format(tmp_arch, tmp_layer)
+                else:
+                    tmp_seed = "{}/{}/{}".format(tmp_image, tmp_arch, tmp_layer)
+                tmp_layers.append({'mediaType': "application/vnd.docker.image.rootfs.diff.tar.gzip",
+                                   'digest': _digest(tmp_seed), 'size': layer_size})
+            tmp_config = {'mediaType': "application/vnd.docker.container.image.v1+json",
+                          'digest': _digest("{}/{}/config".format(tmp_image, tmp_arch)), 'size': 4096}
+            tmp_manifest = json.dumps({'schemaVersion': 2, 'mediaType': DOCKER_MANIFEST_TYPE,
+                                       'config': tmp_config, 'layers': tmp_layers}).encode()
+            tmp_sub_digest = "sha256:{}".format(hashlib.sha256(tmp_manifest).hexdigest())
+            tmp_list['manifests'].append({'mediaType': DOCKER_MANIFEST_TYPE, 'digest': tmp_sub_digest,
+                                          'size': len(tmp_manifest), 'platform': tmp_platform})
+            tmp_folder = "bench/{}/{}".format(tmp_image, _artifact_digest(tmp_sub_digest))
+            content.add_file(remote, "{}/manifest.json".format(tmp_folder), tmp_manifest)
+            for tmp_blob in [tmp_config] + tmp_layers:
+                content.add_file(remote, "{}/{}".format(tmp_folder, _artifact_digest(tmp_blob['digest'])), tmp_blob['size'])
+            content.add_manifest(remote, "bench/{}".format(tmp_image), tmp_sub_digest, DOCKER_MANIFEST_TYPE, tmp_manifest)
+        tmp_list_body = json.dumps(tmp_list).encode()
+        content.add_file(remote, "bench/{}/1.0/list.manifest.json".format(tmp_image), tmp_list_body)
+        content.add_manifest(remote, "bench/{}".format(tmp_image), '1.0', DOCKER_MANIFEST_LIST_TYPE, tmp_list_body)
+        tmp_names.append("bench.local/{}/bench/{}:1.0".format(remote, tmp_image))
+    return tmp_names
+
+def _pom(input_artifact, input_dependencies, input_packaging = 'jar', input_parent = True, input_managed = None):
+    tmp_lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+                 '<project xmlns="http://maven.apache.org/POM/4.0.0">',
+                 '  <modelVersion>4.0.0</modelVersion>']
+    if input_parent:
+        tmp_lines += ['  <parent>', '    <groupId>org.bench</groupId>', '    <artifactId>bench-parent</artifactId>',
+                      '    <version>1.0</version>', '  </parent>']
+    tmp_lines += ['  <groupId>org.bench</groupId>',
+                  '  <artifactId>{}</artifactId>'.format(input_artifact),
+                  '  <version>1.0</version>',
+                  '  <packaging>{}</packaging>'.format(input_packaging)]
+    if input_managed:
+        tmp_lines += ['  <dependencyManagement>', '    <dependencies>']
+        for tmp_dep in input_managed:
+            tmp_lines += ['      <dependency><groupId>org.bench</groupId><artifactId>{}</artifactId>'
+                          '<version>1.0</version></dependency>'.format(tmp_dep)]
+        tmp_lines += ['    </dependencies>', '  </dependencyManagement>']
+    if input_dependencies:
+        tmp_lines.append('  <dependencies>')
+        for tmp_dep, tmp_scope in input_dependencies:
+            tmp_lines.append('    <dependency><groupId>org.bench</groupId><artifactId>{}</artifactId>'
+                             '<scope>{}</scope></dependency>'.format(tmp_dep, tmp_scope))
+        tmp_lines.append('  </dependencies>')
+    tmp_lines.append('</project>')
+    return "\n".join(tmp_lines) + "\n"
+
+def maven_tree(content, remote, depth, width, fanout):
+    # A layered dependency graph, depth levels of width artifacts.  Every artifact depends on fanout artifacts of the
+    # next level, so most of them are reached through several paths (diamonds) and the resolver's mediation and POM
+    # memoization both get exercised.  Versions come from the parent's dependencyManagement.  Returns the pom.xml.
+    tmp_names = [["lib-{}-{}".format(tmp_level, tmp_idx) for tmp_idx in range(width)] for tmp_level in range(depth)]
+    tmp_all = [tmp_name for tmp_level in tmp_names for tmp_name in tmp_level]
+    content.add_file(remote, "org/bench/bench-parent/1.0/bench-parent-1.0.pom",
+                     _pom('bench-parent', [], 'pom', False, tmp_all).encode())
+    for tmp_level in range(depth):
+        for tmp_idx, tmp_name in enumerate(tmp_names[tmp_level]):
+            tmp_deps = []
+            if tmp_level + 1 < depth:
+                for tmp_step in range(fanout):
+                    tmp_deps.append((tmp_names[tmp_level + 1][(tmp_idx * fanout + tmp_step) % width],
+                                     'runtime' if tmp_step % 3 == 2 else 'compile'))
+            tmp_folder = "org/bench/{}/1.0".format(tmp_name)
+            content.add_file(remote, "{}/{}-1.0.pom".format(tmp_folder, tmp_name), _pom(tmp_name, tmp_deps).encode())
+            content.add_file(remote, "{}/{}-1.0.jar".format(tmp_folder, tmp_name), 64 * 1024 * (1 + tmp_idx % 8))
+    tmp_root = _pom('bench-app', [(tmp_name, 'compile') for tmp_name in tmp_names[0]], 'jar', True)
+    return tmp_root
+
+def _wheel(input_name, input_version, input_requires):
+    tmp_dist_info = "{}-{}.dist-info".format(input_name, input_version)
+    tmp_metadata = "Metadata-Version: 2.1\nName: {}\nVersion: {}\n".format(input_name, input_version)
+    for tmp_requirement in input_requires:
+        tmp_metadata += "Requires-Dist: {}\n".format(tmp_requirement)
+    tmp_buffer = io.BytesIO()
+    with zipfile.ZipFile(tmp_buffer, 'w') as tmp_zip:
+        tmp_zip.writestr("{}/__init__.py".format(input_name), "")
+        tmp_zip.writestr("{}/METADATA".format(tmp_dist_info), tmp_metadata)
+        tmp_zip.writestr("{}/WHEEL".format(tmp_dist_info),
+                         "Wheel-Version: 1.0\nGenerator: bench\nRoot-Is-Purelib: true\nTag: py3-none-any\n")
+        tmp_zip.writestr("{}/RECORD".format(tmp_dist_info), "")
+    return tmp_buffer.getvalue()
+
+def pypi_projects(content, remote, projects, requested, fanout):
+    # Pure-python wheels where project i requires fanout of the projects after it, so a requirement set of the
+    # first 'requested' projects resolves to most of the index.  Returns the requirement lines.
+    tmp_names = ["benchpkg{}".format(tmp_idx) for tmp_idx in range(projects)]
+    for tmp_idx, tmp_name in enumerate(tmp_names):
+        tmp_requires = ["{}>=1.0".format(tmp_names[tmp_dep]) for tmp_dep in range(tmp_idx + 1, min(projects, tmp_idx + 1 + fanout))]
+        tmp_file = "{}-1.0-py3-none-any.whl".format(tmp_name)
+        tmp_body = _wheel(tmp_name, '1.0', tmp_requires)
+        tmp_hash = hashlib.sha256(tmp_body).hexdigest()
+        # Same packages/<aa>/<bb>/<rest of the hash>/<file> layout as files.pythonhosted.org.
+        tmp_path = "{}/{}/{}/{}".format(tmp_hash[0:2], tmp_hash[2:4], tmp_hash[4:], tmp_file)
+        content.add_file(remote, tmp_path, tmp_body)
+        content.add_simple(remote, tmp_name, '<a href="../../packages/packages/{}#sha256={}">{}</a>'.format(tmp_path, tmp_hash, tmp_file))
+    return ["{}>=1.0".format(tmp_name) for tmp_name in tmp_names[:requested]]
+
+def _primary(input_packages):
+    tmp_parts = ['<?xml version="1.0"?><metadata xmlns="http://linux.duke.edu/metadata/common" '
+                 'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="{}">'.format(len(input_packages))]
+    for tmp_name, tmp_release, tmp_requires in input_packages:
+        tmp_parts.append(
+            '<package type="rpm"><name>{0}</name><arch>x86_64</arch><version epoch="0" ver="1.0" rel="{1}"/>'
+            '<location href="Packages/{0}-1.0-{1}.x86_64.rpm"/><format><rpm:provides>'
+            '<rpm:entry name="{0}" flags="EQ" epoch="0" ver="1.0" rel="{1}"/>'
+            '<rpm:entry name="lib{0}.so.1()(64bit)"/></rpm:provides><rpm:requires>'.format(tmp_name, tmp_release)
+        )
+        for tmp_require in tmp_requires:
+            tmp_parts.append('<rpm:entry name="lib{}.so.1()(64bit)"/>'.format(tmp_require))
+        tmp_parts.append('</rpm:requires></format></package>')
+    tmp_parts.append('</metadata>')
+    return gzip.compress("".join(tmp_parts).encode())
+
+def rpm_repo(content, remote, packages, requested, fanout, releasever = '7', basearch = 'x86_64'):
+    # An 'os' section with every package at release 1 and an 'updates' section that rebuilds every fifth one, each
+    # package requiring sonames of fanout later packages.  Returns the requested package names.
+    tmp_names = ["benchrpm{}".format(tmp_idx) for tmp_idx in range(packages)]
+    tmp_requires = dict(
+        (tmp_name, [tmp_names[tmp_dep] for tmp_dep in range(tmp_idx + 1, min(packages, tmp_idx + 1 + fanout))])
+        for tmp_idx, tmp_name in enumerate(tmp_names)
+    )
+    tmp_sections = {
+        'os': [(tmp_name, '1.el7', tmp_requires[tmp_name]) for tmp_name in tmp_names],
+        'updates': [(tmp_name, '2.el7', tmp_requires[tmp_name]) for tmp_name in tmp_names[::5]],
+        'extras': [],
+    }
+    for tmp_section, tmp_packages in tmp_sections.items():
+        tmp_prefix = "{}/{}/{}".format(releasever, tmp_section, basearch)
+        tmp_primary = _primary(tmp_packages)
+        tmp_primary_name = "{}-primary.xml.gz".format(hashlib.sha256(tmp_primary).hexdigest())
+        content.add_file(remote, "{}/repodata/{}".format(tmp_prefix, tmp_primary_name), tmp_primary)
+        content.add_file(remote, "{}/repodata/repomd.xml".format(tmp_prefix), (
+            '<?xml version="1.0"?><repomd xmlns="http://linux.duke.edu/metadata/repo"><data type="primary">'
+            '<location href="repodata/{}"/></data></repomd>'.format(tmp_primary_name)
+        ).encode())
+        for tmp_name, tmp_release, _ in tmp_packages:
+            content.add_file(remote, "{}/Packages/{}-1.0-{}.x86_64.rpm".format(tmp_prefix, tmp_name, tmp_release), 2 * 1024 * 1024)
+    return tmp_names[:requested]
+
+def build_scenario(ecosystem, scale):
+    # (content, environment) for one curator run: the environment carries the repos and the payload.
+    tmp_content = MockContent()
+    tmp_params = SCALES[scale][ecosystem]
+    if ecosystem == 'docker':
+        tmp_images = docker_images(tmp_content, DOCKER_REMOTE, **tmp_params)
+        tmp_platforms = [_platform_string(tmp_platform) for tmp_platform in DOCKER_PLATFORMS[:tmp_params['platforms']]]
+        return tmp_content, {
+            'res_curatedocker_payload': json.dumps({'images': tmp_images, 'platforms': tmp_platforms}),
+            'curate_docker_pull_mode': 'registry',
+        }
+    if ecosystem == 'maven':
+        tmp_pom = maven_tree(tmp_content, MAVEN_REMOTE, **tmp_params)
+        return tmp_content, {
+            'res_curatemaven_payload': json.dumps({'pomdata': base64.b64encode(tmp_pom.encode()).decode()}),
+            'curate_maven_resolver': 'python',
+        }
+    if ecosystem == 'pypi':
+        tmp_lines = pypi_projects(tmp_content, PYPI_REMOTE, **tmp_params)
+        return tmp_content, {
+            'res_curatepypi_payload': json.dumps({'packages': tmp_lines}),
+            'local_repo_name': "{}-local".format(PYPI_REMOTE), 'remote_repo_name': PYPI_REMOTE,
+        }
+    if ecosystem == 'rpm':
+        tmp_packages = rpm_repo(tmp_content, RPM_REMOTE, **tmp_params)
+        return tmp_content, {
+            'res_curaterpm_payload': json.dumps({'packages': tmp_packages}),
+            'local_repo_name': "{}-local".format(RPM_REMOTE), 'remote_repo_name': RPM_REMOTE,
+            'curate_rpm_resolver': 'repodata',
+        }
+    raise ValueError("Unknown ecosystem '{}'".format(ecosystem))
+
+### CLASSES ###
+class MockContent:
+    # What the remote repos hold.  A file is either its body or, for large blobs that are only ever streamed, just
+    # its size.
+    def __init__(self):
+        self.files = {}
+        self.manifests = {}
+        self.simple = {}
+
+    def add_file(self, input_repo, input_path, input_body):
+        self.files[(input_repo, input_path)] = input_body
+
+    def add_manifest(self, input_repo, input_image, input_reference, input_media_type, input_body):
+        self.manifests[(input_repo, input_image, input_reference)] = (input_media_type, input_body)
+
+    def add_simple(self, input_repo, input_project, input_link):
+        self.simple.setdefault((input_repo, input_project), []).append(input_link)
+
+    def size(self, input_repo, input_path):
+        tmp_body = self.files.get((input_repo, input_path))
+        if tmp_body is None:
+            return None
+        return tmp_body if isinstance(tmp_body, int) else len(tmp_body)
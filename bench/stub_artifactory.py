@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import argparse
+import hashlib
+import http.server
+import json
+import logging
+import random
+import threading
+import time
+import urllib.parse
+
+import mock_fixtures
+
+### GLOBALS ###
+# Chunk size used to stream blobs that are only modelled by their size.
+STREAM_CHUNK_SIZE = 64 * 1024
+
+### FUNCTIONS ###
+def _aql_terms(input_query):
+    # The items.find() criteria of an AQL query as sent by ArtifactoryClient.find_existing().
+    tmp_start = input_query.index('items.find(') + len('items.find(')
+    tmp_end = input_query.rindex(').include(') if ').include(' in input_query else input_query.rindex(')')
+    return json.loads(input_query[tmp_start:tmp_end])
+
+### CLASSES ###
+class StubArtifactoryHandler(http.server.BaseHTTPRequestHandler):
+    # Keep-alive is only honoured by BaseHTTPRequestHandler for HTTP/1.1.
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so without this every keep-alive response waits on delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.getLogger(type(self).__name__).debug(format, *args)
+
+    def _reply(self, status, body = b'', content_type = 'application/octet-stream', headers = None):
+        # body is the bytes to send, or the size of a blob that is streamed as zeros.
+        time.sleep(self.server.delay())
+        tmp_size = body if isinstance(body, int) else len(body)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(tmp_size))
+        for tmp_name, tmp_value in (headers or {}).items():
+            self.send_header(tmp_name, tmp_value)
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        if isinstance(body, int):
+            tmp_chunk = b'\0' * STREAM_CHUNK_SIZE
+            for tmp_offset in range(0, body, STREAM_CHUNK_SIZE):
+                self.wfile.write(tmp_chunk[:min(STREAM_CHUNK_SIZE, body - tmp_offset)])
+        else:
+            self.wfile.write(body)
+        self.server.count_bytes(tmp_size)
+
+    def _drain(self):
+        tmp_length = int(self.headers.get('Content-Length', 0) or 0)
+        if tmp_length:
+            return self.rfile.read(tmp_length)
+        return b''
+
+    def _split(self):
+        # (path under /artifactory/ with the query removed and unquoted, query parameters)
+        tmp_url = urllib.parse.urlsplit(self.path)
+        tmp_path = urllib.parse.unquote(tmp_url.path)
+        if tmp_path.startswith('/artifactory/'):
+            tmp_path = tmp_path[len('/artifactory/'):]
+        return tmp_path.lstrip('/'), urllib.parse.parse_qs(tmp_url.query)
+
+    def _route(self, input_path):
+        # Request class used for the per-route counters and to target error injection.
+        if input_path.startswith('api/copy/'):
+            return 'copy'
+        if input_path.startswith('api/search/aql'):
+            return 'aql'
+        if input_path.startswith('api/docker/'):
+            return 'registry'
+        if input_path.startswith('api/pypi/'):
+            return 'pypi-index' if '/simple/' in input_path else 'pypi-file'
+        if '/repodata/' in input_path:
+            return 'repodata'
+        if input_path.endswith('manifest.json'):
+            return 'manifest'
+        return 'storage'
+
+    def _inject_error(self, input_route):
+        tmp_error = self.server.error_for(input_route)
+        if tmp_error is None:
+            return False
+        self._drain()
+        tmp_headers = {}
+        if self.server.retry_after is not None:
+            tmp_headers['Retry-After'] = str(self.server.retry_after)
+        self._reply(tmp_error, b'{"errors":[{"status":%d,"message":"injected"}]}' % tmp_error,
+                    'application/json', tmp_headers)
+        return True
+
+    def _handle(self):
+        tmp_path, tmp_query = self._split()
+        tmp_route = self._route(tmp_path)
+        self.server.count_request(tmp_route)
+        if self._inject_error(tmp_route):
+            return
+        if self.command == 'POST':
+            tmp_body = self._drain()
+            if tmp_route == 'copy':
+                return self._copy(tmp_path[len('api/copy/'):], tmp_query.get('to', [''])[0])
+            if tmp_route == 'aql':
+                return self._aql(tmp_body.decode())
+            return self._reply(200, b'{"messages":[]}', 'application/json')
+        if self.command == 'PUT':
+            self._drain()
+            return self._reply(201)
+        if tmp_route == 'registry':
+            return self._registry(tmp_path)
+        if tmp_route == 'pypi-index':
+            return self._pypi_index(tmp_path)
+        if tmp_route == 'pypi-file':
+            tmp_repo, _, tmp_file = tmp_path[len('api/pypi/'):].partition('/packages/packages/')
+            return self._storage(tmp_repo, tmp_file)
+        tmp_repo, _, tmp_file = tmp_path.partition('/')
+        return self._storage(tmp_repo, tmp_file)
+
+    def _storage(self, input_repo, input_path):
+        tmp_body = self.server.lookup(input_repo, input_path, input_warm = True)
+        if tmp_body is None:
+            return self._reply(404, b'{"errors":[{"status":404,"message":"Not Found"}]}', 'application/json')
+        tmp_type = 'application/json' if input_path.endswith('.json') else 'application/octet-stream'
+        if isinstance(tmp_body, int):
+            return self._reply(200, tmp_body, tmp_type)
+        # Artifactory uses the file's SHA-1 as its ETag and answers a matching If-None-Match with '304'.
+        tmp_etag = hashlib.sha1(tmp_body).hexdigest()
+        if self.headers.get('If-None-Match') == tmp_etag:
+            return self._reply(304, b'', tmp_type, {'ETag': tmp_etag})
+        return self._reply(200, tmp_body, tmp_type, {'ETag': tmp_etag})
+
+    def _registry(self, input_path):
+        # api/docker/<repo>/v2/<image>/(manifests|blobs)/<reference>
+        tmp_parts = input_path.split('/')
+        tmp_repo, tmp_kind, tmp_reference = tmp_parts[2], tmp_parts[-2], tmp_parts[-1]
+        tmp_image = "/".join(tmp_parts[4:-2])
+        if tmp_kind == 'manifests':
+            tmp_manifest = self.server.content.manifests.get((tmp_repo, tmp_image, tmp_reference))
+            if tmp_manifest is None:
+                return self._reply(404, b'{"errors":[{"code":"MANIFEST_UNKNOWN"}]}', 'application/json')
+            return self._reply(200, tmp_manifest[1], tmp_manifest[0])
+        tmp_size = self.server.warm_blob(tmp_repo, tmp_image, tmp_reference)
+        if tmp_size is None:
+            return self._reply(404, b'{"errors":[{"code":"BLOB_UNKNOWN"}]}', 'application/json')
+        return self._reply(200, tmp_size)
+
+    def _pypi_index(self, input_path):
+        # api/pypi/<repo>/simple/<project>/
+        tmp_repo, _, tmp_project = input_path[len('api/pypi/'):].partition('/simple/')
+        tmp_links = self.server.content.simple.get((tmp_repo, tmp_project.strip('/')))
+        if tmp_links is None:
+            return self._reply(404, b'Not Found', 'text/plain')
+        tmp_html = "<html><body>{}</body></html>".format("<br/>".join(tmp_links))
+        return self._reply(200, tmp_html.encode(), 'text/html')
+
+    def _copy(self, input_from, input_to):
+        tmp_from_repo, _, tmp_from_path = input_from.partition('/')
+        tmp_to_repo, _, tmp_to_path = input_to.lstrip('/').partition('/')
+        if not self.server.copy(tmp_from_repo, tmp_from_path, tmp_to_repo, tmp_to_path):
+            return self._reply(404, b'{"errors":[{"status":404,"message":"Could not find the source item"}]}',
+                               'application/json')
+        return self._reply(200, b'{"messages":[{"level":"INFO","message":"copying completed successfully"}]}',
+                           'application/json')
+
+    def _aql(self, input_query):
+        tmp_criteria = _aql_terms(input_query)
+        tmp_repo = tmp_criteria['repo']
+        tmp_results = []
+        for tmp_term in tmp_criteria.get('$or', []):
+            tmp_dir, tmp_name = tmp_term['$and'][0]['path'], tmp_term['$and'][1]['name']
+            tmp_path = tmp_name if tmp_dir == '.' else "{}/{}".format(tmp_dir, tmp_name)
+            if self.server.lookup(tmp_repo, tmp_path) is not None:
+                tmp_results.append({'repo': tmp_repo, 'path': tmp_dir, 'name': tmp_name})
+        return self._reply(200, json.dumps({'results': tmp_results}).encode(), 'application/json')
+
+    def do_GET(self):
+        if self.server.content is None:
+            return self._reply(200, b'x' * self.server.body_size)
+        self._handle()
+
+    def do_HEAD(self):
+        if self.server.content is None:
+            return self._reply(200)
+        self._handle()
+
+    def do_PUT(self):
+        if self.server.content is None:
+            self._drain()
+            return self._reply(201)
+        self._handle()
+
+    def do_DELETE(self):
+        if self.server.content is None:
+            return self._reply(204)
+        tmp_path, _ = self._split()
+        self.server.count_request('delete')
+        tmp_repo, _, tmp_file = tmp_path.partition('/')
+        if not self.server.delete(tmp_repo, tmp_file):
+            return self._reply(404, b'{"errors":[{"status":404,"message":"Not Found"}]}', 'application/json')
+        return self._reply(204)
+
+    def do_POST(self):
+        if self.server.content is None:
+            self._drain()
+            return self._reply(200, b'{"messages":[]}')
+        self._handle()
+
+class StubArtifactoryServer(http.server.ThreadingHTTPServer):
+    # Without content every GET returns body_size bytes and every copy succeeds.  With a mock_fixtures.MockContent
+    # the server models a remote repo (what content holds), its '-cache' (what has been pulled through the remote
+    # so far) and the local repos (what has been copied), which is enough for the curators to run end to end.
+    daemon_threads = True
+
+    def __init__(self, address, latency = 0.0, body_size = 1024, content = None, jitter = 0.0, error_rate = 0.0,
+                 error_status = 503, retry_after = None, error_routes = None, seed = 0):
+        super().__init__(address, StubArtifactoryHandler)
+        self.latency = latency
+        self.body_size = body_size
+        self.content = content
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.error_routes = set(error_routes) if error_routes else None
+        self.requests = {}
+        self.errors = {}
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._cached = set()
+        self._copied = {}
+        self._blobs = {}
+        if content is not None:
+            for tmp_repo, tmp_path in content.files:
+                tmp_name = tmp_path.rpartition('/')[2]
+                if tmp_name.startswith('sha256__'):
+                    self._blobs.setdefault((tmp_repo, tmp_name), []).append(tmp_path)
+
+    @property
+    def url(self):
+        return "http://{}:{}/artifactory".format(self.server_address[0], self.server_address[1])
+
+    def start(self):
+        tmp_thread = threading.Thread(target = self.serve_forever, daemon = True)
+        tmp_thread.start()
+        return tmp_thread
+
+    def delay(self):
+        if not self.jitter:
+            return self.latency
+        with self._lock:
+            return self.latency + self._random.uniform(0, self.jitter)
+
+    def error_for(self, input_route):
+        if not self.error_rate or (self.error_routes is not None and input_route not in self.error_routes):
+            return None
+        with self._lock:
+            if self._random.random() >= self.error_rate:
+                return None
+            self.errors[input_route] = self.errors.get(input_route, 0) + 1
+        return self.error_status
+
+    def count_request(self, input_route):
+        with self._lock:
+            self.requests[input_route] = self.requests.get(input_route, 0) + 1
+
+    def count_bytes(self, input_size):
+        with self._lock:
+            self.bytes_sent += input_size
+
+    def lookup(self, input_repo, input_path, input_warm = False):
+        # The body (or size) of a file, None when the repo doesn't have it.  input_warm models a GET on a remote,
+        # which caches the file in the remote's '-cache'.
+        input_path = input_path.strip('/')
+        if input_repo.endswith('-cache'):
+            if (input_repo[:-len('-cache')], input_path) in self._cached:
+                return self.content.files[(input_repo[:-len('-cache')], input_path)]
+            return None
+        tmp_body = self.content.files.get((input_repo, input_path))
+        if tmp_body is not None:
+            if input_warm:
+                with self._lock:
+                    self._cached.add((input_repo, input_path))
+            return tmp_body
+        return self._copied.get((input_repo, input_path))
+
+    def warm_blob(self, input_repo, input_image, input_digest):
+        tmp_paths = [tmp_path for tmp_path in self._blobs.get((input_repo, "__".join(input_digest.split(':'))), [])
+                     if tmp_path.startswith(input_image + '/')]
+        if not tmp_paths:
+            return None
+        with self._lock:
+            self._cached.update((input_repo, tmp_path) for tmp_path in tmp_paths)
+        return self.content.size(input_repo, tmp_paths[0])
+
+    def copy(self, input_from_repo, input_from_path, input_to_repo, input_to_path):
+        # A file, or every file under a folder.
+        input_from_path = input_from_path.strip('/')
+        input_to_path = input_to_path.strip('/')
+        tmp_body = self.lookup(input_from_repo, input_from_path)
+        if tmp_body is not None:
+            with self._lock:
+                self._copied[(input_to_repo, input_to_path)] = tmp_body
+            return True
+        tmp_prefix = input_from_path + '/'
+        with self._lock:
+            tmp_paths = set(tmp_path for tmp_repo, tmp_path in list(self.content.files) + list(self._copied)
+                            if tmp_repo == input_from_repo and tmp_path.startswith(tmp_prefix))
+        tmp_files = [(tmp_path, self.lookup(input_from_repo, tmp_path)) for tmp_path in sorted(tmp_paths)]
+        tmp_files = [(tmp_path, tmp_body) for tmp_path, tmp_body in tmp_files if tmp_body is not None]
+        if not tmp_files:
+            return False
+        with self._lock:
+            for tmp_path, tmp_body in tmp_files:
+                self._copied[(input_to_repo, input_to_path + tmp_path[len(input_from_path):])] = tmp_body
+        return True
+
+    def delete(self, input_repo, input_path):
+        # Only what has been copied into a local repo can be deleted.
+        with self._lock:
+            return self._copied.pop((input_repo, input_path.strip('/')), None) is not None
+
+    def copied(self):
+        with self._lock:
+            return len(self._copied)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': dict(self.requests), 'errors': dict(self.errors), 'bytes_sent': self.bytes_sent,
+                    'copied': len(self._copied), 'cached': len(self._cached)}
+
+### MAIN ###
+def main():
+    tmp_parser = argparse.ArgumentParser(description = "Serve a minimal stub of the Artifactory REST API")
+    tmp_parser.add_argument('--port', type = int, default = 8081)
+    tmp_parser.add_argument('--latency', type = float, default = 0.0, help = "seconds added to every response")
+    tmp_parser.add_argument('--jitter', type = float, default = 0.0, help = "up to this many more seconds, at random")
+    tmp_parser.add_argument('--body-size', type = int, default = 1024)
+    tmp_parser.add_argument('--scenario', choices = ['docker', 'maven', 'pypi', 'rpm'],
+                            help = "serve the mock repos of a benchmark scenario instead of fixed bodies")
+    tmp_parser.add_argument('--scale', choices = ['small', 'large'], default = 'small')
+    tmp_parser.add_argument('--error-rate', type = float, default = 0.0, help = "fraction of requests that fail")
+    tmp_parser.add_argument('--error-status', type = int, default = 503)
+    tmp_parser.add_argument('--retry-after', type = int, help = "Retry-After seconds sent with injected errors")
+    tmp_parser.add_argument('--error-routes', help = "comma separated routes errors are limited to, e.g. copy,aql")
+    tmp_args = tmp_parser.parse_args()
+    logging.basicConfig(
+        format = "%(asctime)s:%(levelname)s:%(name)s:%(funcName)s: %(message)s",
+        level = logging.INFO
+    )
+    tmp_content = None
+    if tmp_args.scenario:
+        tmp_content, tmp_env = mock_fixtures.build_scenario(tmp_args.scenario, tmp_args.scale)
+        for tmp_name, tmp_value in sorted(tmp_env.items()):
+            logging.info("  %s=%s", tmp_name, tmp_value if len(tmp_value) < 200 else tmp_value[:200] + '...')
+    tmp_server = StubArtifactoryServer(
+        ('127.0.0.1', tmp_args.port), tmp_args.latency, tmp_args.body_size, tmp_content, tmp_args.jitter,
+        tmp_args.error_rate, tmp_args.error_status, tmp_args.retry_after,
+        tmp_args.error_routes.split(',') if tmp_args.error_routes else None
+    )
+    logging.info("Stub Artifactory listening on %s", tmp_server.url)
+    tmp_server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import concurrent.futures
+import logging
+import os
+import threading
+import time
+
+import curation_ledger
+import curation_metrics
+
+### GLOBALS ###
+# Upper bound on the number of copy requests in flight against Artifactory at once.
+DEFAULT_MAX_IN_FLIGHT = int(os.environ.get('curate_copy_workers', '8'))
+# Artifacts parsed from a resolver's output while it runs are handed on in groups of this many, or once the oldest
+# has waited this long, so copies start before the resolver exits and each group still costs one existence check.
+STREAM_FLUSH_SIZE = int(os.environ.get('curate_stream_flush_size', '20'))
+STREAM_FLUSH_SECONDS = float(os.environ.get('curate_stream_flush_seconds', '1'))
+
+_SCHEDULERS = {}
+_SCHEDULERS_LOCK = threading.Lock()
+
+### FUNCTIONS ###
+def get_scheduler(client, max_in_flight = DEFAULT_MAX_IN_FLIGHT):
+    with _SCHEDULERS_LOCK:
+        if id(client) not in _SCHEDULERS:
+            _SCHEDULERS[id(client)] = CopyScheduler(client, max_in_flight)
+        return _SCHEDULERS[id(client)]
+
+def present_future(input_from, input_to):
+    # An already-completed copy for a target that the existence check found in the local repo.
+    tmp_future = concurrent.futures.Future()
+    tmp_future.set_result(CopyResult(input_from, input_to, None, present = True))
+    return tmp_future
+
+def split_present(client, input_repo, input_paths):
+    # Plan a copy stage: (already present, still to copy), from one batched lookup against the local repo.
+    with curation_metrics.stage('plan', input_repo) as tmp_stage:
+        tmp_present = client.find_existing(input_repo, input_paths)
+        if tmp_present is None:
+            tmp_stage.fail("lookup failed")
+    if tmp_present is None:
+        return [], list(input_paths)
+    return ([tmp_path for tmp_path in input_paths if tmp_path.strip('/') in tmp_present],
+            [tmp_path for tmp_path in input_paths if tmp_path.strip('/') not in tmp_present])
+
+### CLASSES ###
+class CopyResult:
+    def __init__(self, from_path, to_path, response, present = False):
+        self.from_path = from_path
+        self.to_path = to_path
+        self.response = response
+        # Set when the target was found by the pre-copy existence check, so no copy request was sent.
+        self.present = present
+
+    @property
+    def status(self):
+        return None if self.present else self.response.status
+
+    @property
+    def copied(self):
+        return not self.present and self.response.ok
+
+    @property
+    def conflict(self):
+        return self.present or self.response.conflict
+
+    @property
+    def ok(self):
+        # A '409: Conflict' means the target is already curated, which is the outcome the copy was after.
+        return self.present or self.response.ok or self.response.conflict
+
+    @property
+    def error(self):
+        if self.ok:
+            return None
+        return self.response.error or "{} {}".format(self.response.status, self.response.text())
+
+    def __repr__(self):
+        if self.present:
+            return "<CopyResult {} already present>".format(self.to_path)
+        return "<CopyResult {} -> {} status={}>".format(self.from_path, self.to_path, self.status)
+
+class CopyScheduler:
+    def __init__(self, client, max_in_flight = DEFAULT_MAX_IN_FLIGHT):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.client = client
+        self.max_in_flight = max(1, max_in_flight)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers = self.max_in_flight, thread_name_prefix = 'copy'
+        )
+        self.logger.debug("CopyScheduler with max_in_flight: %d", self.max_in_flight)
+
+    def _copy(self, input_from, input_to, input_warm = None):
+        if input_warm is not None:
+            # Pull the file through the remote repo first so its cache has something to copy from.
+            with curation_metrics.stage('warm', input_warm) as tmp_stage:
+                tmp_response = self.client.fetch(input_warm)
+                if not tmp_response.ok:
+                    tmp_stage.fail(tmp_response.error or tmp_response.status)
+            if not tmp_response.ok:
+                return CopyResult(input_from, input_to, tmp_response)
+        with curation_metrics.stage('copy', input_to) as tmp_stage:
+            tmp_result = CopyResult(input_from, input_to, self.client.copy(input_from, input_to))
+            if not tmp_result.ok:
+                tmp_stage.fail(tmp_result.error)
+        return tmp_result
+
+    def submit(self, input_from, input_to, input_warm = None):
+        return self._executor.submit(self._copy, input_from, input_to, input_warm)
+
+    def submit_call(self, func, *args, **kwargs):
+        # For other requests (e.g. manifest GETs) that should share the same in-flight limit as the copies.
+        return self._executor.submit(func, *args, **kwargs)
+
+    def copy_all(self, input_pairs):
+        tmp_futures = [self.submit(tmp_from, tmp_to) for tmp_from, tmp_to in input_pairs]
+        return [tmp_future.result() for tmp_future in tmp_futures]
+
+    def shutdown(self):
+        self._executor.shutdown(wait = True)
+
+class CopyBatch:
+    # The copies scheduled by one puller.  Scheduling returns immediately so the puller can move on (e.g. to the
+    # next package's resolution) while the copies run, and collect() waits for them and keeps every outcome.
+    def __init__(self, scheduler, ecosystem = None):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.scheduler = scheduler
+        # With an ecosystem, every outcome is written to the curation ledger as it completes, and add_paths() checks
+        # the ledger before the local repo.
+        self.ecosystem = ecosystem
+        self.ledger = curation_ledger.get_ledger() if ecosystem is not None else None
+        self.results = {}
+        self._futures = []
+
+    def _record(self, input_future):
+        tmp_result = input_future.result()
+        self.ledger.record_copy(self.ecosystem, tmp_result.to_path, tmp_result.ok)
+
+    def _track(self, input_key, input_future, input_record = True):
+        if self.ledger is not None and input_record:
+            input_future.add_done_callback(self._record)
+        self._futures.append((input_key, input_future))
+
+    def add(self, input_from, input_to, input_key = None, input_warm = None):
+        self._track(input_key if input_key is not None else input_to, self.scheduler.submit(input_from, input_to, input_warm))
+
+    def add_present(self, input_from, input_to, input_key = None, input_record = True):
+        # NOTE: Paths found through the ledger aren't recorded again, so their entries still expire.
+        self._track(input_key if input_key is not None else input_to, present_future(input_from, input_to), input_record)
+
+    def add_paths(self, input_from_repo, input_to_repo, input_paths, input_warm_repo = None):
+        # Copy each path between two repos, keyed by the path.  One batched lookup first finds the paths that are
+        # already in the target repo, and those are recorded as present without sending a copy.
+        # With input_warm_repo (a remote whose cache is input_from_repo), paths that aren't cached yet are pulled
+        # through the remote right before their copy.
+        tmp_recorded = set()
+        if self.ledger is not None:
+            tmp_recorded = self.ledger.copied(
+                self.ecosystem, ["{}/{}".format(input_to_repo, tmp_path) for tmp_path in input_paths]
+            )
+            self.logger.info("  %d of %d files recorded as curated in the ledger", len(tmp_recorded), len(input_paths))
+        tmp_unrecorded = []
+        for tmp_path in input_paths:
+            tmp_to = "{}/{}".format(input_to_repo, tmp_path)
+            if tmp_to in tmp_recorded:
+                self.add_present("{}/{}".format(input_from_repo, tmp_path), tmp_to, tmp_path, False)
+            else:
+                tmp_unrecorded.append(tmp_path)
+        tmp_present, tmp_missing = split_present(self.scheduler.client, input_to_repo, tmp_unrecorded)
+        self.logger.info("  %d of %d files already present in '%s'", len(tmp_present), len(tmp_unrecorded), input_to_repo)
+        tmp_cold = set()
+        if input_warm_repo is not None and tmp_missing:
+            tmp_cold = set(split_present(self.scheduler.client, input_from_repo, tmp_missing)[1])
+            self.logger.info("  %d of %d files to pull through '%s'", len(tmp_cold), len(tmp_missing), input_warm_repo)
+        for tmp_path in tmp_present:
+            self.add_present("{}/{}".format(input_from_repo, tmp_path), "{}/{}".format(input_to_repo, tmp_path), tmp_path)
+        for tmp_path in tmp_missing:
+            self.add("{}/{}".format(input_from_repo, tmp_path), "{}/{}".format(input_to_repo, tmp_path), tmp_path,
+                     "{}/{}".format(input_warm_repo, tmp_path) if tmp_path in tmp_cold else None)
+
+    def collect(self):
+        for tmp_key, tmp_future in self._futures:
+            tmp_result = tmp_future.result()
+            self.results[tmp_key] = tmp_result
+            if tmp_result.copied:
+                self.logger.debug("  Successfully copied: %s", tmp_key)
+            elif tmp_result.conflict:
+                self.logger.debug("  Already curated: %s", tmp_key)
+            else:
+                self.logger.warning("Failed to copy '%s' with error: %s", tmp_key, tmp_result.error)
+        self._futures = []
+        return self.results
+
+    @property
+    def failures(self):
+        return [tmp_key for tmp_key, tmp_result in self.results.items() if not tmp_result.ok]
+
+class StreamBatcher:
+    # Collects the artifacts a running resolver reports and calls flush_func with each new group of them.  Artifacts
+    # already seen are dropped, so the full list can be passed in again once the resolver has finished.
+    def __init__(self, flush_func, flush_size = STREAM_FLUSH_SIZE, flush_seconds = STREAM_FLUSH_SECONDS):
+        self.flush_func = flush_func
+        self.flush_size = max(1, flush_size)
+        self.flush_seconds = flush_seconds
+        self.items = []
+        self._seen = set()
+        self._pending = []
+        self._since = None
+
+    def _queue(self, input_item):
+        if input_item in self._seen:
+            return
+        self._seen.add(input_item)
+        self.items.append(input_item)
+        self._pending.append(input_item)
+        if self._since is None:
+            self._since = time.monotonic()
+
+    def add(self, input_item):
+        self._queue(input_item)
+        self.poll()
+
+    def poll(self):
+        # Also called for output lines that don't name an artifact, so a group doesn't wait on the next artifact.
+        if self._pending and (len(self._pending) >= self.flush_size or time.monotonic() - self._since >= self.flush_seconds):
+            self.flush()
+
+    def extend(self, input_items):
+        # Everything not seen yet goes out as one group.
+        for tmp_item in input_items:
+            self._queue(tmp_item)
+        self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        tmp_pending = self._pending
+        self._pending = []
+        self._since = None
+        self.flush_func(tmp_pending)
@@ -2,11 +2,21 @@
 
 ### IMPORTS ###
 import base64
+import concurrent.futures
+import hashlib
 import json
 import logging
 import os
 import subprocess
 import sys
+import threading
+import time
+
+import arti_client
+import copy_scheduler
+import curation_cache
+import curation_ledger
+import curation_metrics
 
 ### GLOBALS ###
 REMOTE_REPO_NAME = "shimi-dockerhub"
@@ -18,6 +28,42 @@ ARTIFACTORY_APIKEY = os.environ['int_artifactory_apikey']
 ARTIFACTORY_URL = os.environ['int_artifactory_url']
 DOCKER_URL = str(ARTIFACTORY_URL.split('/')[2])
 
+# Worker counts for each stage of a multi-image run.  Blob copies are bounded separately by 'curate_copy_workers'.
+IMAGE_WORKERS = int(os.environ.get('curate_image_workers', '4'))
+PULL_WORKERS = int(os.environ.get('curate_pull_workers', '2'))
+MANIFEST_WORKERS = int(os.environ.get('curate_manifest_workers', '4'))
+
+# Platforms curated from multi-architecture images when the payload doesn't list any, as 'os/arch[/variant]'.
+DEFAULT_PLATFORMS = os.environ.get('curate_docker_platforms', 'linux/amd64')
+
+# 'docker' runs a full 'docker pull' on the build node.  'registry' drives the remote-cache fetch through the
+# Docker Registry v2 API instead (manifests plus a HEAD per blob), so no daemon or local disk space is needed.
+DOCKER_PULL_MODE = os.environ.get('curate_docker_pull_mode', 'docker')
+# 'blob' copies the config and every layer with its own request.  'folder' copies the tag folder and each platform's
+# sub-manifest folder, manifests included, with one server-side copy each, and only falls back to per-blob copies for
+# a folder that is partly curated already (a layer shared with an image curated before) or for the files a folder copy
+# left out (checked with one lookup per folder).
+DOCKER_COPY_MODE = os.environ.get('curate_docker_copy_mode', 'blob')
+REGISTRY_MANIFEST_TYPES = ", ".join([
+    "application/vnd.docker.distribution.manifest.list.v2+json",
+    "application/vnd.docker.distribution.manifest.v2+json",
+    "application/vnd.oci.image.index.v1+json",
+    "application/vnd.oci.image.manifest.v1+json",
+])
+
+# Manifests kept on disk between runs and trimmed at startup.  'none' fetches every manifest on every run.
+DOCKER_MANIFEST_CACHE_SETTING = os.environ.get('curate_docker_manifest_cache_dir', '')
+DOCKER_MANIFEST_CACHE_MAX_BYTES = int(os.environ.get('curate_docker_manifest_cache_max_mb', '256')) * 1024 * 1024
+DOCKER_MANIFEST_CACHE_MAX_AGE = int(os.environ.get('curate_docker_manifest_cache_max_age_days', '30')) * 24 * 60 * 60
+# Minutes a cached tag manifest is trusted without asking Artifactory.  0 revalidates it (If-None-Match) every run.
+DOCKER_TAG_MANIFEST_TTL = int(os.environ.get('curate_docker_tag_manifest_ttl_minutes', '0')) * 60
+# File name of the tag manifest for each manifest format, in the order they're tried for a tag seen for the first time.
+TAG_MANIFEST_FILES = [("V2", "list.manifest.json"), ("V1", "manifest.json")]
+MANIFEST_CACHE_STATS = curation_cache.CacheStats("manifest cache")
+
+_MANIFEST_CACHE = None
+_MANIFEST_CACHE_LOCK = threading.Lock()
+
 ### FUNCTIONS ###
 def get_images_from_payload(payload_json):
     # FIXME: Change the generation of the URLs and image names so just the "project/image:tag" format is required.
@@ -34,6 +80,60 @@ def get_images_from_payload(payload_json):
     logging.debug("  tmp_images: %s", tmp_images)
     return tmp_images
 
+def parse_platform(input_spec):
+    # 'linux/arm/v7' -> {'os': 'linux', 'architecture': 'arm', 'variant': 'v7'}; a bare 'arm64' only sets the arch.
+    # A payload can also list the platforms as objects, the way image indexes do: {"os": ..., "architecture": ...}.
+    if isinstance(input_spec, dict):
+        tmp_platform = dict((tmp_key, str(input_spec[tmp_key])) for tmp_key in ('os', 'architecture', 'variant')
+                            if input_spec.get(tmp_key))
+        if not tmp_platform:
+            raise ValueError("Platform without an os, architecture or variant: {}".format(json.dumps(input_spec)))
+        return tmp_platform
+    if not isinstance(input_spec, str):
+        raise ValueError("Platform must be an 'os/arch[/variant]' string or an object: {}".format(json.dumps(input_spec)))
+    tmp_split = input_spec.strip().split('/')
+    if len(tmp_split) == 1:
+        return {'architecture': tmp_split[0]}
+    tmp_platform = {'os': tmp_split[0], 'architecture': tmp_split[1]}
+    if len(tmp_split) > 2:
+        tmp_platform['variant'] = tmp_split[2]
+    return tmp_platform
+
+def platform_name(input_platform):
+    return "/".join(
+        input_platform[tmp_key] for tmp_key in ('os', 'architecture', 'variant') if input_platform.get(tmp_key)
+    )
+
+def platform_matches(input_spec, input_platform):
+    return all(input_platform.get(tmp_key) == tmp_value for tmp_key, tmp_value in input_spec.items())
+
+def get_platforms_from_payload(payload_json):
+    logging.debug("Getting platforms from the payload")
+    tmp_payload_dict = json.loads(payload_json)
+    tmp_platforms = tmp_payload_dict.get('platforms', DEFAULT_PLATFORMS.split(','))
+    if isinstance(tmp_platforms, str):
+        tmp_platforms = tmp_platforms.split(',')
+    tmp_platforms = [parse_platform(tmp_spec) for tmp_spec in tmp_platforms if not isinstance(tmp_spec, str) or tmp_spec.strip()]
+    logging.debug("  tmp_platforms: %s", tmp_platforms)
+    return tmp_platforms
+
+def prep_manifest_cache():
+    if DOCKER_MANIFEST_CACHE_SETTING == 'none':
+        return
+    curation_cache.evict_directory(curation_cache.cache_dir('docker-manifests', DOCKER_MANIFEST_CACHE_SETTING),
+                                   DOCKER_MANIFEST_CACHE_MAX_BYTES, DOCKER_MANIFEST_CACHE_MAX_AGE)
+
+def get_manifest_cache():
+    # One cache per process, shared by every puller.
+    global _MANIFEST_CACHE
+    with _MANIFEST_CACHE_LOCK:
+        if _MANIFEST_CACHE is None:
+            if DOCKER_MANIFEST_CACHE_SETTING == 'none':
+                _MANIFEST_CACHE = ManifestCache(None)
+            else:
+                _MANIFEST_CACHE = ManifestCache(curation_cache.cache_dir('docker-manifests', DOCKER_MANIFEST_CACHE_SETTING))
+        return _MANIFEST_CACHE
+
 def docker_login(login_data):
     logging.debug("Logging into Docker CLI")
     tmp_prep_cmd = "docker login -u {} -p {} {}".format(
@@ -47,11 +147,99 @@ def docker_login(login_data):
         # FIXME: Should have this raise an exception if the login files?
         logging.warning("Failed to log into docker: %s", tmp_prep_output.stderr)
 
+def curate_images(pullers, image_workers = IMAGE_WORKERS):
+    logging.debug("Curating %d images with %d workers", len(pullers), image_workers)
+    with concurrent.futures.ThreadPoolExecutor(max_workers = max(1, image_workers), thread_name_prefix = 'image') as tmp_executor:
+        tmp_futures = [tmp_executor.submit(tmp_puller.curate) for tmp_puller in pullers]
+        # Results are gathered in payload order, whatever order the images finish in.
+        for tmp_puller, tmp_future in zip(pullers, tmp_futures):
+            try:
+                tmp_future.result()
+            except Exception:
+                logging.exception("Curation failed for '%s'", tmp_puller.docker_image)
+                tmp_puller.success_copy = False
+    return [(tmp_puller.docker_image, tmp_puller.success) for tmp_puller in pullers]
+
 ### CLASSES ###
+class ManifestCache:
+    # NOTE: A manifest addressed by its digest never changes, so once cached it's used without asking Artifactory.
+    #       A tag can move to a new manifest, so its entry keeps the ETag to revalidate it with, and the format (the
+    #       file name) the tag was found under so the next run doesn't probe for the other one first.
+    def __init__(self, root):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.root = root
+
+    def _digest_path(self, input_digest):
+        return os.path.join(self.root, 'digests', "{}.json".format("__".join(input_digest.split(':'))))
+
+    def _tag_path(self, input_key):
+        return os.path.join(self.root, 'tags', "{}.json".format(hashlib.sha256(input_key.encode()).hexdigest()))
+
+    def _read(self, input_path):
+        try:
+            with open(input_path, 'rb') as tmp_file:
+                tmp_data = tmp_file.read()
+            # Bump the mtime so eviction drops the entries that haven't been used for the longest.
+            os.utime(input_path)
+        except OSError:
+            return None
+        return tmp_data
+
+    def _write(self, input_path, input_data):
+        # Another puller (or another run on the node) may read the entry at any time, so never leave it half written.
+        tmp_partial = "{}.{}.{}.tmp".format(input_path, os.getpid(), threading.get_ident())
+        try:
+            os.makedirs(os.path.dirname(input_path), exist_ok = True)
+            with open(tmp_partial, 'wb') as tmp_file:
+                tmp_file.write(input_data)
+            os.replace(tmp_partial, input_path)
+        except OSError as tmp_err:
+            self.logger.warning("Failed to write the manifest cache entry '%s': %s", input_path, tmp_err)
+
+    def get_digest(self, input_digest):
+        if self.root is None:
+            return None
+        tmp_data = self._read(self._digest_path(input_digest))
+        if tmp_data is None:
+            return None
+        try:
+            return json.loads(tmp_data.decode())
+        except ValueError:
+            return None
+
+    def put_digest(self, input_digest, input_body):
+        if self.root is None:
+            return
+        tmp_algorithm, _, tmp_hex = input_digest.partition(':')
+        # Only keep a body that really is the manifest the digest names.
+        if tmp_algorithm != 'sha256' or hashlib.sha256(input_body).hexdigest() != tmp_hex:
+            self.logger.debug("  Not caching a manifest that doesn't match its digest: %s", input_digest)
+            return
+        self._write(self._digest_path(input_digest), input_body)
+
+    def get_tag(self, input_key):
+        # {'version', 'file', 'etag', 'checked', 'manifest'} for the tag, or None.
+        if self.root is None:
+            return None
+        tmp_data = self._read(self._tag_path(input_key))
+        if tmp_data is None:
+            return None
+        try:
+            return json.loads(tmp_data.decode())
+        except ValueError:
+            return None
+
+    def put_tag(self, input_key, input_entry):
+        if self.root is None:
+            return
+        self._write(self._tag_path(input_key), json.dumps(input_entry).encode())
+
 class DockerImagePuller:
-    SUPPORTED_ARCHITECTURES = ['amd64']
+    # Shared by every puller so the stage limits hold across concurrently curated images.
+    PULL_SLOTS = threading.BoundedSemaphore(max(1, PULL_WORKERS))
+    MANIFEST_SLOTS = threading.BoundedSemaphore(max(1, MANIFEST_WORKERS))
 
-    def __init__(self, login_data, docker_image):
+    def __init__(self, login_data, docker_image, platforms = None):
         self.logger = logging.getLogger(type(self).__name__)
         self.login_data = login_data
         self.docker_image = docker_image
@@ -62,72 +250,314 @@ class DockerImagePuller:
         self.docker_version = None
         self.success_pull = False
         self.success_copy = False
+        self.client = arti_client.get_client(login_data)
+        self.scheduler = copy_scheduler.get_scheduler(self.client)
+        self.ledger = curation_ledger.get_ledger()
+        self.manifest_cache = get_manifest_cache()
+        self.platforms = platforms if platforms is not None else [
+            parse_platform(tmp_spec) for tmp_spec in DEFAULT_PLATFORMS.split(',')
+        ]
+        self.platform_results = {}
+        self.copy_results = {}
+        self.folder_copies = 0
+        self._copy_futures = []
+        self._folder_futures = []
         self.logger.debug("DockerImagePuller for image: %s", docker_image)
 
-    def _arti_curl_copy(self, input_from, input_to):
-        # FIXME: Convert this to urllib or similar
-        self.logger.debug("Copying artifact from: %s to: %s", input_from, input_to)
-        curl_cmd = "curl -f -XPOST -u{}:{} {}/api/copy/{}?to=/{}".format(
-            self.login_data['user'], self.login_data['apikey'], self.login_data['arti_url'], input_from, input_to
-        )
-        curl_output = subprocess.run(curl_cmd.split(' '), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        self.logger.debug("  curl_output: %s", curl_output)
-        # FIXME: Raise exceptions for errors, in particular, the '409: Conflict' error
-        return curl_output
+    @property
+    def success(self):
+        return self.success_pull and self.success_copy
+
+    def _schedule_copy(self, input_from, input_to, input_present = False, input_record = True):
+        self.logger.debug("Scheduling copy from: %s to: %s", input_from, input_to)
+        if input_present:
+            tmp_future = copy_scheduler.present_future(input_from, input_to)
+        else:
+            tmp_future = self.scheduler.submit(input_from, input_to)
+        if input_record:
+            # NOTE: Blob paths end in the digest, so a recorded path can't go stale when a tag moves.
+            tmp_future.add_done_callback(lambda tmp_done: self.ledger.record_copy('docker', input_to, tmp_done.result().ok))
+        self._copy_futures.append((input_to, tmp_future))
+
+    def _find_curated(self, input_copies, input_unrecorded = ()):
+        # The targets of input_copies (a list of (from, to, blob)) already curated: the ones the ledger knows earlier
+        # runs copied, and the ones one batched lookup finds in the local repo.  The input_unrecorded target paths
+        # are only looked up in the local repo, the ledger can't vouch for a file that moves with its tag.
+        tmp_recorded = self.ledger.copied('docker', [tmp_to for _, tmp_to, _ in input_copies])
+        tmp_to_paths = [tmp_to.split('/', 1)[1] for _, tmp_to, _ in input_copies if tmp_to not in tmp_recorded]
+        tmp_to_paths.extend(tmp_to.split('/', 1)[1] for tmp_to in input_unrecorded)
+        tmp_present, _ = copy_scheduler.split_present(self.client, self.local_repo, tmp_to_paths) if tmp_to_paths else ([], [])
+        tmp_present = set(tmp_present)
+        self.logger.debug("  %d of %d files already in '%s' (%d from the ledger)", len(tmp_present) + len(tmp_recorded),
+                          len(input_copies) + len(input_unrecorded), self.local_repo, len(tmp_recorded))
+        return tmp_recorded, tmp_present
+
+    def _schedule_copies(self, input_copies, input_curated = None):
+        # input_copies is a list of (from, to, blob), and none of the ones already curated gets a copy.
+        tmp_recorded, tmp_present = input_curated if input_curated is not None else self._find_curated(input_copies)
+        for tmp_from, tmp_to, _ in input_copies:
+            if tmp_to in tmp_recorded:
+                self._schedule_copy(tmp_from, tmp_to, True, False)
+            else:
+                self._schedule_copy(tmp_from, tmp_to, tmp_to.split('/', 1)[1] in tmp_present)
 
-    def _arti_curl_get(self, input_url):
-        # FIXME: Convert this to urllib or similar
+    def _schedule_folder(self, input_folder, input_blobs, input_manifest = None):
+        # Curate one folder of the image (a tag, or a platform's sub-manifest) with a single server-side copy of the
+        # folder.  input_blobs are the (file name, blob) of its digest named files, the only ones the ledger can
+        # vouch for, and input_manifest the name of a manifest that isn't digest named (the tag's).
+        # NOTE: The folder copy would conflict with the files of a folder that's partly in the local repo already,
+        #       so those fall back to a copy per missing file.
+        tmp_from_folder = "{}/{}/{}/{}".format(self.image_split[1], self.image_split[2], self.image_split[3], input_folder)
+        tmp_to_folder = "{}/{}/{}/{}".format(self.local_repo, self.image_split[2], self.image_split[3], input_folder)
+        tmp_copies = [
+            ("{}/{}".format(tmp_from_folder, tmp_name), "{}/{}".format(tmp_to_folder, tmp_name), tmp_blob)
+            for tmp_name, tmp_blob in input_blobs
+        ]
+        tmp_manifest = None
+        if input_manifest is not None:
+            tmp_manifest = ("{}/{}".format(tmp_from_folder, input_manifest), "{}/{}".format(tmp_to_folder, input_manifest))
+        tmp_recorded, tmp_present = self._find_curated(tmp_copies, [tmp_manifest[1]] if tmp_manifest else [])
+        if tmp_recorded or tmp_present:
+            self.logger.debug("  Folder '%s' is partly curated, copying its files one by one", tmp_to_folder)
+            self._schedule_copies(tmp_copies, (tmp_recorded, tmp_present))
+            if tmp_manifest is not None:
+                self._schedule_tag_manifest(tmp_manifest[0], tmp_manifest[1], tmp_manifest[1].split('/', 1)[1] in tmp_present)
+            return
+        self.logger.debug("Scheduling folder copy from: %s to: %s", tmp_from_folder, tmp_to_folder)
+        self._folder_futures.append((self.scheduler.submit(tmp_from_folder, tmp_to_folder), tmp_copies, tmp_manifest))
+        self.folder_copies += 1
+
+    def _check_folders(self):
+        # A folder copy only copies what the remote cache holds, which may not be every file of the folder (e.g. a
+        # platform that was never pulled), so once it's done one lookup checks which files really are in the local
+        # repo.  Only those are recorded, and the rest get a copy of their own.
+        for tmp_future, tmp_copies, tmp_manifest in self._folder_futures:
+            tmp_folder_result = tmp_future.result()
+            tmp_expected = list(tmp_copies)
+            if tmp_manifest is not None:
+                tmp_expected.append((tmp_manifest[0], tmp_manifest[1], None))
+            tmp_present, tmp_missing = copy_scheduler.split_present(
+                self.client, self.local_repo, [tmp_to.split('/', 1)[1] for _, tmp_to, _ in tmp_expected]
+            )
+            tmp_present = set(tmp_present)
+            if tmp_missing:
+                self.logger.info("  The copy of '%s' left out %d of %d files, copying them one by one",
+                                 tmp_folder_result.to_path, len(tmp_missing), len(tmp_expected))
+            for tmp_from, tmp_to, tmp_blob in tmp_expected:
+                if tmp_to.split('/', 1)[1] not in tmp_present:
+                    if tmp_blob is None:
+                        self._copy_futures.append((tmp_to, self.scheduler.submit(tmp_from, tmp_to)))
+                    else:
+                        self._schedule_copy(tmp_from, tmp_to)
+                    continue
+                if tmp_blob is not None:
+                    # NOTE: Blob paths end in the digest, so a recorded path can't go stale when a tag moves.
+                    self.ledger.record_copy('docker', tmp_to, True)
+                if tmp_folder_result.ok:
+                    self._copy_futures.append((tmp_to, tmp_future))
+                else:
+                    self._copy_futures.append((tmp_to, copy_scheduler.present_future(tmp_from, tmp_to)))
+        self._folder_futures = []
+
+    def _tag_manifest_current(self, input_to):
+        # Whether the tag manifest in the local repo is the one the tag points at now.
+        tmp_response = self._arti_get(input_to)
+        if not tmp_response.ok:
+            return False
+        try:
+            return tmp_response.json() == self.manifest
+        except ValueError:
+            return False
+
+    def _replace_tag_manifest(self, input_from, input_to):
+        # A copy onto a file that's there already only gets a '409: Conflict', so the stale manifest goes first.
+        with curation_metrics.stage('copy', input_to) as tmp_stage:
+            tmp_response = self.client.delete(input_to)
+            if tmp_response.ok or tmp_response.not_found:
+                tmp_response = self.client.copy(input_from, input_to)
+            tmp_result = copy_scheduler.CopyResult(input_from, input_to, tmp_response)
+            if not tmp_result.ok:
+                tmp_stage.fail(tmp_result.error)
+        return tmp_result
+
+    def _schedule_tag_manifest(self, input_from, input_to, input_present):
+        # The tag manifest isn't digest named, so one that's in the local repo already may be from before the tag
+        # moved.  It's only kept when it still is the manifest the tag points at, and replaced otherwise.
+        if not input_present:
+            tmp_future = self.scheduler.submit(input_from, input_to)
+        elif self._tag_manifest_current(input_to):
+            tmp_future = copy_scheduler.present_future(input_from, input_to)
+        else:
+            self.logger.info("  The curated tag manifest '%s' is out of date, replacing it", input_to)
+            tmp_future = self.scheduler.submit_call(self._replace_tag_manifest, input_from, input_to)
+        self._copy_futures.append((input_to, tmp_future))
+
+    def _collect_copies(self):
+        # Wait on every scheduled copy and keep the outcome of each blob, keyed by its target path.
+        self._check_folders()
+        for tmp_to_name, tmp_future in self._copy_futures:
+            tmp_result = tmp_future.result()
+            self.copy_results[tmp_to_name] = tmp_result
+            if tmp_result.copied:
+                self.logger.debug("  Successfully copied: %s", tmp_result.to_path)
+            elif tmp_result.conflict:
+                # NOTE: Found by the existence check, or '409: Conflict' from a copy of an already curated file.
+                self.logger.debug("  Already curated: %s", tmp_result.to_path)
+            else:
+                self.logger.warning("Failed to copy '%s' with error: %s", tmp_result.from_path, tmp_result.error)
+        self._copy_futures = []
+        self.success_copy = all(tmp_result.ok for tmp_result in self.copy_results.values())
+
+    def _platform_selected(self, input_platform):
+        return any(platform_matches(tmp_spec, input_platform) for tmp_spec in self.platforms)
+
+    def _arti_get(self, input_url, input_headers = None):
         self.logger.debug("Get artifact: %s", input_url)
-        curl_cmd = "curl -f -u{}:{} {}/{}".format(
-            self.login_data['user'], self.login_data['apikey'], self.login_data['arti_url'], input_url
-        )
-        curl_output = subprocess.run(curl_cmd.split(' '), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        self.logger.debug("  curl_output: %s", curl_output)
-        # FIXME: Raise exceptions for errors, in particular, the '409: Conflict' error
-        return curl_output
+        tmp_response = self.client.get(input_url, headers = input_headers)
+        self.logger.debug("  tmp_response: %s", tmp_response)
+        return tmp_response
 
     def _pull_image(self):
+        # A plain 'docker pull' only pulls the node's own platform into the remote cache, so each selected platform
+        # gets a pull of its own.
         self.logger.debug("Pulling the docker image: %s", self.docker_image)
-        tmp_pull_cmd = "docker pull {}".format(self.docker_image)
-        self.logger.debug("  tmp_pull_cmd: %s", tmp_pull_cmd)
-        tmp_pull_output = subprocess.run(tmp_pull_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        if tmp_pull_output.returncode == 0:
-            self.logger.info("  Successfully pulled '%s'", self.docker_image)
-            self.success_pull = True
-        else:
-            # FIXME: Should this raise an exception on failure?
-            self.logger.warning("Failed to pull '%s' with error: %s", self.docker_image, tmp_pull_output.stderr)
+        tmp_failed = []
+        for tmp_platform in self.platforms:
+            tmp_pull_cmd = "docker pull --platform {} {}".format(platform_name(tmp_platform), self.docker_image)
+            self.logger.debug("  tmp_pull_cmd: %s", tmp_pull_cmd)
+            tmp_pull_output = subprocess.run(tmp_pull_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+            if tmp_pull_output.returncode == 0:
+                self.logger.info("  Successfully pulled '%s' (%s)", self.docker_image, platform_name(tmp_platform))
+            else:
+                # FIXME: Should this raise an exception on failure?
+                self.logger.warning("Failed to pull '%s' (%s) with error: %s", self.docker_image,
+                                    platform_name(tmp_platform), tmp_pull_output.stderr)
+                tmp_failed.append(tmp_platform)
+        self.success_pull = not tmp_failed
+
+    def _registry_path(self, input_kind, input_reference):
+        return "api/docker/{}/v2/{}/{}/{}/{}".format(
+            self.image_split[1], self.image_split[2], self.image_split[3], input_kind, input_reference
+        )
+
+    def _registry_get_manifest(self, input_reference):
+        return self.client.get(self._registry_path('manifests', input_reference), headers = {'Accept': REGISTRY_MANIFEST_TYPES})
+
+    def _registry_head_blob(self, input_digest):
+        return self.client.head(self._registry_path('blobs', input_digest))
+
+    def _pull_image_registry(self):
+        self.logger.debug("Fetching the docker image through the registry API: %s", self.docker_image)
+        tmp_response = self._registry_get_manifest(self.image_tag[1])
+        if not tmp_response.ok:
+            self.logger.warning("Failed to fetch the manifest for '%s' with error: %s %s", self.docker_image,
+                                tmp_response.status, tmp_response.error or tmp_response.text())
+            return
+        tmp_manifests = [tmp_response.json()]
+        if 'manifests' in tmp_manifests[0]:
+            # Manifest list / OCI index, so fetch the manifest of each supported platform.
+            tmp_futures = [
+                self.scheduler.submit_call(curation_metrics.in_current_stage(self._registry_get_manifest), tmp_sub['digest'])
+                for tmp_sub in tmp_manifests[0]['manifests']
+                if self._platform_selected(tmp_sub.get('platform', {}))
+            ]
+            tmp_manifests = []
+            for tmp_future in tmp_futures:
+                tmp_sub_response = tmp_future.result()
+                if not tmp_sub_response.ok:
+                    self.logger.warning("Failed to fetch a platform manifest for '%s': %s", self.docker_image,
+                                        tmp_sub_response.status)
+                    return
+                tmp_manifests.append(tmp_sub_response.json())
+        tmp_digests = []
+        for tmp_manifest in tmp_manifests:
+            if 'config' in tmp_manifest:
+                tmp_digests.append(tmp_manifest['config']['digest'])
+            tmp_digests.extend(tmp_layer['digest'] for tmp_layer in tmp_manifest.get('layers', []))
+        tmp_head_blob = curation_metrics.in_current_stage(self._registry_head_blob)
+        tmp_futures = [self.scheduler.submit_call(tmp_head_blob, tmp_digest) for tmp_digest in tmp_digests]
+        tmp_failed = [tmp_future.result() for tmp_future in tmp_futures if not tmp_future.result().ok]
+        if tmp_failed:
+            self.logger.warning("Failed to fetch %d blobs for '%s': %s", len(tmp_failed), self.docker_image, tmp_failed)
+            return
+        self.logger.info("  Successfully fetched '%s' through the registry API (%d blobs)", self.docker_image, len(tmp_digests))
+        self.success_pull = True
+
+    def _use_tag_manifest(self, input_entry):
+        self.manifest = input_entry['manifest']
+        self.docker_version = input_entry['version']
 
     def _pull_manifest(self):
         self.logger.debug("Pulling the manifest for image: %s", self.docker_image)
         self.logger.debug("tmp_image_tag: %s", self.image_tag)
         self.logger.debug("tmp_image_split: %s", self.image_split)
-        tmp_image_arti_name = "{}/{}/{}/{}/list.manifest.json".format(
-            self.image_split[1], self.image_split[2], self.image_split[3], self.image_tag[1]
+        tmp_key = "{}/{}/{}/{}:{}".format(
+            self.login_data['arti_url'], self.image_split[1], self.image_split[2], self.image_split[3], self.image_tag[1]
         )
-        tmp_curl1_output = self._arti_curl_get(tmp_image_arti_name)
-        self.logger.debug("  tmp_curl1_output: %s", tmp_curl1_output)
-        if tmp_curl1_output.returncode == 0:
-            # Succeeded in pulling the V2 type image manifest.
-            self.manifest = json.loads(tmp_curl1_output.stdout.decode())
-            self.docker_version = "V2"
-        else:
-            # Failure in pulling V2, so try V1
-            tmp_image_arti_name = "{}/{}/{}/{}/manifest.json".format(
-                self.image_split[1], self.image_split[2], self.image_split[3], self.image_tag[1]
+        tmp_entry = self.manifest_cache.get_tag(tmp_key)
+        tmp_formats = list(TAG_MANIFEST_FILES)
+        if tmp_entry is not None:
+            if DOCKER_TAG_MANIFEST_TTL and time.time() - tmp_entry['checked'] < DOCKER_TAG_MANIFEST_TTL:
+                self.logger.debug("  Using the cached %s manifest without revalidating it", tmp_entry['version'])
+                MANIFEST_CACHE_STATS.record(hits = 1)
+                self._use_tag_manifest(tmp_entry)
+                return
+            # Ask for the format the tag had last time first.
+            tmp_formats.sort(key = lambda tmp_format: tmp_format[1] != tmp_entry['file'])
+        for tmp_version, tmp_file in tmp_formats:
+            tmp_image_arti_name = "{}/{}/{}/{}/{}".format(
+                self.image_split[1], self.image_split[2], self.image_split[3], self.image_tag[1], tmp_file
             )
-            tmp_curl12_output = self._arti_curl_get(tmp_image_arti_name)
-            self.logger.debug("  tmp_curl12_output: %s", tmp_curl12_output)
-            if tmp_curl12_output.returncode == 0:
-                # Succeeded in pulling the V1 type image manifest.
-                self.manifest = json.loads(tmp_curl12_output.stdout.decode())
-                self.docker_version = "V1"
-            else:
-                # FIXME: Raise an exception if both manifest pull attempts fail
-                self.logger.warning("Failed to pull a manifest")
+            tmp_headers = None
+            if tmp_entry is not None and tmp_entry['file'] == tmp_file and tmp_entry.get('etag'):
+                tmp_headers = {'If-None-Match': tmp_entry['etag']}
+            tmp_get_output = self._arti_get(tmp_image_arti_name, tmp_headers)
+            if tmp_get_output.not_modified:
+                # The tag still points at the cached manifest.
+                self.logger.debug("  The cached %s manifest is current", tmp_entry['version'])
+                MANIFEST_CACHE_STATS.record(hits = 1)
+                tmp_entry['checked'] = time.time()
+                self.manifest_cache.put_tag(tmp_key, tmp_entry)
+                self._use_tag_manifest(tmp_entry)
+                return
+            if tmp_get_output.ok:
+                # Succeeded in pulling the image manifest (list.manifest.json for V2, manifest.json for V1).
+                MANIFEST_CACHE_STATS.record(misses = 1)
+                self.manifest = tmp_get_output.json()
+                self.docker_version = tmp_version
+                self.manifest_cache.put_tag(tmp_key, {
+                    'version': tmp_version, 'file': tmp_file, 'etag': tmp_get_output.header('ETag'),
+                    'checked': time.time(), 'manifest': self.manifest,
+                })
+                return
+        # FIXME: Raise an exception if both manifest pull attempts fail
+        self.logger.warning("Failed to pull a manifest")
+
+    def _get_sub_manifest(self, input_platform, input_digest, input_path):
+        # Returns the sub-manifest, or None and the reason it couldn't be fetched.
+        tmp_manifest = self.manifest_cache.get_digest(input_digest)
+        if tmp_manifest is not None:
+            MANIFEST_CACHE_STATS.record(hits = 1)
+            return tmp_manifest, None
+        MANIFEST_CACHE_STATS.record(misses = 1)
+        with curation_metrics.stage('resolve', "{} ({})".format(self.docker_image, input_platform)) as tmp_stage:
+            tmp_response = self._arti_get(input_path)
+            if not tmp_response.ok:
+                tmp_stage.fail(tmp_response.error or tmp_response.status)
+                return None, tmp_response.error or tmp_response.status
+        self.manifest_cache.put_digest(input_digest, tmp_response.body)
+        return tmp_response.json(), None
 
     def _copy_v1(self):
         self.logger.debug("Copying the V1 type docker image")
+        if DOCKER_COPY_MODE == 'folder':
+            self._schedule_folder(self.image_tag[1], [
+                ("__".join(tmp_blob['digest'].split(':')), tmp_blob)
+                for tmp_blob in [self.manifest['config']] + self.manifest['layers']
+            ], 'manifest.json')
+            self._collect_copies()
+            logging.info("Completed Copying V1 Images")
+            return
         tmp_config_from_name = "{}/{}/{}/{}".format(
             self.image_split[1], self.image_split[2], self.image_split[3], "__".join(self.manifest['config']['digest'].split(':'))
         )
@@ -136,14 +566,7 @@ class DockerImagePuller:
             self.local_repo, self.image_split[2], self.image_split[3], "__".join(self.manifest['config']['digest'].split(':'))
         )
         self.logger.debug("tmp_config_to_name: %s", tmp_config_to_name)
-        tmp_curl13_output = self._arti_curl_copy(tmp_config_from_name, tmp_config_to_name)
-        self.logger.debug("tmp_curl13_output: %s", tmp_curl13_output)
-        if tmp_curl13_output.returncode != 0:
-            # Failed to copy the config
-            # FIXME: What error handling should happen here?
-            # FIXME: The '409: Conflict' error means the file has already been copied,
-            #        likely from a previous curation.
-            self.logger.debug("Successfully copied config")
+        tmp_copies = [(tmp_config_from_name, tmp_config_to_name, self.manifest['config'])]
         # Copy the layer files
         for tmp_sublayer in self.manifest['layers']:
             tmp_layer_from_name = "{}/{}/{}/{}".format(
@@ -154,78 +577,115 @@ class DockerImagePuller:
                 self.local_repo, self.image_split[2], self.image_split[3], "__".join(tmp_sublayer['digest'].split(':'))
             )
             self.logger.debug("tmp_layer_to_name: %s", tmp_layer_to_name)
-            tmp_curl14_output = self._arti_curl_copy(tmp_layer_from_name, tmp_layer_to_name)
-            self.logger.debug("tmp_curl14_output: %s", tmp_curl14_output)
-            if tmp_curl14_output.returncode != 0:
-                # Failed to copy the config
-                # FIXME: What error handling should happen here?
-                # FIXME: The '409: Conflict' error means the file has already been copied, likely from a previous
-                #        curation.
-                self.logger.debug("Successfully copied layer")
+            tmp_copies.append((tmp_layer_from_name, tmp_layer_to_name, tmp_sublayer))
+        self._schedule_copies(tmp_copies)
+        self._collect_copies()
         logging.info("Completed Copying V1 Images")
 
     def _copy_v2(self):
         self.logger.debug("Copying the V2 type docker image")
         sub_images = self.manifest['manifests']
         self.logger.debug("sub_images: %s", sub_images)
+        # Fetch every selected sub-manifest concurrently, and schedule its blob copies as soon as it arrives so the
+        # copies of one platform overlap with the manifest fetches of the others.
+        tmp_manifest_futures = {}
+        tmp_platform_targets = {}
+        tmp_sub_blobs = {}
+        if DOCKER_COPY_MODE == 'folder':
+            # The tag folder only holds list.manifest.json.
+            self._schedule_folder(self.image_tag[1], [], 'list.manifest.json')
         for subimage in sub_images:
-            if subimage['platform']['architecture'] in self.SUPPORTED_ARCHITECTURES:
+            if self._platform_selected(subimage.get('platform', {})):
+                tmp_platform = platform_name(subimage['platform'])
                 subimage_name = "__".join(subimage['digest'].split(':'))
-                self.logger.debug("subimage_name: %s", subimage_name)
-
+                self.logger.debug("subimage_name: %s (%s)", subimage_name, tmp_platform)
                 subimage_arti_name = "{}/{}/{}/{}/manifest.json".format(
                     self.image_split[1], self.image_split[2], self.image_split[3], subimage_name
                 )
-                tmp_curl2_output = self._arti_curl_get(subimage_arti_name)
-                self.logger.debug("  tmp_curl2_output: %s", tmp_curl2_output)
-                if tmp_curl2_output.returncode == 0:
-                    # Succeeded in pulling the V2 type image manifest.
-                    subimage_manifest = json.loads(tmp_curl2_output.stdout.decode())
-                    # Copy the config
-                    tmp_config_from_name = "{}/{}/{}/{}/{}".format(
-                        self.image_split[1], self.image_split[2], self.image_split[3], subimage_name, "__".join(subimage_manifest['config']['digest'].split(':'))
-                    )
-                    tmp_config_to_name = "{}/{}/{}/{}/{}".format(
-                        self.local_repo, self.image_split[2], self.image_split[3], subimage_name, "__".join(subimage_manifest['config']['digest'].split(':'))
-                    )
-                    tmp_curl3_output = self._arti_curl_copy(tmp_config_from_name, tmp_config_to_name)
-                    self.logger.debug("tmp_curl3_output: %s", tmp_curl3_output)
-                    if tmp_curl3_output.returncode != 0:
-                        # Failed to copy the config
-                        # FIXME: What error handling should happen here?
-                        # FIXME: The '409: Conflict' error means the file has already been copied, likely from a previous
-                        #        curation.
-                        self.logger.debug("Successfully copied config")
-                    # Copy the layer files
-                    for tmp_sublayer in subimage_manifest['layers']:
-                        tmp_sublayer_from_name = "{}/{}/{}/{}/{}".format(
-                            self.image_split[1], self.image_split[2], self.image_split[3], subimage_name, "__".join(tmp_sublayer['digest'].split(':'))
-                        )
-                        tmp_sublayer_to_name = "{}/{}/{}/{}/{}".format(
-                            self.local_repo, self.image_split[2], self.image_split[3], subimage_name, "__".join(tmp_sublayer['digest'].split(':'))
-                        )
-                        tmp_curl4_output = self._arti_curl_copy(tmp_sublayer_from_name, tmp_sublayer_to_name)
-                        self.logger.debug("tmp_curl4_output: %s", tmp_curl4_output)
-                        if tmp_curl4_output.returncode != 0:
-                            # Failed to copy the config
-                            # FIXME: What error handling should happen here?
-                            # FIXME: The '409: Conflict' error means the file has already been copied, likely from a previous
-                            #        curation.
-                            self.logger.debug("Successfully copied layer")
-                else:
-                    # Failed to get manifest.json
-                    # FIXME: What error handling should happen here?
-                    pass
+                tmp_future = self.scheduler.submit_call(self._get_sub_manifest, tmp_platform, subimage['digest'],
+                                                        subimage_arti_name)
+                tmp_manifest_futures[tmp_future] = (tmp_platform, subimage_name)
+                tmp_platform_targets[tmp_platform] = []
+                tmp_sub_blobs[subimage_name] = subimage
+        tmp_failed_platforms = set()
+        for tmp_spec in self.platforms:
+            if not any(platform_matches(tmp_spec, tmp_sub.get('platform', {})) for tmp_sub in sub_images):
+                # Requested but not in the manifest list, so nothing can be curated for it.
+                tmp_platform = platform_name(tmp_spec)
+                self.logger.warning("Platform '%s' is not available for '%s'", tmp_platform, self.docker_image)
+                tmp_platform_targets[tmp_platform] = []
+                tmp_failed_platforms.add(tmp_platform)
+        for tmp_future in concurrent.futures.as_completed(tmp_manifest_futures):
+            tmp_platform, subimage_name = tmp_manifest_futures[tmp_future]
+            subimage_manifest, tmp_error = tmp_future.result()
+            if subimage_manifest is None:
+                # Failed to get manifest.json
+                self.logger.warning("Failed to get the %s manifest for '%s': %s", tmp_platform, subimage_name, tmp_error)
+                tmp_failed_platforms.add(tmp_platform)
+                continue
+            if DOCKER_COPY_MODE == 'folder':
+                # The sub-manifest folder is named after the manifest's digest, so its manifest.json is as safe to
+                # record in the ledger as the blobs.
+                tmp_files = [('manifest.json', tmp_sub_blobs[subimage_name])] + [
+                    ("__".join(tmp_blob['digest'].split(':')), tmp_blob)
+                    for tmp_blob in [subimage_manifest['config']] + subimage_manifest['layers']
+                ]
+                self._schedule_folder(subimage_name, tmp_files)
+                tmp_platform_targets[tmp_platform].extend(
+                    "{}/{}/{}/{}/{}".format(self.local_repo, self.image_split[2], self.image_split[3], subimage_name, tmp_name)
+                    for tmp_name, _ in tmp_files
+                )
+                continue
+            # Copy the config
+            tmp_config_from_name = "{}/{}/{}/{}/{}".format(
+                self.image_split[1], self.image_split[2], self.image_split[3], subimage_name, "__".join(subimage_manifest['config']['digest'].split(':'))
+            )
+            tmp_config_to_name = "{}/{}/{}/{}/{}".format(
+                self.local_repo, self.image_split[2], self.image_split[3], subimage_name, "__".join(subimage_manifest['config']['digest'].split(':'))
+            )
+            tmp_copies = [(tmp_config_from_name, tmp_config_to_name, subimage_manifest['config'])]
+            # Copy the layer files
+            for tmp_sublayer in subimage_manifest['layers']:
+                tmp_sublayer_from_name = "{}/{}/{}/{}/{}".format(
+                    self.image_split[1], self.image_split[2], self.image_split[3], subimage_name, "__".join(tmp_sublayer['digest'].split(':'))
+                )
+                tmp_sublayer_to_name = "{}/{}/{}/{}/{}".format(
+                    self.local_repo, self.image_split[2], self.image_split[3], subimage_name, "__".join(tmp_sublayer['digest'].split(':'))
+                )
+                tmp_copies.append((tmp_sublayer_from_name, tmp_sublayer_to_name, tmp_sublayer))
+            self._schedule_copies(tmp_copies)
+            tmp_platform_targets[tmp_platform].extend(tmp_to for _, tmp_to, _ in tmp_copies)
+        self._collect_copies()
+        for tmp_platform, tmp_targets in tmp_platform_targets.items():
+            self.platform_results[tmp_platform] = (tmp_platform not in tmp_failed_platforms) and all(
+                self.copy_results[tmp_target].ok for tmp_target in tmp_targets
+            )
+            self.logger.info("  %s: %s (%d blobs)", tmp_platform,
+                             "curated" if self.platform_results[tmp_platform] else "FAILED", len(tmp_targets))
+        self.success_copy = self.success_copy and not tmp_failed_platforms
         self.logger.info("Completed Copying V2 Images")
 
     def curate(self):
         self.logger.debug("Curating the docker image: %s", self.docker_image)
-        self._pull_image()
-        self._pull_manifest()
+        with self.PULL_SLOTS, curation_metrics.stage('pull', self.docker_image) as tmp_stage:
+            if DOCKER_PULL_MODE == 'registry':
+                self._pull_image_registry()
+            else:
+                self._pull_image()
+            if not self.success_pull:
+                tmp_stage.fail("pull failed")
+        with self.MANIFEST_SLOTS, curation_metrics.stage('resolve', self.docker_image) as tmp_stage:
+            self._pull_manifest()
+            if self.docker_version is None:
+                tmp_stage.fail("no manifest")
         if self.docker_version == "V2":
             self._copy_v2()
         elif self.docker_version == "V1":
             self._copy_v1()
+        self.logger.info("Copied %d blobs for '%s' (%d folder copies, %d already curated, %d failed)",
+                         len(self.copy_results), self.docker_image, self.folder_copies,
+                         len([tmp_result for tmp_result in self.copy_results.values() if tmp_result.conflict]),
+                         len([tmp_result for tmp_result in self.copy_results.values() if not tmp_result.ok]))
         self.logger.debug("Curating complete for docker image: %s", self.docker_image)
 
 ### MAIN ###
@@ -235,10 +695,12 @@ def main():
         format = "%(asctime)s:%(levelname)s:%(name)s:%(funcName)s: %(message)s",
         level = logging.DEBUG
     )
+    curation_metrics.start_run('docker')
 
     logging.debug("Environment Prep Starting")
     tmp_payload_json = os.environ['res_curatedocker_payload']
     tmp_images = get_images_from_payload(tmp_payload_json)
+    tmp_platforms = get_platforms_from_payload(tmp_payload_json)
 
     tmp_login_data = {}
     tmp_login_data['user'] = os.environ['int_artifactory_user']
@@ -246,16 +708,30 @@ def main():
     tmp_login_data['arti_url'] = os.environ['int_artifactory_url']
     tmp_login_data['docker_url'] = str(tmp_login_data['arti_url'].split('/')[2])
 
-    docker_login(tmp_login_data)
+    if DOCKER_PULL_MODE == 'docker':
+        docker_login(tmp_login_data)
+    prep_manifest_cache()
     logging.info("Environment Prep Complete")
 
     tmp_dockerimagepullers = []
     for tmp_img in tmp_images:
-        tmp_dockerimagepullers.append(DockerImagePuller(tmp_login_data, tmp_img))
-    for tmp_puller in tmp_dockerimagepullers:
-        tmp_puller.curate()
+        tmp_dockerimagepullers.append(DockerImagePuller(tmp_login_data, tmp_img, tmp_platforms))
+    tmp_results = curate_images(tmp_dockerimagepullers)
 
     # Report Results
+    logging.info("Gathering Results")
+    tmp_successes = [tmp_image for tmp_image, tmp_success in tmp_results if tmp_success]
+    tmp_failures = [tmp_image for tmp_image, tmp_success in tmp_results if not tmp_success]
+    logging.info("Successfully Curated:")
+    for item in tmp_successes:
+        logging.info("  %s", item)
+    if len(tmp_failures) > 0:
+        logging.warning("Failed to Curate:")
+        for item in tmp_failures:
+            logging.warning("  %s", item)
+    logging.info("%s", MANIFEST_CACHE_STATS)
+    logging.info("%s", curation_ledger.get_ledger().stats)
+    curation_metrics.finish_run()
 
 if __name__ == "__main__":
     main()
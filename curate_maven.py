@@ -2,39 +2,235 @@
 
 ### IMPORTS ###
 import base64
+import hashlib
 import json
 import logging
 import os
-import subprocess
+import re
 import sys
+import xml.etree.ElementTree as ET
+
+import arti_client
+import copy_scheduler
+import curation_ledger
+import curation_metrics
+import line_runner
+import maven_resolver
 
 ### GLOBALS ###
 REMOTE_REPO_NAME = "demo-maven"
 LOCAL_REPO_NAME = "demo-maven-local"
+# 'mvn' runs 'mvn dependency:list', 'python' resolves the pom.xml in-process with maven_resolver (and falls back to
+# 'mvn' if the POM can't be resolved that way).
+MAVEN_RESOLVER = os.environ.get('curate_maven_resolver', 'mvn')
+# Maven settings (mirrors, profiles...) change what 'mvn' resolves a pom.xml to, so they're part of its ledger key.
+MAVEN_SETTINGS_FILE = os.path.join(os.path.expanduser('~'), '.m2', 'settings.xml')
+# A dependency entry in the output of 'mvn dependency:list'.
+MVN_DEPENDENCY_PATTERN = re.compile(r'^\[INFO\]\s+([^\s:]+:[^\s:]+:[^\s:]+(?::[^\s:]+)?:[^\s:]+:(?:compile|provided|runtime|test|system))\b')
 
 ### FUNCTIONS ###
-def format_jar_line(input_line):
-    logging.debug("  input_line: %s", input_line)
-    # NOTE: Here's an example of the line processing here.
-    #   tmp_line: [INFO]    org.apache.tinkerpop:gremlin-shaded:jar:3.5.3:compile
-    #   ':jar:' found
-    #   input_line: org.apache.tinkerpop:gremlin-shaded:jar:3.5.3:compile
-    #     tmp_split: #5 - ['org.apache.tinkerpop', 'gremlin-shaded', 'jar', '3.5.3', 'compile']
-    #     tmp_path: org/apache/tinkerpop
-    #   output_line: org/apache/tinkerpop/gremlin-shaded/3.5.3/gremlin-shaded-3.5.3.jar
-    tmp_split = input_line.split(':')
-    logging.debug("    tmp_split: #%d - %s", len(tmp_split), tmp_split)
-    tmp_path = "/".join(tmp_split[0].split('.'))
-    logging.debug("    tmp_path: %s", tmp_path)
-    tmp_name = "{}-{}.jar".format(tmp_split[1], tmp_split[-2])
-    # NOTE: Check for the architecture classifier.  This should be a more complete processor for the lines.
-    if len(tmp_split) == 6:
-        tmp_name = "{}-{}-{}.jar".format(tmp_split[1], tmp_split[-2], tmp_split[-3])
-    tmp_full_path = "{}/{}/{}/{}".format(tmp_path, tmp_split[1], tmp_split[-2], tmp_name)
-    logging.debug("  output_line: %s", tmp_full_path)
-    return tmp_full_path
+def list_dependencies_mvn(input_dir = None, on_coordinate = None):
+    # Run 'mvn dependency:list' on the pom.xml in input_dir (the working directory by default) and return its
+    # dependencies.  Each one is also handed to on_coordinate as soon as mvn prints it.
+    tmp_coordinates = []
+    def tmp_on_line(tmp_line):
+        logging.debug("  tmp_line: %s", tmp_line)
+        # NOTE: Here's an example of the lines processed here, relocation warnings and the rest of the build output
+        #       don't match.
+        #   tmp_line: [INFO]    org.apache.tinkerpop:gremlin-shaded:jar:3.5.3:compile
+        #   tmp_line: [INFO]    io.netty:netty-transport-native-epoll:jar:linux-x86_64:4.1.77.Final:runtime
+        tmp_match = MVN_DEPENDENCY_PATTERN.match(tmp_line)
+        if tmp_match:
+            tmp_coordinates.append(maven_resolver.MavenCoordinate.parse(tmp_match.group(1)))
+            if on_coordinate is not None:
+                on_coordinate(tmp_coordinates[-1])
+    tmp_mvn_output = line_runner.run_lines('mvn -B dependency:list'.split(' '), tmp_on_line, cwd = input_dir)
+    logging.debug("tmp_mvn_output: %s", tmp_mvn_output)
+    if tmp_mvn_output.returncode != 0:
+        logging.warning("'mvn dependency:list' failed with exit code %d", tmp_mvn_output.returncode)
+    return tmp_coordinates, tmp_mvn_output.returncode == 0
+
+def list_dependencies_python(client, pom_text):
+    # Resolve the pom.xml without Maven: parents, BOMs and dependency POMs are read from the remote repo, which also
+    # warms its cache for them.  The parents and BOMs are curated too, builds against the local repo need them.
+    tmp_resolver = maven_resolver.PomResolver(maven_resolver.ArtifactoryPomSource(client, REMOTE_REPO_NAME))
+    tmp_dependency_lines = tmp_resolver.resolve_pom_text(pom_text)
+    logging.debug("tmp_dependency_lines: %s", tmp_dependency_lines)
+    tmp_coordinates = [maven_resolver.MavenCoordinate.parse(tmp_line) for tmp_line in tmp_dependency_lines]
+    for tmp_group, tmp_artifact, tmp_version in tmp_resolver.support_poms:
+        tmp_coordinates.append(maven_resolver.MavenCoordinate(tmp_group, tmp_artifact, tmp_version, 'pom'))
+    return tmp_coordinates
+
+def normalize_pom(pom_text):
+    # The pom.xml without comments, indentation or line endings, so re-encoding or re-formatting it doesn't change
+    # its ledger key.  A POM that doesn't parse is only stripped, mvn will report it.
+    try:
+        tmp_root = ET.fromstring(pom_text)
+    except ET.ParseError:
+        return pom_text.strip().encode()
+    for tmp_elem in tmp_root.iter():
+        tmp_elem.text = tmp_elem.text.strip() if tmp_elem.text else None
+        tmp_elem.tail = None
+    return ET.tostring(tmp_root)
+
+def resolution_key(pom_text, input_resolver):
+    # Ledger key of a pom.xml resolved by input_resolver ('mvn' or 'python'): what it resolves to also depends on the
+    # remote repo and, for 'mvn', the Maven settings.
+    tmp_hash = hashlib.sha256(normalize_pom(pom_text))
+    if input_resolver == 'mvn' and os.path.isfile(MAVEN_SETTINGS_FILE):
+        with open(MAVEN_SETTINGS_FILE, 'rb') as tmp_settings_file:
+            tmp_hash.update(tmp_settings_file.read())
+    return "{}|{}|{}".format(REMOTE_REPO_NAME, input_resolver, tmp_hash.hexdigest())
+
+def curate_artifact(client, coordinate, input_paths):
+    # Curate the files of one artifact as a set: warm the remote cache with each of them, then copy the ones that
+    # pulled to the local (curated) repo.  Returns the (path, stage) failures, the stage being 'pull' or 'copy'.
+    # NOTE: The .sha1/.md5 siblings aren't copied, Artifactory keeps the checksums with each file and serves them
+    #       from the local repo once the file is there.
+    tmp_failures = []
+    tmp_pulled = []
+    for tmp_path in input_paths:
+        # NOTE: The body is streamed and discarded, it only has to pass through the remote repo to be cached.
+        with curation_metrics.stage('warm', tmp_path) as tmp_stage:
+            tmp_fetch_output = client.fetch("{}/{}".format(str(REMOTE_REPO_NAME), tmp_path))
+            if not tmp_fetch_output.ok:
+                tmp_stage.fail(tmp_fetch_output.error or tmp_fetch_output.status)
+        if not tmp_fetch_output.ok:
+            logging.warning("Failed to pull '%s' with error: %s %s", tmp_path, tmp_fetch_output.status,
+                            tmp_fetch_output.error or tmp_fetch_output.text())
+            tmp_failures.append((tmp_path, 'pull'))
+            continue
+        logging.debug("  Pulled '%s' (%d bytes)", tmp_path, tmp_fetch_output.size)
+        tmp_pulled.append(tmp_path)
+    # NOTE: The copy API creates any missing folders in the target, so the directory doesn't have to be touched with
+    #       a PUT first.
+    for tmp_path in tmp_pulled:
+        with curation_metrics.stage('copy', tmp_path) as tmp_stage:
+            tmp_copy_output = client.copy(
+                "{}/{}".format(str(REMOTE_REPO_NAME), tmp_path),
+                "{}/{}".format(str(LOCAL_REPO_NAME), tmp_path)
+            )
+            # A '409: Conflict' means the file is already in the local repo.
+            if not (tmp_copy_output.ok or tmp_copy_output.conflict):
+                tmp_stage.fail(tmp_copy_output.error or tmp_copy_output.status)
+        if not (tmp_copy_output.ok or tmp_copy_output.conflict):
+            logging.warning("Failed to copy '%s' with error: %s %s", tmp_path, tmp_copy_output.status,
+                            tmp_copy_output.error or tmp_copy_output.text())
+            tmp_failures.append((tmp_path, 'copy'))
+            continue
+        curation_ledger.get_ledger().record_copy('maven', "{}/{}".format(LOCAL_REPO_NAME, tmp_path), True)
+    if not tmp_failures:
+        logging.info("Successfully curated '%s' (%d files)", coordinate, len(input_paths))
+    return tmp_failures
+
+def curate_pom(client, pom_text, input_dir = None):
+    # Curate every dependency of a pom.xml whose copy is in input_dir (for 'mvn').  Returns the curated coordinates
+    # and the paths that failed to pull and to copy.  Shared by main() and the curation service.
+    tmp_curation = PomCuration(client)
+    tmp_ledger = curation_ledger.get_ledger()
+    # The python resolver falls back on mvn, so a pom.xml it couldn't resolve may be recorded under the mvn key.
+    tmp_resolvers = ['python', 'mvn'] if MAVEN_RESOLVER == 'python' else ['mvn']
+    tmp_keys = [resolution_key(pom_text, tmp_resolver) for tmp_resolver in tmp_resolvers]
+    tmp_recorded = tmp_ledger.resolutions('maven', tmp_keys)
+    for tmp_key in tmp_keys:
+        if tmp_key in tmp_recorded:
+            # Resolved recently: skip the resolver and go straight to the copies.
+            logging.info("Resolution recorded in the ledger: %d dependencies", len(tmp_recorded[tmp_key]))
+            tmp_curation.add([maven_resolver.MavenCoordinate.parse(tmp_line) for tmp_line in tmp_recorded[tmp_key]])
+            logging.info("dependencies processed")
+            return tmp_curation.collect()
+    tmp_listed = None
+    tmp_resolver = None
+    tmp_resolved = False
+    if MAVEN_RESOLVER == 'python':
+        with curation_metrics.stage('resolve', 'pom.xml (python)') as tmp_stage:
+            try:
+                tmp_listed = list_dependencies_python(client, pom_text)
+            except (maven_resolver.ResolutionError, ET.ParseError) as tmp_err:
+                logging.warning("In-process resolution failed, falling back on 'mvn dependency:list': %s", tmp_err)
+                tmp_stage.fail(tmp_err)
+        if tmp_listed is not None:
+            tmp_resolved = True
+            tmp_resolver = 'python'
+            tmp_curation.add(tmp_listed)
+    if tmp_listed is None:
+        # The artifacts mvn lists start on their way to the local repo while mvn is still printing the rest.
+        tmp_stream = copy_scheduler.StreamBatcher(tmp_curation.add)
+        with curation_metrics.stage('resolve', 'pom.xml (mvn)') as tmp_stage:
+            tmp_listed, tmp_resolved = list_dependencies_mvn(input_dir, tmp_stream.add)
+            tmp_resolver = 'mvn'
+            if not tmp_listed:
+                tmp_stage.fail("no dependencies listed")
+        tmp_stream.flush()
+    if tmp_resolved:
+        # Recorded under the key of the resolver that produced the list, which for 'mvn' covers the Maven settings.
+        tmp_ledger.record_resolution('maven', resolution_key(pom_text, tmp_resolver),
+                                     [str(tmp_coordinate) for tmp_coordinate in tmp_listed])
+    logging.info("dependencies processed")
+    return tmp_curation.collect()
 
 ### CLASSES ###
+class PomCuration:
+    # Curates the dependencies of one pom.xml, taking them in as many groups as the resolver hands over.
+    def __init__(self, client):
+        self.client = client
+        self.ledger = curation_ledger.get_ledger()
+        self.scheduler = copy_scheduler.get_scheduler(client)
+        self.copy_successes = []
+        self._seen_paths = set()
+        self._pending = []
+
+    def add(self, input_coordinates):
+        tmp_coordinates = []
+        for tmp_coordinate in input_coordinates:
+            if tmp_coordinate.scope == 'system':
+                # 'system' dependencies come from the local filesystem, never from a repository.
+                logging.info("Skipping system dependency '%s'", tmp_coordinate)
+                continue
+            if tmp_coordinate.artifact_path not in self._seen_paths:
+                self._seen_paths.add(tmp_coordinate.artifact_path)
+                tmp_coordinates.append(tmp_coordinate)
+
+        # Skip every file that is already in the local (curated) repo: the ledger knows about the ones earlier runs
+        # copied, and one batched lookup finds the rest.
+        tmp_all_paths = [tmp_path for tmp_coordinate in tmp_coordinates for tmp_path in tmp_coordinate.paths()]
+        tmp_recorded = self.ledger.copied('maven', ["{}/{}".format(LOCAL_REPO_NAME, tmp_path) for tmp_path in tmp_all_paths])
+        tmp_present_paths = set(tmp_path for tmp_path in tmp_all_paths if "{}/{}".format(LOCAL_REPO_NAME, tmp_path) in tmp_recorded)
+        tmp_unrecorded = [tmp_path for tmp_path in tmp_all_paths if tmp_path not in tmp_present_paths]
+        for tmp_path in copy_scheduler.split_present(self.client, LOCAL_REPO_NAME, tmp_unrecorded)[0]:
+            self.ledger.record_copy('maven', "{}/{}".format(LOCAL_REPO_NAME, tmp_path), True)
+            tmp_present_paths.add(tmp_path)
+        logging.info("%d of %d files already curated (%d from the ledger)", len(tmp_present_paths), len(tmp_all_paths),
+                     len(tmp_recorded))
+
+        # Curate each artifact with its POM as one set: warm the remote cache, then copy them to the local (curated)
+        # repo.  Artifacts run through the pipeline concurrently, and each one moves on to its copies as soon as its
+        # own pulls have finished.
+        for tmp_coordinate in tmp_coordinates:
+            tmp_missing_paths = [tmp_path for tmp_path in tmp_coordinate.paths() if tmp_path not in tmp_present_paths]
+            if not tmp_missing_paths:
+                logging.info("Already curated '%s'", tmp_coordinate)
+                self.copy_successes.append(tmp_coordinate)
+                continue
+            self._pending.append((tmp_coordinate, self.scheduler.submit_call(curate_artifact, self.client, tmp_coordinate,
+                                                                             tmp_missing_paths)))
+
+    def collect(self):
+        # Wait for every artifact and return the curated coordinates and the paths that failed to pull and to copy.
+        tmp_jar_failures = []
+        tmp_copy_failures = []
+        for tmp_coordinate, tmp_future in self._pending:
+            tmp_failures = tmp_future.result()
+            if not tmp_failures:
+                self.copy_successes.append(tmp_coordinate)
+            for tmp_path, tmp_stage in tmp_failures:
+                if tmp_stage == 'pull':
+                    tmp_jar_failures.append(tmp_path)
+                else:
+                    tmp_copy_failures.append(tmp_path)
+        self._pending = []
+        logging.info("copies completed")
+        return self.copy_successes, tmp_jar_failures, tmp_copy_failures
 
 ### MAIN ###
 def main():
@@ -43,6 +239,7 @@ def main():
         format = "%(asctime)s:%(levelname)s:%(name)s:%(funcName)s: %(message)s",
         level = logging.DEBUG
     )
+    curation_metrics.start_run('maven')
 
     # Get the pom.xml from the payload stored in an environment variable and write it to a pom.xml file
     tmp_payload_json = os.environ['res_curatemaven_payload']
@@ -57,97 +254,16 @@ def main():
         tmp_pomxml_file.write(tmp_pomxml_str.decode())
     logging.info("pom.xml file written")
 
-    # Run 'mvn dependency:list' and process the output
-    tmp_jar_lines = []
-    tmp_mvn_output = subprocess.run('mvn -B dependency:list'.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-    logging.debug("tmp_mvn_output: %s", tmp_mvn_output)
-    tmp_mvn_str = tmp_mvn_output.stdout.decode()
-    tmp_mvn_list = tmp_mvn_str.split('\n')
-    logging.debug("tmp_mvn_list: %s", tmp_mvn_list)
-    for tmp_line in tmp_mvn_list:
-        logging.debug("  tmp_line: %s", tmp_line)
-        if (':jar:' in tmp_line) and ('has been relocated' not in tmp_line):
-            logging.debug("  ':jar:' found")
-            # NOTE: This should be expanded to handle 'ear' files and 'war' files.
-            # NOTE: This is crude parsing of the lines returned from maven
-            tmp_jar_lines.append(format_jar_line(tmp_line.replace('[INFO]    ', '')))
-    logging.info("dependencies processed")
+    tmp_login_data = {}
+    tmp_login_data['user'] = os.environ['int_artifactory_user']
+    tmp_login_data['apikey'] = os.environ['int_artifactory_apikey']
+    tmp_login_data['arti_url'] = os.environ['int_artifactory_url']
+    tmp_client = arti_client.get_client(tmp_login_data)
 
-    # Make http/curl requests to artifactory to curate each jar file
-    tmp_jar_failures = []
-    tmp_jar_successes = []
-    # NOTE: Using a shortcut here by shelling out to call CURL commands.  This should be updated to use urllib,
-    #       or better yet, a library like requests
-    for tmp_jar_line in tmp_jar_lines:
-        logging.debug("  tmp_jar_line: %s", tmp_jar_line)
-        tmp_curl_cmd = "curl -f -s -S -u{}:{} {}/{}/{}".format(
-            os.environ['int_artifactory_user'],
-            os.environ['int_artifactory_apikey'],
-            os.environ['int_artifactory_url'],
-            str(REMOTE_REPO_NAME),
-            tmp_jar_line
-        )
-        logging.debug("  tmp_curl_cmd: %s", tmp_curl_cmd)
-        tmp_curl_output = subprocess.run(tmp_curl_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        if tmp_curl_output.returncode == 0:
-            # Success, add to success list
-            logging.info("Successfully pulled '%s'", tmp_jar_line)
-            tmp_jar_successes.append(tmp_jar_line)
-        else:
-            # Failure, add to failure list
-            logging.warning("Failed to pull '%s' with error: %s", tmp_jar_line, tmp_curl_output.stderr)
-            tmp_jar_failures.append(tmp_jar_line)
-    logging.info("requests completed")
-
-    # Copy successfully pulled artifacts to the local (curated) repo.
-    tmp_copy_successes = []
-    tmp_copy_failures = []
-    for tmp_jar_line in tmp_jar_successes:
-        logging.debug("  tmp_jar_line: %s", tmp_jar_line)
-        # curl -XPOST -u${user}:${apikey} ${int_artifactory_url}/api/copy/${artBase}/${curate_image}?to=/shimi-curated/${artImageBase}/${curate_image}
-        # Make sure the directory exists.
-        # FIXME: Is this touching the directories needed?
-        #        Should we check for pre-existing versions?
-        #        Should we just overwrite the local repo files?
-        #        Can we detect copy errors due to the file already existing?
-        tmp_curl1_cmd = "curl -f -s -S -XPUT -u{}:{} {}/{}/{}".format(
-            os.environ['int_artifactory_user'],
-            os.environ['int_artifactory_apikey'],
-            os.environ['int_artifactory_url'],
-            str(LOCAL_REPO_NAME),
-            tmp_jar_line
-        )
-        logging.debug("  tmp_curl1_cmd: %s", tmp_curl1_cmd)
-        tmp_curl1_output = subprocess.run(tmp_curl1_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        if tmp_curl1_output.returncode == 0:
-            # Success, add to success list
-            logging.info("Successfully touched the directory '%s'", tmp_jar_line)
-        else:
-            # Failure
-            logging.warning("Failed to touch the directory '%s' with error: %s", tmp_jar_line, tmp_curl1_output.stderr)
-            tmp_copy_failures.append(tmp_jar_line)
-            continue  # Skip to the next cycle of the for loop
-        # Copy the JAR file
-        tmp_curl2_cmd = "curl -f -s -S -XPOST -u{}:{} {}/api/copy/{}/{}?to={}/{}".format(
-            os.environ['int_artifactory_user'],
-            os.environ['int_artifactory_apikey'],
-            os.environ['int_artifactory_url'],
-            str(REMOTE_REPO_NAME),
-            tmp_jar_line,
-            str(LOCAL_REPO_NAME),
-            tmp_jar_line
-        )
-        logging.debug("  tmp_curl2_cmd: %s", tmp_curl2_cmd)
-        tmp_curl2_output = subprocess.run(tmp_curl2_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        if tmp_curl2_output.returncode == 0:
-            # Success, add to success list
-            logging.info("Successfully copied '%s'", tmp_jar_line)
-            tmp_copy_successes.append(tmp_jar_line)
-        else:
-            # Failure
-            logging.warning("Failed to copy '%s' with error: %s", tmp_jar_line, tmp_curl2_output.stderr)
-            tmp_copy_failures.append(tmp_jar_line)
-    logging.info("copies completed")
+    # List the dependencies and curate them
+    tmp_copy_successes, tmp_jar_failures, tmp_copy_failures = curate_pom(tmp_client, tmp_pomxml_str.decode())
+    logging.info("%s", curation_ledger.get_ledger().stats)
+    curation_metrics.finish_run()
 
     # Write failure list to a file
     with open('curation_pull_failures.txt', 'w', encoding='utf-8') as tmp_fail_file:
@@ -160,10 +276,10 @@ def main():
 
     # Print a summary of the results and exit with a code if there are failures
     logging.info("The following artifacts have been successfully curated:")
-    for tmp_line in tmp_copy_successes:
-        logging.info("  %s", tmp_line)
+    for tmp_coordinate in tmp_copy_successes:
+        logging.info("  %s", tmp_coordinate)
     if len(tmp_jar_failures) > 0 or len(tmp_copy_failures) > 0:
-        logging.warning("The following artifacts require more attention:")
+        logging.warning("The following files require more attention:")
         for tmp_line in tmp_jar_failures:
             logging.warning("  (pull) %s", tmp_line)
         for tmp_line in tmp_copy_failures:
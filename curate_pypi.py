@@ -4,9 +4,32 @@
 import json
 import logging
 import os
+import re
 import subprocess
+import sys
+import tempfile
+
+import arti_client
+import copy_scheduler
+import curation_cache
+import curation_ledger
+import curation_metrics
+import line_runner
 
 ### GLOBALS ###
+# 'report' resolves with 'pip install --dry-run --report' (pip >= 22.2) without keeping any distributions.
+# 'download' runs 'pip download' and scrapes the "Downloading" lines, as older pip versions require.
+# NOTE: In 'report' mode pip only skips the download of a distribution whose index serves its metadata on its own
+#       (PEP 658).  For the others, which is most of them on indexes and remotes without metadata files, it still
+#       downloads the whole file to read its metadata and throws it away afterwards.
+PYPI_RESOLVE_MODE = os.environ.get('curate_pypi_resolve_mode', 'report')
+# Resolve every requirement line of the payload in a single pip run (needs the 'report' resolve mode).
+PYPI_BATCH_MODE = os.environ.get('curate_pypi_batch_mode', 'true').lower() == 'true'
+# pip cache kept between runs on the same node and trimmed at startup.  'none' goes back to '--no-cache'.
+PYPI_CACHE_SETTING = os.environ.get('curate_pypi_cache_dir', '')
+PYPI_CACHE_MAX_BYTES = int(os.environ.get('curate_pypi_cache_max_mb', '2048')) * 1024 * 1024
+PYPI_CACHE_MAX_AGE = int(os.environ.get('curate_pypi_cache_max_age_days', '14')) * 24 * 60 * 60
+PIP_CACHE_STATS = curation_cache.CacheStats("pip cache")
 
 ### FUNCTIONS ###
 def get_requirements_from_payload(payload_json):
@@ -18,6 +41,115 @@ def get_requirements_from_payload(payload_json):
     logging.debug("  pkg_contents: %s", pkg_contents)
     return pkg_contents
 
+def pypi_url_to_repo_path(input_url):
+    # https://<host>/artifactory/api/pypi/<repo>/packages/packages/<aa>/<bb>/<hash>/<file> -> <aa>/<bb>/<hash>/<file>
+    return "/".join(input_url.split('#')[0].split('/')[9:])
+
+def pypi_download_repo(login_data):
+    # Where pip downloads a distribution from the remote, the reverse of pypi_url_to_repo_path().  A GET there pulls
+    # the file into '<remote>-cache'.
+    return "api/pypi/{}/packages/packages".format(login_data['remote_repo'])
+
+def canonical_name(input_name):
+    return re.sub(r'[-_.]+', '-', input_name).lower()
+
+def parse_requirement(input_line):
+    # 'Requests[socks] >= 2.0 ; python_version > "3"' -> ('requests', {'socks'}), or (None, set()) for non-requirements.
+    tmp_match = re.match(r'\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[([^\]]*)\])?', input_line)
+    if not tmp_match:
+        return None, set()
+    tmp_extras = set(canonical_name(tmp_extra.strip()) for tmp_extra in (tmp_match.group(2) or '').split(',') if tmp_extra.strip())
+    return canonical_name(tmp_match.group(1)), tmp_extras
+
+def pip_cache_args():
+    if PYPI_CACHE_SETTING == 'none':
+        return ['--no-cache']
+    return ['--cache-dir', curation_cache.cache_dir('pypi', PYPI_CACHE_SETTING)]
+
+def prep_pip_cache():
+    if PYPI_CACHE_SETTING == 'none':
+        return
+    curation_cache.evict_directory(pip_cache_args()[1], PYPI_CACHE_MAX_BYTES, PYPI_CACHE_MAX_AGE)
+
+def record_pip_cache_use(input_lines):
+    # pip logs "Using cached <url>" for cache hits and "Downloading <url>" for everything fetched from the index.
+    tmp_hits = len([tmp_line for tmp_line in input_lines if tmp_line.strip().startswith("Using cached")])
+    tmp_misses = len([tmp_line for tmp_line in input_lines if tmp_line.strip().startswith("Downloading")])
+    PIP_CACHE_STATS.record(tmp_hits, tmp_misses)
+
+def run_pip_report(login_data, input_args):
+    # Returns the CompletedProcess and, when pip succeeded, the parsed installation report.  Not download free, see
+    # PYPI_RESOLVE_MODE.
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_report_file = os.path.join(tmp_dir, 'report.json')
+        pip_cmd = [
+            'pip', 'install', '--disable-pip-version-check', '--no-color', '--dry-run', '--ignore-installed',
+            '--report', tmp_report_file, '--index-url', login_data['pypi_index_url']
+        ] + pip_cache_args() + list(input_args)
+        pip_output = subprocess.run(pip_cmd, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        logging.debug("  pip_output: %s", pip_output)
+        record_pip_cache_use(pip_output.stdout.decode().splitlines())
+        if pip_output.returncode != 0:
+            return pip_output, None
+        with open(tmp_report_file, 'r', encoding='utf-8') as tmp_file:
+            return pip_output, json.load(tmp_file)
+
+def pip_report_unsupported(pip_output):
+    return b'no such option' in pip_output.stderr
+
+def get_login_data(local_repo, remote_repo):
+    tmp_login_data = {}
+    tmp_login_data['user'] = os.environ['int_artifactory_user']
+    tmp_login_data['apikey'] = os.environ['int_artifactory_apikey']
+    tmp_login_data['arti_url'] = os.environ['int_artifactory_url']
+    tmp_login_data['local_repo'] = local_repo
+    tmp_login_data['remote_repo'] = remote_repo
+    tmp_login_data['pypi_index_url'] = "{}//{}:{}@{}/artifactory/api/pypi/{}/simple".format(
+        str(tmp_login_data['arti_url'].split('/')[0]),
+        tmp_login_data['user'],
+        tmp_login_data['apikey'],
+        str(tmp_login_data['arti_url'].split('/')[2]),
+        tmp_login_data['remote_repo']
+    )
+    return tmp_login_data
+
+def curate_packages(login_data, packages):
+    # Curate a list of requirement lines and return ([(line, success)], copy failures).  Shared by main() and the
+    # curation service.
+    tmp_results = None
+    tmp_copy_failures = []
+    if PYPI_BATCH_MODE and PYPI_RESOLVE_MODE == 'report':
+        tmp_batchpuller = PythonBatchPuller(login_data, packages)
+        tmp_batchpuller.curate()
+        tmp_batchpuller.finish()
+        tmp_copy_failures = list(tmp_batchpuller.copies.failures)
+        if tmp_batchpuller.resolved:
+            tmp_results = tmp_batchpuller.results()
+        else:
+            # One bad line fails the whole resolution, so retry line by line to isolate the failures.
+            logging.info("Falling back to resolving each requirement line separately")
+    if tmp_results is None:
+        tmp_pythonpackagepullers = []
+        for tmp_pkg in packages:
+            tmp_pythonpackagepullers.append(PythonPackagePuller(login_data, tmp_pkg))
+        # Each puller's copies run in the background while the next puller resolves.
+        for tmp_puller in tmp_pythonpackagepullers:
+            tmp_puller.curate()
+        for tmp_puller in tmp_pythonpackagepullers:
+            tmp_puller.finish()
+            tmp_copy_failures.extend(tmp_puller.copies.failures)
+        tmp_results = [(tmp_puller.package_line, tmp_puller.success) for tmp_puller in tmp_pythonpackagepullers]
+    return tmp_results, tmp_copy_failures
+
+def resolution_key(login_data, package_line):
+    # Ledger key of a requirement line: what pip selects also depends on the index and the interpreter version.
+    return "{}|py{}.{}|{}".format(login_data['remote_repo'], sys.version_info[0], sys.version_info[1], package_line)
+
+def batch_resolution_key(login_data, package_lines):
+    # Ledger key of requirement lines resolved together.  The versions pip picks for one line depend on the other
+    # lines, so the record is only used again for the very same set of lines.
+    return resolution_key(login_data, "batch:{}".format("\n".join(sorted(set(package_lines)))))
+
 ### CLASSES ###
 class PythonPackagePuller:
     def __init__(self, login_data, package_line):
@@ -26,25 +158,49 @@ class PythonPackagePuller:
         self.package_line = package_line
         self.to_copy = []
         self.success = False
+        self.client = arti_client.get_client(login_data)
+        self.copies = copy_scheduler.CopyBatch(copy_scheduler.get_scheduler(self.client), 'pypi')
+        self.stream = copy_scheduler.StreamBatcher(self._copy_paths)
+        # The file pip is downloading, see _on_pip_line().
+        self._downloading = None
+        self.ledger = curation_ledger.get_ledger()
         self.logger.debug("PythonPackagePuller for package: %s", self.package_line)
 
-    def _install_package(self):
-        self.logger.debug("Installing the package")
-        # NOTE: A report option was added in pip v 22.2, but our installation isn't using that version currently.
+    def _on_pip_line(self, input_line):
+        # A file is in the remote's cache once pip has read all of it, which is when pip prints its next line.
+        if self._downloading is not None:
+            self.stream.add(self._downloading)
+            self._downloading = None
+        self.stream.poll()
+        record_pip_cache_use([input_line])
+        if input_line[0:13] == "  Downloading":
+            tmp_pkg_split = input_line.split(" ")
+            self.logger.debug("  tmp_pkg_split: %s", tmp_pkg_split)
+            self._downloading = pypi_url_to_repo_path(tmp_pkg_split[3])
+        elif input_line[0:14] == "  Using cached" and "://" in input_line:
+            # NOTE: Wheels built locally from an sdist are logged by file name only and aren't in the remote.
+            tmp_pkg_split = input_line.split(" ")
+            self.logger.debug("  tmp_pkg_split: %s", tmp_pkg_split)
+            self.stream.add(pypi_url_to_repo_path(tmp_pkg_split[4]))
+
+    def _download_package(self):
+        self.logger.debug("Downloading the package")
         # NOTE: The image that is used to run this script should be kept in sync with the python version being used for
         #       development and deployment, otherwise there may be potential version misses.
         # pip_cmd = "pip install --disable-pip-version-check --no-color --no-cache --ignore-installed --index-url {} {}".format(
         #     PYPI_INDEX_URL,
         #     self.package_line
         # )
-        pip_cmd = "pip download --disable-pip-version-check --no-color --no-cache --index-url {} {}".format(
+        pip_cmd = "pip download --disable-pip-version-check --no-color --index-url {} {}".format(
             self.login_data['pypi_index_url'],
             self.package_line
         )
-        pip_output = subprocess.run(pip_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+        # NOTE: Each file is copied as soon as pip has downloaded it, while pip goes on with the rest.  Files a
+        #       failed run had already downloaded stay curated, they are fine on their own.
+        pip_output = line_runner.run_lines(pip_cmd.split(' ') + pip_cache_args(), self._on_pip_line)
         self.logger.debug("  pip_output: %s", pip_output)
         # Check for a failed install
-        if pip_output.returncode is not 0:
+        if pip_output.returncode != 0:
             # NOTE: Since the output from the pip command is captured, it is
             #       possible to parse the output and figure out which dependency
             #       failed.  This isn't required for this example as the failed
@@ -52,41 +208,209 @@ class PythonPackagePuller:
             self.logger.warning("Failed to install package: %s", self.package_line)
             self.logger.warning("  Error: %s", pip_output.stderr.decode())
             return
-        # Install succeeded, so process the output
+        # Install succeeded, so the last download is complete too
+        self.success = True
+        if self._downloading is not None:
+            self.stream.add(self._downloading)
+            self._downloading = None
+        self.to_copy = list(self.stream.items)
+        self.logger.debug("  self._to_copy: %s", self.to_copy)
+
+    def _resolve_report(self):
+        self.logger.debug("Resolving the package with a pip installation report")
+        pip_output, tmp_report = run_pip_report(self.login_data, [self.package_line])
+        if tmp_report is None:
+            if pip_report_unsupported(pip_output):
+                # pip older than 22.2, so the caller falls back to 'pip download'.
+                self.logger.info("  pip doesn't support '--report', falling back to 'pip download'")
+                return False
+            self.logger.warning("Failed to resolve package: %s", self.package_line)
+            self.logger.warning("  Error: %s", pip_output.stderr.decode())
+            return True
         self.success = True
-        tmp_output = pip_output.stdout.decode().splitlines()
-        self.logger.debug("  pip_output.stdout: %s", tmp_output)
-        for item in tmp_output:
-            if item[0:13] == "  Downloading":
-                tmp_pkg_split = item.split(" ")
-                self.logger.debug("  tmp_pkg_split: %s", tmp_pkg_split)
-                tmp_pkg_split2 = tmp_pkg_split[3].split('/')
-                self.logger.debug("  tmp_pkg_split2: %s", tmp_pkg_split2)
-                self.to_copy.append("/".join(tmp_pkg_split2[9:]))
+        for tmp_item in tmp_report.get('install', []):
+            self.logger.debug("  %s %s: %s", tmp_item['metadata']['name'], tmp_item['metadata']['version'],
+                              tmp_item['download_info']['url'])
+            self.to_copy.append(pypi_url_to_repo_path(tmp_item['download_info']['url']))
         self.logger.debug("  self._to_copy: %s", self.to_copy)
+        return True
+
+    def _install_package(self):
+        self.logger.debug("Installing the package")
+        if PYPI_RESOLVE_MODE == 'report' and self._resolve_report():
+            return
+        self._download_package()
+
+    def _copy_paths(self, input_paths):
+        # NOTE: 'pip install --dry-run --report' may resolve from PEP 658 metadata or the pip cache, and a resolution
+        #       from the ledger downloads nothing, so any file that isn't cached yet is pulled through the remote before
+        #       its copy.
+        self.copies.add_paths(
+            "{}-cache".format(self.login_data['remote_repo']), self.login_data['local_repo'], input_paths,
+            pypi_download_repo(self.login_data)
+        )
 
     def _copy_to_local(self):
         self.logger.debug("Copying package and dependencies to local repo")
-        for pkg in self.to_copy:
-            self.logger.debug("  pkg: %s", pkg)
-            curl_cmd = "curl -f -XPOST -u{}:{} {}/api/copy/{}/{}?to=/{}/{}".format(
-                self.login_data['user'],
-                self.login_data['apikey'],
-                self.login_data['arti_url'],
-                "{}-cache".format(self.login_data['remote_repo']),
-                pkg,
-                self.login_data['local_repo'],
-                pkg
-            )
-            curl_output = subprocess.run(curl_cmd.split(' '), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.logger.debug("  curl_output: %s", curl_output)
+        # Files streamed to their copies while pip ran are skipped.
+        self.stream.extend(self.to_copy)
 
     def curate(self):
         self.logger.info("Curating PyPi package: %s", self.package_line)
-        # Should figure out how to configure pip to pull from remote repo...
-        self._install_package()
+        tmp_key = resolution_key(self.login_data, self.package_line)
+        tmp_recorded = self.ledger.resolutions('pypi', [tmp_key])
+        if tmp_key in tmp_recorded:
+            self.logger.info("  Resolution recorded in the ledger: %d files", len(tmp_recorded[tmp_key]))
+            self.success = True
+            self.to_copy = tmp_recorded[tmp_key]
+        else:
+            # Should figure out how to configure pip to pull from remote repo...
+            with curation_metrics.stage('resolve', self.package_line) as tmp_stage:
+                self._install_package()
+                if not self.success:
+                    tmp_stage.fail("pip failed")
+            if self.success:
+                self.ledger.record_resolution('pypi', tmp_key, self.to_copy)
         self._copy_to_local()
 
+    def finish(self):
+        # Wait for the copies scheduled by curate() and fold any failed file into the package result.
+        self.copies.collect()
+        if self.copies.failures:
+            self.success = False
+        self.logger.info("Copied %d files for '%s' (%d failed)", len(self.copies.results), self.package_line,
+                         len(self.copies.failures))
+
+class PythonBatchPuller:
+    def __init__(self, login_data, package_lines):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.login_data = login_data
+        self.package_lines = package_lines
+        self.to_copy = []
+        # Repository path -> the requested lines that pulled it in.
+        self.provenance = {}
+        self.resolved = False
+        self.client = arti_client.get_client(login_data)
+        self.copies = copy_scheduler.CopyBatch(copy_scheduler.get_scheduler(self.client), 'pypi')
+        self.ledger = curation_ledger.get_ledger()
+        self.logger.debug("PythonBatchPuller for %d requirement lines", len(self.package_lines))
+
+    def _lines_for(self, input_report, input_lines):
+        # Walk requires_dist from each requested line so every resolved distribution can be traced back to the
+        # lines that need it.  Environment markers are not evaluated: the report only contains what pip selected.
+        tmp_items = {}
+        for tmp_item in input_report.get('install', []):
+            tmp_items[canonical_name(tmp_item['metadata']['name'])] = tmp_item
+        tmp_lines = {}
+        for tmp_line in input_lines:
+            tmp_name, tmp_extras = parse_requirement(tmp_line)
+            if tmp_name is None or tmp_name not in tmp_items:
+                continue
+            tmp_pending = [(tmp_name, tmp_extras)]
+            tmp_seen = set()
+            while tmp_pending:
+                tmp_name, tmp_extras = tmp_pending.pop()
+                if tmp_name in tmp_seen:
+                    continue
+                tmp_seen.add(tmp_name)
+                tmp_lines.setdefault(tmp_name, []).append(tmp_line)
+                for tmp_requires in tmp_items[tmp_name]['metadata'].get('requires_dist', []):
+                    tmp_extra_marker = re.search(r'extra\s*==\s*[\'"]([^\'"]+)[\'"]', tmp_requires)
+                    if tmp_extra_marker and canonical_name(tmp_extra_marker.group(1)) not in tmp_extras:
+                        continue
+                    tmp_dep_name, tmp_dep_extras = parse_requirement(tmp_requires)
+                    if tmp_dep_name in tmp_items:
+                        tmp_pending.append((tmp_dep_name, tmp_dep_extras))
+        return tmp_items, tmp_lines
+
+    def _add_path(self, input_path, input_lines):
+        if input_path not in self.provenance:
+            self.to_copy.append(input_path)
+            self.provenance[input_path] = []
+        for tmp_line in input_lines:
+            if tmp_line not in self.provenance[input_path]:
+                self.provenance[input_path].append(tmp_line)
+
+    def _resolve(self):
+        # Lines resolved on their own by a recent run come from the ledger, and the rest are resolved together, or
+        # taken from the ledger when a recent run resolved that same set of lines.
+        tmp_keys = dict((tmp_line, resolution_key(self.login_data, tmp_line)) for tmp_line in self.package_lines)
+        tmp_recorded = self.ledger.resolutions('pypi', tmp_keys.values())
+        tmp_pending = []
+        for tmp_line in self.package_lines:
+            if tmp_keys[tmp_line] in tmp_recorded:
+                for tmp_path in tmp_recorded[tmp_keys[tmp_line]]:
+                    self._add_path(tmp_path, [tmp_line])
+            else:
+                tmp_pending.append(tmp_line)
+        self.logger.info("%d of %d requirement lines resolved from the ledger", len(self.package_lines) - len(tmp_pending),
+                         len(self.package_lines))
+        tmp_batch_key = batch_resolution_key(self.login_data, tmp_pending)
+        tmp_batch = self.ledger.resolutions('pypi', [tmp_batch_key]).get(tmp_batch_key) if tmp_pending else None
+        if tmp_batch is not None:
+            self.logger.info("The other %d requirement lines were resolved together by a recent run", len(tmp_pending))
+            for tmp_path, tmp_lines in tmp_batch:
+                self._add_path(tmp_path, tmp_lines)
+        elif tmp_pending:
+            self.logger.debug("Resolving %d requirement lines in one pass", len(tmp_pending))
+            with curation_metrics.stage('resolve', "{} requirement lines".format(len(tmp_pending))) as tmp_stage:
+                with tempfile.TemporaryDirectory() as tmp_dir:
+                    tmp_requirements_file = os.path.join(tmp_dir, 'requirements.txt')
+                    with open(tmp_requirements_file, 'w', encoding='utf-8') as tmp_file:
+                        for tmp_line in tmp_pending:
+                            tmp_file.write("{}\n".format(tmp_line))
+                    pip_output, tmp_report = run_pip_report(self.login_data, ['-r', tmp_requirements_file])
+                if tmp_report is None:
+                    tmp_stage.fail("pip failed")
+            if tmp_report is None:
+                self.logger.warning("Failed to resolve the requirement set in one pass")
+                self.logger.warning("  Error: %s", pip_output.stderr.decode())
+                return
+            tmp_items, tmp_lines = self._lines_for(tmp_report, tmp_pending)
+            tmp_batch = []
+            for tmp_name, tmp_item in tmp_items.items():
+                tmp_path = pypi_url_to_repo_path(tmp_item['download_info']['url'])
+                if not tmp_lines.get(tmp_name):
+                    # Not reached from any line by the requires_dist walk (e.g. a requirement it can't parse), so
+                    # every line of the batch may need it.
+                    self.logger.info("  %s can't be traced to a requirement line, attributing it to the batch", tmp_path)
+                    tmp_lines[tmp_name] = list(tmp_pending)
+                self._add_path(tmp_path, tmp_lines[tmp_name])
+                tmp_batch.append([tmp_path, tmp_lines[tmp_name]])
+                self.logger.info("  %s <- %s", tmp_path, self.provenance[tmp_path])
+            # NOTE: Not recorded per line, replaying one line on its own could give a set no resolution of that line
+            #       alone would pick.
+            self.ledger.record_resolution('pypi', tmp_batch_key, tmp_batch)
+        self.resolved = True
+        self.logger.debug("  self.to_copy: %s", self.to_copy)
+
+    def _copy_to_local(self):
+        self.logger.debug("Copying %d unique distributions to local repo", len(self.to_copy))
+        # Distributions the report didn't download are pulled through the remote first, see PythonPackagePuller.
+        self.copies.add_paths(
+            "{}-cache".format(self.login_data['remote_repo']), self.login_data['local_repo'], self.to_copy,
+            pypi_download_repo(self.login_data)
+        )
+
+    def curate(self):
+        self.logger.info("Curating %d PyPi requirement lines as one batch", len(self.package_lines))
+        self._resolve()
+        if self.resolved:
+            self._copy_to_local()
+
+    def finish(self):
+        self.copies.collect()
+        for pkg in self.copies.failures:
+            self.logger.warning("  '%s' is needed by: %s", pkg, self.provenance[pkg])
+        self.logger.info("Copied %d files (%d failed)", len(self.copies.results), len(self.copies.failures))
+
+    def results(self):
+        # A line is curated when the batch resolved and none of the files it needs failed to copy.
+        tmp_failed_lines = set()
+        for pkg in self.copies.failures:
+            tmp_failed_lines.update(self.provenance[pkg])
+        return [(tmp_line, self.resolved and tmp_line not in tmp_failed_lines) for tmp_line in self.package_lines]
+
 ### MAIN ###
 def main():
     # Set up logging
@@ -94,35 +418,19 @@ def main():
         format = "%(asctime)s:%(levelname)s:%(name)s:%(funcName)s: %(message)s",
         level = logging.DEBUG
     )
+    curation_metrics.start_run('pypi')
 
     logging.debug("Environment Prep Starting")
     tmp_payload_json = os.environ['res_curatepypi_payload']
     tmp_packages = get_requirements_from_payload(tmp_payload_json)
 
-    tmp_login_data = {}
-    tmp_login_data['user'] = os.environ['int_artifactory_user']
-    tmp_login_data['apikey'] = os.environ['int_artifactory_apikey']
-    tmp_login_data['arti_url'] = os.environ['int_artifactory_url']
-    tmp_login_data['local_repo'] = os.environ['local_repo_name']
-    tmp_login_data['remote_repo'] = os.environ['remote_repo_name']
-    tmp_login_data['pypi_index_url'] = "{}//{}:{}@{}/artifactory/api/pypi/{}/simple".format(
-        str(tmp_login_data['arti_url'].split('/')[0]),
-        tmp_login_data['user'],
-        tmp_login_data['apikey'],
-        str(tmp_login_data['arti_url'].split('/')[2]),
-        tmp_login_data['remote_repo']
-    )
+    tmp_login_data = get_login_data(os.environ['local_repo_name'], os.environ['remote_repo_name'])
 
-    # NOTE: Currently this script uses the '--no-cache' option for pip, which
-    #       forces download of all packages for each run of the pip command.
-    #       This could be made a bit more efficient by allowing the cache for
-    #       each run, but wiping out the cache at the start of the script.
+    # NOTE: pip's cache is kept between runs on this node, and trimmed by age
+    #       and size here before anything is resolved.
+    prep_pip_cache()
 
-    tmp_pythonpackagepullers = []
-    for tmp_pkg in tmp_packages:
-        tmp_pythonpackagepullers.append(PythonPackagePuller(tmp_login_data, tmp_pkg))
-    for tmp_puller in tmp_pythonpackagepullers:
-        tmp_puller.curate()
+    tmp_results, tmp_copy_failures = curate_packages(tmp_login_data, tmp_packages)
 
     # Report Results
     # NOTE: This just prints the results to the log output.  This information
@@ -131,11 +439,14 @@ def main():
     logging.info("Gathering Results")
     tmp_successes = []
     tmp_failures = []
-    for tmp_puller in tmp_pythonpackagepullers:
-        if tmp_puller.success:
-            tmp_successes.append(tmp_puller.package_line)
+    for tmp_line, tmp_success in tmp_results:
+        if tmp_success:
+            tmp_successes.append(tmp_line)
         else:
-            tmp_failures.append(tmp_puller.package_line)
+            tmp_failures.append(tmp_line)
+    logging.info("%s", PIP_CACHE_STATS)
+    logging.info("%s", curation_ledger.get_ledger().stats)
+    curation_metrics.finish_run()
     logging.info("Successfully Curated:")
     for item in tmp_successes:
         logging.info("  %s", item)
@@ -143,6 +454,10 @@ def main():
         logging.warning("Failed to Curate:")
         for item in tmp_failures:
             logging.warning("  %s", item)
+    if len(tmp_copy_failures) > 0:
+        logging.warning("Failed to Copy:")
+        for item in tmp_copy_failures:
+            logging.warning("  %s", item)
 
 if __name__ == '__main__':
     main()
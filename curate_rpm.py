@@ -6,7 +6,19 @@ import logging
 import os
 import subprocess
 
+import arti_client
+import copy_scheduler
+import curation_ledger
+import curation_metrics
+import line_runner
+import rpm_resolver
+
 ### GLOBALS ###
+# 'repodata' computes each package's closure from the remote repo's metadata, 'yum' runs 'yum install --downloadonly'
+# (which needs root and the yum lock).  'repodata' falls back on 'yum' if the metadata can't be loaded.
+RPM_RESOLVER = os.environ.get('curate_rpm_resolver', 'repodata')
+# Resolve every package of the payload together and copy the combined set once.
+RPM_BATCH_MODE = os.environ.get('curate_rpm_batch_mode', 'true').lower() == 'true'
 
 ### FUNCTIONS ###
 def get_packages_from_payload(payload_json):
@@ -55,23 +67,130 @@ gpgkey=file:///etc/pki/rpm-gpg/RPM-GPG-KEY-CentOS-7
     yum_output = subprocess.run(yum_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
     logging.debug("  yum_output: %s", yum_output)
 
+def resolution_key(login_data, package_line):
+    # Ledger key of a requested package, within the repo layout it was resolved against.
+    return "{}|{}/{}|{}".format(login_data['remote_repo'], rpm_resolver.RPM_RELEASEVER, rpm_resolver.RPM_BASEARCH,
+                                package_line)
+
+def run_yum_download(package_lines, on_path, on_line = None):
+    # Each package of yum's transaction is handed to on_path as soon as yum lists it, before yum downloads them, and
+    # every other line to on_line.
+    yum_cmd = "yum install --downloadonly {}".format(
+        " ".join(package_lines)
+    )
+    def tmp_on_line(input_line):
+        tmp_repo_path = parse_yum_line(input_line)
+        if tmp_repo_path is not None:
+            on_path(tmp_repo_path)
+        elif on_line is not None:
+            on_line(input_line)
+    yum_output = line_runner.run_lines(yum_cmd.split(' '), tmp_on_line)
+    logging.debug("  yum_output: %s", yum_output)
+    return yum_output
+
+def parse_yum_line(item):
+    # FIXME: What is the stdout format for yum?
+    if (len(item) > 2) and (item[0] == ' ') and (item[-1] in ['k', 'M']):
+        logging.debug("  item: %s", item)
+        tmp_split = list(filter(None, item.split(' ')))
+        logging.debug("  tmp_split: %s", tmp_split)
+        tmp_version_split = tmp_split[2].split(':')
+        # NOTE: The following path is hard coded to CentOS 7 on x86_64.  This will have to be
+        #       modified or supplied to the script if a different distribution or a different
+        #       repository is used.
+        tmp_repo_path = "7/{}/x86_64/Packages/{}-{}.{}.rpm".format(
+            'os' if tmp_split[3] == 'base' else tmp_split[3],
+            tmp_split[0],
+            tmp_version_split[1] if len(tmp_version_split) == 2 else tmp_version_split[0],
+            tmp_split[1]
+        )
+        logging.debug("  tmp_repo_path: %s", tmp_repo_path)
+        return tmp_repo_path
+    return None
+
+def get_login_data(local_repo, remote_repo):
+    tmp_login_data = {}
+    tmp_login_data['user'] = os.environ['int_artifactory_user']
+    tmp_login_data['apikey'] = os.environ['int_artifactory_apikey']
+    tmp_login_data['arti_url'] = os.environ['int_artifactory_url']
+    tmp_login_data['local_repo'] = local_repo
+    tmp_login_data['remote_repo'] = remote_repo
+    return tmp_login_data
+
+def prepare_resolver(login_data, packages):
+    # Load what the packages need resolved with: the repodata index, or the yum repos directory when the index can't
+    # be loaded.  Returns the index, or None for yum.  Nothing has to be resolved when the ledger has a recent
+    # resolution for every package.
+    tmp_keys = set(resolution_key(login_data, tmp_pkg) for tmp_pkg in packages)
+    tmp_needs_resolver = len(curation_ledger.get_ledger().resolutions('rpm', tmp_keys)) < len(tmp_keys)
+
+    # Load the remote repo's metadata once for all the packages
+    tmp_index = None
+    if tmp_needs_resolver and RPM_RESOLVER == 'repodata':
+        tmp_source = rpm_resolver.ArtifactoryRepoSource(arti_client.get_client(login_data), login_data['remote_repo'])
+        with curation_metrics.stage('metadata', login_data['remote_repo']) as tmp_stage:
+            try:
+                tmp_index = rpm_resolver.load_index(tmp_source)
+            except rpm_resolver.ResolutionError as tmp_err:
+                logging.warning("Failed to load the repodata, falling back on yum: %s", tmp_err)
+                tmp_stage.fail(tmp_err)
+
+    if tmp_needs_resolver and tmp_index is None:
+        # Prep the yum.repos.d directory
+        logging.debug("Preparing the yum repos directory")
+        prep_repos_dir(login_data)
+    return tmp_index
+
+def curate_packages(login_data, packages, index):
+    # Curate a list of packages and return ([(line, success)], copy failures).  Shared by main() and the curation
+    # service.
+    tmp_results = None
+    tmp_copy_failures = []
+    if RPM_BATCH_MODE:
+        tmp_batchpuller = RPMBatchPuller(login_data, packages, index)
+        tmp_batchpuller.curate()
+        tmp_batchpuller.finish()
+        tmp_copy_failures = list(tmp_batchpuller.copies.failures)
+        if tmp_batchpuller.resolved:
+            tmp_results = tmp_batchpuller.results()
+        else:
+            # One bad package fails the whole yum transaction, so retry package by package to isolate the failures.
+            logging.info("Falling back to resolving each package separately")
+    if tmp_results is None:
+        logging.debug("Starting the threads")
+        tmp_rpmpackagepullers = []
+        for tmp_pkg in packages:
+            tmp_rpmpackagepullers.append(RPMPackagePuller(login_data, tmp_pkg, index))
+        # Each puller's copies run in the background while the next puller resolves.
+        for tmp_puller in tmp_rpmpackagepullers:
+            tmp_puller.curate()
+        for tmp_puller in tmp_rpmpackagepullers:
+            tmp_puller.finish()
+            tmp_copy_failures.extend(tmp_puller.copies.failures)
+        tmp_results = [(tmp_puller.package_line, tmp_puller.success) for tmp_puller in tmp_rpmpackagepullers]
+    return tmp_results, tmp_copy_failures
+
 ### CLASSES ###
 class RPMPackagePuller:
-    def __init__(self, login_data, package_line):
+    def __init__(self, login_data, package_line, index = None):
         self.logger = logging.getLogger(type(self).__name__)
         self.login_data = login_data
         self.package_line = package_line
+        # Shared rpm_resolver.RepodataIndex, or None to resolve with yum.
+        self.index = index
         self.to_copy = []
         self.success = False
+        self.client = arti_client.get_client(login_data)
+        self.copies = copy_scheduler.CopyBatch(copy_scheduler.get_scheduler(self.client), 'rpm')
+        self.stream = copy_scheduler.StreamBatcher(self._copy_paths)
+        self.ledger = curation_ledger.get_ledger()
         self.logger.debug("RPMPackagePuller for package: %s", self.package_line)
 
     def _install_package(self):
         self.logger.debug("Getting the package")
-        yum_cmd = "yum install --downloadonly {}".format(
-            self.package_line
-        )
-        yum_output = subprocess.run(yum_cmd.split(' '), stdout = subprocess.PIPE, stderr = subprocess.PIPE)
-        self.logger.debug("  yum_output: %s", yum_output)
+        # NOTE: Packages are copied (pulled through the remote first) while yum is still downloading.  The ones a
+        #       failed run had listed stay curated, they are fine on their own.
+        yum_output = run_yum_download([self.package_line], self.stream.add, lambda tmp_line: self.stream.poll())
         # Check for a failed install
         if yum_output.returncode is not 0:
             # NOTE: Since the output from the yum command is captured, it is
@@ -83,51 +202,194 @@ class RPMPackagePuller:
             return
         # Install succeeded, so process the output
         self.success = True
-        tmp_output = yum_output.stdout.decode().splitlines()
-        self.logger.debug("  yum_output.stdout: %s", tmp_output)
-        # FIXME: What is the stdout format for yum?
-        for item in tmp_output:
-            if (len(item) > 2) and (item[0] == ' ') and (item[-1] in ['k', 'M']):
-                self.logger.debug("  item: %s", item)
-                tmp_split = list(filter(None, item.split(' ')))
-                self.logger.debug("  tmp_split: %s", tmp_split)
-                tmp_version_split = tmp_split[2].split(':')
-                # NOTE: The following path is hard coded to CentOS 7 on x86_64.  This will have to be
-                #       modified or supplied to the script if a different distribution or a different
-                #       repository is used.
-                tmp_repo_path = "7/{}/x86_64/Packages/{}-{}.{}.rpm".format(
-                    'os' if tmp_split[3] == 'base' else tmp_split[3],
-                    tmp_split[0],
-                    tmp_version_split[1] if len(tmp_version_split) == 2 else tmp_version_split[0],
-                    tmp_split[1]
-                )
-                self.logger.debug("  tmp_repo_path: %s", tmp_repo_path)
-                self.to_copy.append(tmp_repo_path)
+        self.to_copy = list(self.stream.items)
         self.logger.debug("  self._to_copy: %s", self.to_copy)
 
+    def _resolve_package(self):
+        self.logger.debug("Resolving the package from the repodata")
+        tmp_package = self.index.find(self.package_line)
+        if tmp_package is None:
+            self.logger.warning("No package matches: %s", self.package_line)
+            return
+        tmp_closure, tmp_missing = self.index.closure(tmp_package)
+        if tmp_missing:
+            # Same outcome as a failed 'yum install': refer the package to manual review.
+            self.logger.warning("Failed to resolve package: %s", self.package_line)
+            for tmp_requirement in tmp_missing:
+                self.logger.warning("  Unresolved: %s", tmp_requirement)
+            return
+        self.success = True
+        self.to_copy = [tmp_member.location for tmp_member in tmp_closure]
+        self.logger.debug("  self.to_copy: %s", self.to_copy)
+
+    def _copy_paths(self, input_paths):
+        # FIXME: Is the '-cache' part needed for the RPM repos?
+        # NOTE: Packages resolved from the repodata or the ledger haven't been downloaded, so any that aren't cached
+        #       yet are pulled through the remote before their copy.
+        self.copies.add_paths(
+            "{}-cache".format(self.login_data['remote_repo']), self.login_data['local_repo'], input_paths,
+            self.login_data['remote_repo']
+        )
+
     def _copy_to_local(self):
         self.logger.debug("Copying package and dependencies to local repo")
-        for pkg in self.to_copy:
-            self.logger.debug("  pkg: %s", pkg)
-            # FIXME: Is the '-cache' part needed for the RPM repos?
-            curl_cmd = "curl -f -XPOST -u{}:{} {}/api/copy/{}/{}?to=/{}/{}".format(
-                self.login_data['user'],
-                self.login_data['apikey'],
-                self.login_data['arti_url'],
-                "{}-cache".format(self.login_data['remote_repo']),
-                pkg,
-                self.login_data['local_repo'],
-                pkg
-            )
-            curl_output = subprocess.run(curl_cmd.split(' '), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            self.logger.debug("  curl_output: %s", curl_output)
+        # Packages streamed to their copies while yum ran are skipped.
+        self.stream.extend(self.to_copy)
 
     def curate(self):
         self.logger.info("Curating RPM package: %s", self.package_line)
-        # Should figure out how to configure pip to pull from remote repo...
-        self._install_package()
+        tmp_key = resolution_key(self.login_data, self.package_line)
+        tmp_recorded = self.ledger.resolutions('rpm', [tmp_key])
+        if tmp_key in tmp_recorded:
+            self.logger.info("  Resolution recorded in the ledger: %d packages", len(tmp_recorded[tmp_key]))
+            self.success = True
+            self.to_copy = tmp_recorded[tmp_key]
+        else:
+            with curation_metrics.stage('resolve', self.package_line) as tmp_stage:
+                if self.index is not None:
+                    self._resolve_package()
+                else:
+                    self._install_package()
+                if not self.success:
+                    tmp_stage.fail("unresolved")
+            if self.success:
+                self.ledger.record_resolution('rpm', tmp_key, self.to_copy)
         self._copy_to_local()
 
+    def finish(self):
+        # Wait for the copies scheduled by curate() and fold any failed file into the package result.
+        self.copies.collect()
+        if self.copies.failures:
+            self.success = False
+        self.logger.info("Copied %d files for '%s' (%d failed)", len(self.copies.results), self.package_line,
+                         len(self.copies.failures))
+
+class RPMBatchPuller:
+    def __init__(self, login_data, package_lines, index = None):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.login_data = login_data
+        self.package_lines = package_lines
+        self.index = index
+        self.to_copy = []
+        # Repository path -> the requested packages that need it.
+        self.provenance = {}
+        self.resolved = False
+        # Requested packages that couldn't be resolved on their own, while the rest of the batch could.
+        self.unresolved = set()
+        self.client = arti_client.get_client(login_data)
+        self.copies = copy_scheduler.CopyBatch(copy_scheduler.get_scheduler(self.client), 'rpm')
+        self.stream = copy_scheduler.StreamBatcher(self._copy_paths)
+        self.ledger = curation_ledger.get_ledger()
+        self.logger.debug("RPMBatchPuller for %d packages", len(self.package_lines))
+
+    def _add_path(self, input_path, input_lines):
+        if input_path not in self.provenance:
+            self.to_copy.append(input_path)
+            self.provenance[input_path] = []
+        for tmp_line in input_lines:
+            if tmp_line not in self.provenance[input_path]:
+                self.provenance[input_path].append(tmp_line)
+
+    def _resolve_recorded(self):
+        # Take the packages resolved by a recent run from the ledger, and return the ones still to resolve.
+        tmp_keys = dict((tmp_line, resolution_key(self.login_data, tmp_line)) for tmp_line in self.package_lines)
+        tmp_recorded = self.ledger.resolutions('rpm', tmp_keys.values())
+        tmp_pending = []
+        for tmp_line in self.package_lines:
+            if tmp_keys[tmp_line] in tmp_recorded:
+                for tmp_path in tmp_recorded[tmp_keys[tmp_line]]:
+                    self._add_path(tmp_path, [tmp_line])
+            else:
+                tmp_pending.append(tmp_line)
+        self.logger.info("%d of %d packages resolved from the ledger", len(self.package_lines) - len(tmp_pending),
+                         len(self.package_lines))
+        return tmp_pending
+
+    def _resolve_repodata(self, input_lines):
+        self.logger.debug("Resolving %d packages in one pass over the repodata", len(input_lines))
+        tmp_found = []
+        for tmp_line in input_lines:
+            tmp_package = self.index.find(tmp_line)
+            if tmp_package is None:
+                self.logger.warning("No package matches: %s", tmp_line)
+                self.unresolved.add(tmp_line)
+                continue
+            tmp_found.append((tmp_line, tmp_package))
+        tmp_closures = self.index.closure_many([tmp_package for _, tmp_package in tmp_found])
+        for (tmp_line, tmp_package), (tmp_closure, tmp_missing) in zip(tmp_found, tmp_closures):
+            if tmp_missing:
+                self.logger.warning("Failed to resolve package: %s", tmp_line)
+                for tmp_requirement in tmp_missing:
+                    self.logger.warning("  Unresolved: %s", tmp_requirement)
+                self.unresolved.add(tmp_line)
+                continue
+            for tmp_member in tmp_closure:
+                self._add_path(tmp_member.location, [tmp_line])
+            self.ledger.record_resolution(
+                'rpm', resolution_key(self.login_data, tmp_line), [tmp_member.location for tmp_member in tmp_closure]
+            )
+        self.resolved = True
+
+    def _resolve_yum(self, input_lines):
+        # NOTE: One yum transaction can't say which request needs which download, so every path is attributed to
+        #       every package, any failure fails the whole transaction, and nothing is recorded in the ledger.
+        self.logger.debug("Resolving %d packages in one yum transaction", len(input_lines))
+        yum_output = run_yum_download(input_lines, lambda tmp_path: self._stream_path(tmp_path, input_lines),
+                                      lambda tmp_line: self.stream.poll())
+        if yum_output.returncode != 0:
+            self.logger.warning("Failed to install the package set in one transaction")
+            self.logger.warning("  Error: %s", yum_output.stderr.decode())
+            return
+        self.resolved = True
+
+    def _stream_path(self, input_path, input_lines):
+        # Copy each package of the transaction while yum is still downloading.  If the transaction fails, the
+        # packages it had listed stay curated and the fallback finds them in the ledger or the local repo.
+        self._add_path(input_path, input_lines)
+        self.stream.add(input_path)
+
+    def _copy_paths(self, input_paths):
+        # FIXME: Is the '-cache' part needed for the RPM repos?
+        self.copies.add_paths(
+            "{}-cache".format(self.login_data['remote_repo']), self.login_data['local_repo'], input_paths,
+            self.login_data['remote_repo']
+        )
+
+    def _copy_to_local(self):
+        self.logger.debug("Copying %d unique packages to local repo", len(self.to_copy))
+        self.stream.extend(self.to_copy)
+
+    def curate(self):
+        self.logger.info("Curating %d RPM packages as one batch", len(self.package_lines))
+        tmp_pending = self._resolve_recorded()
+        if not tmp_pending:
+            self.resolved = True
+        else:
+            with curation_metrics.stage('resolve', "{} packages".format(len(tmp_pending))) as tmp_stage:
+                if self.index is not None:
+                    self._resolve_repodata(tmp_pending)
+                else:
+                    self._resolve_yum(tmp_pending)
+                if not self.resolved:
+                    tmp_stage.fail("unresolved")
+                elif self.unresolved:
+                    tmp_stage.fail("{} packages unresolved".format(len(self.unresolved)))
+        if self.resolved:
+            self._copy_to_local()
+
+    def finish(self):
+        self.copies.collect()
+        for pkg in self.copies.failures:
+            self.logger.warning("  '%s' is needed by: %s", pkg, self.provenance[pkg])
+        self.logger.info("Copied %d files (%d failed)", len(self.copies.results), len(self.copies.failures))
+
+    def results(self):
+        # A package is curated when it resolved and none of the files it needs failed to copy.
+        tmp_failed_lines = set(self.unresolved)
+        for pkg in self.copies.failures:
+            tmp_failed_lines.update(self.provenance[pkg])
+        return [(tmp_line, self.resolved and tmp_line not in tmp_failed_lines) for tmp_line in self.package_lines]
+
 ### MAIN ###
 def main():
     # Set up logging
@@ -135,41 +397,30 @@ def main():
         format = "%(asctime)s:%(levelname)s:%(name)s:%(funcName)s: %(message)s",
         level = logging.DEBUG
     )
+    curation_metrics.start_run('rpm')
 
     logging.debug("Environment Prep Starting")
     tmp_payload_json = os.environ['res_curaterpm_payload']
     tmp_packages = get_packages_from_payload(tmp_payload_json)
 
-    tmp_login_data = {}
-    tmp_login_data['user'] = os.environ['int_artifactory_user']
-    tmp_login_data['apikey'] = os.environ['int_artifactory_apikey']
-    tmp_login_data['arti_url'] = os.environ['int_artifactory_url']
-    tmp_login_data['local_repo'] = os.environ['local_repo_name']
-    tmp_login_data['remote_repo'] = os.environ['remote_repo_name']
-
-    # Prep the yum.repos.d directory
-    logging.debug("Preparing the yum repos directory")
-    prep_repos_dir(tmp_login_data)
-
-    logging.debug("Starting the threads")
-    tmp_rpmpackagepullers = []
-    for tmp_pkg in tmp_packages:
-        tmp_rpmpackagepullers.append(RPMPackagePuller(tmp_login_data, tmp_pkg))
-    for tmp_puller in tmp_rpmpackagepullers:
-        tmp_puller.curate()
+    tmp_login_data = get_login_data(os.environ['local_repo_name'], os.environ['remote_repo_name'])
+    tmp_index = prepare_resolver(tmp_login_data, tmp_packages)
+    tmp_results, tmp_copy_failures = curate_packages(tmp_login_data, tmp_packages, tmp_index)
 
     # Report Results
     # NOTE: This just prints the results to the log output.  This information
     #       can be gathered and pushed to a webhook on an external system for
     #       reporting, e.g. JIRA or ServiceNow.
     logging.info("Gathering Results")
+    logging.info("%s", curation_ledger.get_ledger().stats)
+    curation_metrics.finish_run()
     tmp_successes = []
     tmp_failures = []
-    for tmp_puller in tmp_rpmpackagepullers:
-        if tmp_puller.success:
-            tmp_successes.append(tmp_puller.package_line)
+    for tmp_line, tmp_success in tmp_results:
+        if tmp_success:
+            tmp_successes.append(tmp_line)
         else:
-            tmp_failures.append(tmp_puller.package_line)
+            tmp_failures.append(tmp_line)
     logging.info("Successfully Curated:")
     for item in tmp_successes:
         logging.info("  %s", item)
@@ -177,6 +428,10 @@ def main():
         logging.warning("Failed to Curate:")
         for item in tmp_failures:
             logging.warning("  %s", item)
+    if len(tmp_copy_failures) > 0:
+        logging.warning("Failed to Copy:")
+        for item in tmp_copy_failures:
+            logging.warning("  %s", item)
 
 if __name__ == '__main__':
     main()
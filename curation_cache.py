@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import logging
+import os
+import threading
+import time
+
+### GLOBALS ###
+DEFAULT_CACHE_ROOT = os.environ.get('curate_cache_root', os.path.join(os.path.expanduser('~'), '.cache', 'curation'))
+
+### FUNCTIONS ###
+def cache_dir(input_name, input_override = None):
+    # A cache directory under the shared root, or the override (e.g. from an environment variable) when one is set.
+    tmp_dir = input_override if input_override else os.path.join(DEFAULT_CACHE_ROOT, input_name)
+    os.makedirs(tmp_dir, exist_ok = True)
+    return tmp_dir
+
+def _last_used(input_stat):
+    # atime isn't updated on noatime mounts, so fall back on whichever of atime/mtime is newer.
+    return max(input_stat.st_atime, input_stat.st_mtime)
+
+def evict_directory(input_dir, max_bytes, max_age_seconds):
+    logging.debug("Evicting from cache directory: %s", input_dir)
+    tmp_entries = []
+    for tmp_root, tmp_dirs, tmp_files in os.walk(input_dir):
+        for tmp_file in tmp_files:
+            tmp_path = os.path.join(tmp_root, tmp_file)
+            try:
+                tmp_stat = os.stat(tmp_path)
+            except OSError:
+                continue
+            tmp_entries.append((_last_used(tmp_stat), tmp_stat.st_size, tmp_path))
+    tmp_entries.sort()
+    tmp_total = sum(tmp_size for _, tmp_size, _ in tmp_entries)
+    tmp_now = time.time()
+    tmp_removed = 0
+    tmp_removed_bytes = 0
+    # Oldest first: drop everything past the age limit, then keep going until the directory fits the size limit.
+    for tmp_used, tmp_size, tmp_path in tmp_entries:
+        if (max_age_seconds and tmp_now - tmp_used > max_age_seconds) or (max_bytes and tmp_total > max_bytes):
+            try:
+                os.remove(tmp_path)
+            except OSError as tmp_err:
+                logging.debug("  Failed to evict '%s': %s", tmp_path, tmp_err)
+                continue
+            tmp_total -= tmp_size
+            tmp_removed += 1
+            tmp_removed_bytes += tmp_size
+    for tmp_root, tmp_dirs, tmp_files in os.walk(input_dir, topdown = False):
+        if tmp_root != input_dir and not os.listdir(tmp_root):
+            os.rmdir(tmp_root)
+    logging.info("Cache '%s': evicted %d files (%d bytes), %d bytes remain", input_dir, tmp_removed,
+                 tmp_removed_bytes, tmp_total)
+    return tmp_removed, tmp_removed_bytes, tmp_total
+
+### CLASSES ###
+class CacheStats:
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hits = 0, misses = 0):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def __str__(self):
+        return "{}: {} hits, {} misses".format(self.name, self.hits, self.misses)
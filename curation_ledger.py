@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+import curation_cache
+
+### GLOBALS ###
+# Path of the ledger database, empty for the default under the cache root, or 'none' to run without a ledger.
+LEDGER_SETTING = os.environ.get('curate_ledger', '')
+# Recorded copies are trusted this long before the local repo is checked again, in case something was deleted there.
+LEDGER_COPY_TTL = float(os.environ.get('curate_ledger_copy_ttl_days', '30')) * 86400
+# Resolutions of unpinned requests go stale as new versions are published, so they expire much sooner.
+LEDGER_RESOLVE_TTL = float(os.environ.get('curate_ledger_resolve_ttl_hours', '24')) * 3600
+# Most resolutions kept, the oldest are dropped when the ledger is opened.  Copies are bounded by their TTL alone.
+LEDGER_MAX_RESOLUTIONS = int(os.environ.get('curate_ledger_max_resolutions', '10000'))
+# Number of keys looked up per query.
+LEDGER_BATCH_SIZE = 500
+
+_LEDGER = None
+_LEDGER_LOCK = threading.Lock()
+
+### FUNCTIONS ###
+def get_ledger():
+    # One ledger per process, shared by every puller.
+    global _LEDGER
+    with _LEDGER_LOCK:
+        if _LEDGER is None:
+            if LEDGER_SETTING.lower() == 'none':
+                _LEDGER = Ledger(None)
+            else:
+                _LEDGER = Ledger(LEDGER_SETTING or os.path.join(curation_cache.cache_dir('ledger'), 'ledger.sqlite'))
+        return _LEDGER
+
+### CLASSES ###
+class Ledger:
+    # Outcomes of earlier runs keyed by (ecosystem, stage, key): 'copy' records a target path that is in the local
+    # repo, 'resolve' records the paths a request resolved to.  Every record is committed as soon as it's made, so a
+    # run that dies part way leaves what it finished for the next run to skip.
+    # NOTE: The ledger is only ever an optimization.  If it can't be opened or written, the run carries on without it.
+    def __init__(self, path, copy_ttl = LEDGER_COPY_TTL, resolve_ttl = LEDGER_RESOLVE_TTL,
+                 max_resolutions = LEDGER_MAX_RESOLUTIONS):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.path = path
+        self.copy_ttl = copy_ttl
+        self.resolve_ttl = resolve_ttl
+        self.max_resolutions = max_resolutions
+        self.stats = curation_cache.CacheStats('ledger')
+        self._lock = threading.Lock()
+        self._db = None
+        if path is None:
+            return
+        try:
+            self._db = sqlite3.connect(path, timeout = 30, check_same_thread = False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (ecosystem TEXT, stage TEXT, key TEXT, value TEXT, updated REAL, "
+                "PRIMARY KEY (ecosystem, stage, key))"
+            )
+            self._db.commit()
+            self.logger.debug("Using curation ledger: %s", path)
+        except sqlite3.Error as tmp_err:
+            self.logger.warning("Failed to open the curation ledger '%s', continuing without it: %s", path, tmp_err)
+            self._db = None
+            return
+        self.prune()
+
+    @property
+    def enabled(self):
+        return self._db is not None
+
+    def _execute(self, input_sql, input_args = ()):
+        with self._lock:
+            try:
+                tmp_rows = self._db.execute(input_sql, input_args).fetchall()
+                self._db.commit()
+                return tmp_rows
+            except sqlite3.Error as tmp_err:
+                self.logger.warning("Curation ledger error, continuing without it: %s", tmp_err)
+                self._db = None
+                return []
+
+    def _lookup(self, input_ecosystem, input_stage, input_keys, input_ttl):
+        tmp_found = {}
+        if not self.enabled:
+            return tmp_found
+        tmp_keys = sorted(set(input_keys))
+        tmp_oldest = time.time() - input_ttl
+        for tmp_idx in range(0, len(tmp_keys), LEDGER_BATCH_SIZE):
+            tmp_chunk = tmp_keys[tmp_idx:tmp_idx + LEDGER_BATCH_SIZE]
+            tmp_rows = self._execute(
+                "SELECT key, value FROM entries WHERE ecosystem = ? AND stage = ? AND updated >= ? AND key IN ({})".format(
+                    ",".join("?" * len(tmp_chunk))
+                ),
+                [input_ecosystem, input_stage, tmp_oldest] + tmp_chunk
+            )
+            for tmp_key, tmp_value in tmp_rows:
+                tmp_found[tmp_key] = json.loads(tmp_value)
+        self.stats.record(hits = len(tmp_found), misses = len(tmp_keys) - len(tmp_found))
+        return tmp_found
+
+    def _record(self, input_ecosystem, input_stage, input_key, input_value):
+        if self.enabled:
+            self._execute(
+                "INSERT OR REPLACE INTO entries (ecosystem, stage, key, value, updated) VALUES (?, ?, ?, ?, ?)",
+                (input_ecosystem, input_stage, input_key, json.dumps(input_value), time.time())
+            )
+
+    def _forget(self, input_ecosystem, input_stage, input_key):
+        if self.enabled:
+            self._execute(
+                "DELETE FROM entries WHERE ecosystem = ? AND stage = ? AND key = ?",
+                (input_ecosystem, input_stage, input_key)
+            )
+
+    def prune(self):
+        # Drop the entries past their TTL, which would never be used again, then the oldest resolutions past
+        # max_resolutions.  Resolutions can be large (a pom.xml resolves to hundreds of artifacts), copies are not.
+        if not self.enabled:
+            return
+        tmp_now = time.time()
+        self._execute("DELETE FROM entries WHERE stage = 'copy' AND updated < ?", (tmp_now - self.copy_ttl,))
+        self._execute("DELETE FROM entries WHERE stage = 'resolve' AND updated < ?", (tmp_now - self.resolve_ttl,))
+        if self.max_resolutions:
+            self._execute(
+                "DELETE FROM entries WHERE rowid IN (SELECT rowid FROM entries WHERE stage = 'resolve' "
+                "ORDER BY updated DESC LIMIT -1 OFFSET ?)", (self.max_resolutions,)
+            )
+
+    def copied(self, input_ecosystem, input_to_paths):
+        # The subset of the target paths ('<local repo>/<path>') recorded as curated.
+        return set(self._lookup(input_ecosystem, 'copy', input_to_paths, self.copy_ttl))
+
+    def record_copy(self, input_ecosystem, input_to_path, input_ok):
+        if input_ok:
+            self._record(input_ecosystem, 'copy', input_to_path, True)
+        else:
+            self._forget(input_ecosystem, 'copy', input_to_path)
+
+    def resolutions(self, input_ecosystem, input_keys):
+        # Request key -> the paths it resolved to, for the requests resolved recently enough.
+        return self._lookup(input_ecosystem, 'resolve', input_keys, self.resolve_ttl)
+
+    def record_resolution(self, input_ecosystem, input_key, input_paths):
+        self._record(input_ecosystem, 'resolve', input_key, list(input_paths))
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import collections
+import json
+import logging
+import os
+import threading
+import time
+
+### GLOBALS ###
+# Path of the JSON run report, or 'none' to skip it.
+METRICS_REPORT = os.environ.get('curate_metrics_report', 'curation_report.json')
+# Path of a Prometheus textfile-collector file (e.g. in node_exporter's --collector.textfile.directory), off by default.
+# Every value describes the last run, so they are all gauges.
+METRICS_TEXTFILE = os.environ.get('curate_metrics_textfile', '')
+# Number of slowest stages listed on their own in the report.
+SLOWEST_COUNT = 20
+# Stages kept for the report.  The totals count every stage, but a long running process (curation_service.py) only
+# keeps the most recent ones.
+METRICS_MAX_STAGES = int(os.environ.get('curate_metrics_max_stages', '100000'))
+
+_RECORDER = None
+_RECORDER_LOCK = threading.Lock()
+# The stage running on each thread, so HTTP requests can be charged to it without passing it around.
+_CURRENT = threading.local()
+
+### FUNCTIONS ###
+def get_recorder():
+    # One recorder per process, shared by every puller and worker thread.
+    global _RECORDER
+    with _RECORDER_LOCK:
+        if _RECORDER is None:
+            _RECORDER = StageRecorder()
+        return _RECORDER
+
+def start_run(input_ecosystem):
+    tmp_recorder = get_recorder()
+    tmp_recorder.ecosystem = input_ecosystem
+    tmp_recorder.started = time.time()
+    return tmp_recorder
+
+def stage(input_name, input_artifact):
+    return get_recorder().stage(input_name, input_artifact)
+
+def count_request(input_size):
+    # Called by the Artifactory client for every response, charged to the stage running on this thread if any.
+    tmp_stage = getattr(_CURRENT, 'stage', None)
+    if tmp_stage is not None:
+        tmp_stage.add(input_bytes = input_size, input_requests = 1)
+    get_recorder().count_request(input_size)
+
+def count_retry():
+    tmp_stage = getattr(_CURRENT, 'stage', None)
+    if tmp_stage is not None:
+        tmp_stage.add(input_retries = 1)
+    get_recorder().count_retry()
+
+def in_current_stage(func):
+    # Wrap func for a worker thread so the requests it sends are charged to the stage running on this thread.
+    tmp_stage = getattr(_CURRENT, 'stage', None)
+    def tmp_wrapper(*args, **kwargs):
+        tmp_outer = getattr(_CURRENT, 'stage', None)
+        _CURRENT.stage = tmp_stage
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _CURRENT.stage = tmp_outer
+    return tmp_wrapper
+
+def finish_run():
+    tmp_recorder = get_recorder()
+    tmp_recorder.log_summary()
+    if METRICS_REPORT.lower() != 'none':
+        tmp_recorder.write_report(METRICS_REPORT)
+    if METRICS_TEXTFILE:
+        tmp_recorder.write_textfile(METRICS_TEXTFILE)
+    return tmp_recorder
+
+def _write_atomic(input_path, input_text):
+    # Readers (node_exporter, the pipeline's artifact upload) must never see a half written file.
+    tmp_dir = os.path.dirname(os.path.abspath(input_path))
+    os.makedirs(tmp_dir, exist_ok = True)
+    tmp_partial = "{}.{}.tmp".format(input_path, os.getpid())
+    with open(tmp_partial, 'w') as tmp_file:
+        tmp_file.write(input_text)
+    os.replace(tmp_partial, input_path)
+
+def _label(input_value):
+    return str(input_value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+### CLASSES ###
+class Stage:
+    # One timed stage (resolve, warm, copy...) of one artifact.  Used as a context manager: the stage is 'ok' unless
+    # fail() is called or an exception escapes it.
+    def __init__(self, recorder, name, artifact):
+        self.recorder = recorder
+        self.name = name
+        self.artifact = artifact
+        self.started = None
+        self.duration = None
+        self.outcome = 'ok'
+        self.detail = None
+        self.bytes = 0
+        self.requests = 0
+        self.retries = 0
+        self._outer = None
+        self._clock = None
+        # Worker threads may charge requests to the same stage, see in_current_stage().
+        self._lock = threading.Lock()
+
+    def add(self, input_bytes = 0, input_requests = 0, input_retries = 0):
+        with self._lock:
+            self.bytes += input_bytes
+            self.requests += input_requests
+            self.retries += input_retries
+
+    def fail(self, input_detail = None):
+        self.outcome = 'failed'
+        self.detail = None if input_detail is None else str(input_detail)
+
+    def __enter__(self):
+        self._outer = getattr(_CURRENT, 'stage', None)
+        _CURRENT.stage = self
+        self.started = time.time()
+        self._clock = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.duration = time.perf_counter() - self._clock
+        _CURRENT.stage = self._outer
+        if exc_type is not None:
+            self.fail("{}: {}".format(exc_type.__name__, exc_value))
+        self.recorder.finish(self)
+        return False
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'artifact': self.artifact,
+            'started': round(self.started, 3),
+            'duration': round(self.duration, 6),
+            'outcome': self.outcome,
+            'bytes': self.bytes,
+            'requests': self.requests,
+            'retries': self.retries,
+            'detail': self.detail,
+        }
+
+class StageRecorder:
+    def __init__(self):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.ecosystem = None
+        self.started = time.time()
+        self.stages = collections.deque(maxlen = METRICS_MAX_STAGES)
+        self._totals = {}
+        self.requests = 0
+        self.bytes = 0
+        self.retries = 0
+        self._lock = threading.Lock()
+
+    def stage(self, input_name, input_artifact):
+        return Stage(self, input_name, input_artifact)
+
+    def finish(self, input_stage):
+        with self._lock:
+            self.stages.append(input_stage)
+            tmp_total = self._totals.setdefault(input_stage.name, {
+                'count': 0, 'ok': 0, 'failed': 0, 'duration': 0.0, 'duration_max': 0.0, 'bytes': 0, 'requests': 0, 'retries': 0,
+            })
+            tmp_total['count'] += 1
+            tmp_total[input_stage.outcome] += 1
+            tmp_total['duration'] += input_stage.duration
+            tmp_total['duration_max'] = max(tmp_total['duration_max'], input_stage.duration)
+            tmp_total['bytes'] += input_stage.bytes
+            tmp_total['requests'] += input_stage.requests
+            tmp_total['retries'] += input_stage.retries
+
+    def count_request(self, input_size):
+        with self._lock:
+            self.requests += 1
+            self.bytes += input_size
+
+    def count_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def totals(self):
+        # Stage name -> aggregate counters, in the order the stages first ran.
+        with self._lock:
+            return dict((tmp_name, dict(tmp_total)) for tmp_name, tmp_total in self._totals.items())
+
+    def report(self):
+        with self._lock:
+            tmp_stages = list(self.stages)
+        tmp_finished = time.time()
+        return {
+            'ecosystem': self.ecosystem,
+            'started': round(self.started, 3),
+            'finished': round(tmp_finished, 3),
+            'duration': round(tmp_finished - self.started, 3),
+            'requests': self.requests,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'totals': self.totals(),
+            'slowest': [tmp_stage.as_dict() for tmp_stage in
+                        sorted(tmp_stages, key = lambda tmp_stage: tmp_stage.duration, reverse = True)[:SLOWEST_COUNT]],
+            'stages': [tmp_stage.as_dict() for tmp_stage in tmp_stages],
+        }
+
+    def write_report(self, input_path):
+        try:
+            _write_atomic(input_path, json.dumps(self.report(), indent = 2) + "\n")
+            self.logger.info("Wrote the run report: %s", input_path)
+        except OSError as tmp_err:
+            self.logger.warning("Failed to write the run report '%s': %s", input_path, tmp_err)
+
+    def textfile(self):
+        tmp_eco = _label(self.ecosystem)
+        tmp_lines = []
+        tmp_metrics = [
+            ('curation_stage_duration_seconds', 'gauge', 'Time spent in each curation stage in the last run.', 'duration'),
+            ('curation_stage_bytes', 'gauge', 'Bytes received from Artifactory in each curation stage.', 'bytes'),
+            ('curation_stage_requests', 'gauge', 'HTTP requests sent in each curation stage.', 'requests'),
+            ('curation_stage_retries', 'gauge', 'Requests retried after a transient error in each curation stage.', 'retries'),
+            ('curation_stage_duration_max_seconds', 'gauge', 'Slowest single artifact in each curation stage.', 'duration_max'),
+        ]
+        tmp_totals = self.totals()
+        for tmp_name, tmp_type, tmp_help, tmp_field in tmp_metrics:
+            tmp_lines.append("# HELP {} {}".format(tmp_name, tmp_help))
+            tmp_lines.append("# TYPE {} {}".format(tmp_name, tmp_type))
+            for tmp_stage, tmp_total in tmp_totals.items():
+                tmp_lines.append('{}{{ecosystem="{}",stage="{}"}} {}'.format(tmp_name, tmp_eco, _label(tmp_stage), tmp_total[tmp_field]))
+        tmp_lines.append("# HELP curation_stage_artifacts Artifacts that went through each curation stage, by outcome.")
+        tmp_lines.append("# TYPE curation_stage_artifacts gauge")
+        for tmp_stage, tmp_total in tmp_totals.items():
+            for tmp_outcome in ('ok', 'failed'):
+                tmp_lines.append('curation_stage_artifacts{{ecosystem="{}",stage="{}",outcome="{}"}} {}'.format(
+                    tmp_eco, _label(tmp_stage), tmp_outcome, tmp_total[tmp_outcome]))
+        tmp_lines.append("# HELP curation_run_duration_seconds Wall clock time of the last curation run.")
+        tmp_lines.append("# TYPE curation_run_duration_seconds gauge")
+        tmp_lines.append('curation_run_duration_seconds{{ecosystem="{}"}} {}'.format(tmp_eco, round(time.time() - self.started, 3)))
+        tmp_lines.append("# HELP curation_run_timestamp_seconds When the last curation run finished.")
+        tmp_lines.append("# TYPE curation_run_timestamp_seconds gauge")
+        tmp_lines.append('curation_run_timestamp_seconds{{ecosystem="{}"}} {}'.format(tmp_eco, round(time.time(), 3)))
+        return "\n".join(tmp_lines) + "\n"
+
+    def write_textfile(self, input_path):
+        try:
+            _write_atomic(input_path, self.textfile())
+            self.logger.info("Wrote the Prometheus textfile: %s", input_path)
+        except OSError as tmp_err:
+            self.logger.warning("Failed to write the Prometheus textfile '%s': %s", input_path, tmp_err)
+
+    def log_summary(self):
+        self.logger.info("Stage timings for this run (%d requests, %d retries, %d bytes):", self.requests, self.retries,
+                         self.bytes)
+        for tmp_stage, tmp_total in self.totals().items():
+            self.logger.info("  %s: %d artifacts (%d failed) in %.2fs total, %.2fs max, %d requests, %d retries, %d bytes",
+                             tmp_stage, tmp_total['count'], tmp_total['failed'], tmp_total['duration'],
+                             tmp_total['duration_max'], tmp_total['requests'], tmp_total['retries'], tmp_total['bytes'])
@@ -0,0 +1,638 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import argparse
+import base64
+import collections
+import hashlib
+import heapq
+import http.server
+import itertools
+import json
+import logging
+import os
+import signal
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+import arti_client
+import curate_docker
+import curate_maven
+import curate_pypi
+import curate_rpm
+import curation_ledger
+import curation_metrics
+
+### GLOBALS ###
+# Address of the HTTP endpoint ('' turns it off).
+SERVICE_LISTEN = os.environ.get('curate_service_listen', '127.0.0.1:8700')
+# Spool directory watched for request files ('' turns it off).  See SpoolWatcher for the layout.
+SERVICE_SPOOL = os.environ.get('curate_service_spool', '')
+SPOOL_POLL_SECONDS = float(os.environ.get('curate_service_spool_poll_seconds', '2'))
+# Batches curated at the same time, and the most items of one ecosystem curated as one batch.
+SERVICE_WORKERS = int(os.environ.get('curate_service_workers', '2'))
+SERVICE_BATCH_SIZE = int(os.environ.get('curate_service_batch_size', '50'))
+# Finished requests that can still be looked up.
+SERVICE_HISTORY = int(os.environ.get('curate_service_history', '1000'))
+# The RPM repodata index is loaded once per remote repo and reused by every request until it is this old.
+RPM_INDEX_TTL = int(os.environ.get('curate_service_rpm_index_ttl_minutes', '30')) * 60
+# The pip cache is trimmed when the first PyPI batch runs and then at most this often.
+PIP_CACHE_PREP_INTERVAL = 60 * 60
+ECOSYSTEMS = ('docker', 'maven', 'pypi', 'rpm')
+# Higher numbers are curated first.
+DEFAULT_PRIORITY = 0
+
+### FUNCTIONS ###
+def repo_names(ecosystem):
+    # PyPI and RPM read their repos from curate_service_<ecosystem>_local_repo/_remote_repo, and fall back on the
+    # local_repo_name/remote_repo_name the pipeline steps use.  Docker and Maven have theirs in the curator modules.
+    return (
+        os.environ.get('curate_service_{}_local_repo'.format(ecosystem), os.environ.get('local_repo_name', '')),
+        os.environ.get('curate_service_{}_remote_repo'.format(ecosystem), os.environ.get('remote_repo_name', '')),
+    )
+
+def split_payload(ecosystem, payload_json):
+    # Break a webhook payload (the same JSON the pipeline steps get) into the (key, target) pairs of the artifacts it
+    # asks for.  Requests with the same key share one queued item.
+    tmp_targets = collections.OrderedDict()
+    if ecosystem == 'docker':
+        tmp_platforms = curate_docker.get_platforms_from_payload(payload_json)
+        tmp_platform_names = ",".join(curate_docker.platform_name(tmp_platform) for tmp_platform in tmp_platforms)
+        for tmp_image in curate_docker.get_images_from_payload(payload_json):
+            tmp_targets["{} [{}]".format(tmp_image, tmp_platform_names)] = (tmp_image, tmp_platforms)
+    elif ecosystem == 'maven':
+        tmp_pom_text = base64.b64decode(json.loads(payload_json)['pomdata']).decode()
+        tmp_digest = hashlib.sha256(tmp_pom_text.encode()).hexdigest()
+        tmp_targets["pom.xml sha256:{}".format(tmp_digest[:16])] = tmp_pom_text
+    elif ecosystem == 'pypi':
+        for tmp_line in curate_pypi.get_requirements_from_payload(payload_json):
+            tmp_targets[tmp_line.strip()] = tmp_line.strip()
+    elif ecosystem == 'rpm':
+        for tmp_package in curate_rpm.get_packages_from_payload(payload_json):
+            tmp_targets[tmp_package.strip()] = tmp_package.strip()
+    else:
+        raise ValueError("unknown ecosystem '{}'".format(ecosystem))
+    return [(tmp_key, tmp_target) for tmp_key, tmp_target in tmp_targets.items() if tmp_key]
+
+def parse_address(input_listen):
+    tmp_host, _, tmp_port = input_listen.rpartition(':')
+    return (tmp_host or '127.0.0.1', int(tmp_port))
+
+def handle_sigterm(signum, frame):
+    raise KeyboardInterrupt()
+
+### CLASSES ###
+class QueueClosed(Exception):
+    pass
+
+class WorkItem:
+    # One artifact (an image, a requirement line, a package or a pom.xml) to curate.  Every request that asks for it
+    # while it is queued or running waits on the same item.
+    def __init__(self, ecosystem, key, target, priority):
+        self.ecosystem = ecosystem
+        self.key = key
+        self.target = target
+        self.priority = priority
+        self.state = 'queued'
+        self.success = None
+        self.detail = None
+        self.requests = []
+
+    def as_dict(self):
+        return {'item': self.key, 'state': self.state, 'success': self.success, 'detail': self.detail}
+
+class CurationRequest:
+    def __init__(self, request_id, ecosystem, priority, source):
+        self.id = request_id
+        self.ecosystem = ecosystem
+        self.priority = priority
+        self.source = source
+        self.items = []
+        self.submitted = time.time()
+        self.finished = None
+        # Set when the service shut down before some of its items ran, so the request can be submitted again.
+        self.dropped = False
+        self.done = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def on_done(self, input_callback):
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(input_callback)
+                return
+        input_callback(self)
+
+    def finish(self):
+        with self._lock:
+            self.finished = time.time()
+            self.done.set()
+            tmp_callbacks = self._callbacks
+            self._callbacks = []
+        for tmp_callback in tmp_callbacks:
+            tmp_callback(self)
+
+    def state(self):
+        if self.done.is_set():
+            return 'done'
+        if any(tmp_item.state != 'queued' for tmp_item in self.items):
+            return 'running'
+        return 'queued'
+
+    def as_dict(self):
+        tmp_done = self.done.is_set()
+        return {
+            'id': self.id,
+            'ecosystem': self.ecosystem,
+            'priority': self.priority,
+            'source': self.source,
+            'state': self.state(),
+            'success': all(tmp_item.success for tmp_item in self.items) if tmp_done else None,
+            'dropped': self.dropped,
+            'submitted': round(self.submitted, 3),
+            'finished': round(self.finished, 3) if tmp_done else None,
+            'items': [tmp_item.as_dict() for tmp_item in self.items],
+        }
+
+class WorkQueue:
+    # Priority queue of work items, deduplicated by (ecosystem, key) while an item is queued or running.  Raising an
+    # item's priority pushes it again, the stale heap entry is skipped when it comes up.
+    def __init__(self, batch_size = SERVICE_BATCH_SIZE, history = SERVICE_HISTORY):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.batch_size = max(1, batch_size)
+        self.history = max(1, history)
+        self._lock = threading.Lock()
+        self._ready = threading.Condition(self._lock)
+        self._heap = []
+        self._seq = itertools.count()
+        self._active = {}
+        self._requests = collections.OrderedDict()
+        self._closed = False
+        self.submitted = 0
+        self.merged = 0
+        self.completed = 0
+
+    def _push(self, input_item):
+        heapq.heappush(self._heap, (-input_item.priority, next(self._seq), input_item))
+
+    def _current(self, input_entry):
+        return input_entry[2].state == 'queued' and -input_entry[0] == input_entry[2].priority
+
+    def submit(self, ecosystem, targets, priority = DEFAULT_PRIORITY, source = None):
+        tmp_request = CurationRequest(uuid.uuid4().hex, ecosystem, priority, source)
+        with self._ready:
+            if self._closed:
+                raise QueueClosed("the service is shutting down")
+            for tmp_key, tmp_target in targets:
+                tmp_item = self._active.get((ecosystem, tmp_key))
+                if tmp_item is None:
+                    tmp_item = WorkItem(ecosystem, tmp_key, tmp_target, priority)
+                    self._active[(ecosystem, tmp_key)] = tmp_item
+                    self._push(tmp_item)
+                else:
+                    self.merged += 1
+                    if tmp_item.state == 'queued' and priority > tmp_item.priority:
+                        tmp_item.priority = priority
+                        self._push(tmp_item)
+                tmp_item.requests.append(tmp_request)
+                tmp_request.items.append(tmp_item)
+            self.submitted += 1
+            self._requests[tmp_request.id] = tmp_request
+            self._trim()
+            self._ready.notify_all()
+        if not tmp_request.items:
+            tmp_request.finish()
+        self.logger.info("Queued request %s: %d %s items at priority %d", tmp_request.id, len(tmp_request.items),
+                         ecosystem, priority)
+        return tmp_request
+
+    def _trim(self):
+        # Forget the oldest finished requests past the history limit, the ones still in progress are always kept.
+        tmp_excess = len(self._requests) - self.history
+        if tmp_excess <= 0:
+            return
+        for tmp_id in list(self._requests):
+            if tmp_excess <= 0:
+                break
+            if self._requests[tmp_id].done.is_set():
+                del self._requests[tmp_id]
+                tmp_excess -= 1
+
+    def take(self, timeout = None):
+        # The most urgent item, with up to batch_size - 1 more queued items of its ecosystem in priority order so the
+        # curator can resolve and copy them together.  Returns [] on timeout or once the queue is closed.
+        with self._ready:
+            while True:
+                if self._closed:
+                    return []
+                while self._heap and not self._current(self._heap[0]):
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    break
+                if not self._ready.wait(timeout):
+                    return []
+            tmp_first = heapq.heappop(self._heap)[2]
+            tmp_batch = [tmp_first]
+            for tmp_entry in sorted(self._heap):
+                if len(tmp_batch) >= self.batch_size:
+                    break
+                if self._current(tmp_entry) and tmp_entry[2].ecosystem == tmp_first.ecosystem:
+                    tmp_batch.append(tmp_entry[2])
+            for tmp_item in tmp_batch:
+                tmp_item.state = 'running'
+            return tmp_batch
+
+    def finish(self, items, input_dropped = False):
+        tmp_finished = []
+        with self._lock:
+            for tmp_item in items:
+                tmp_item.state = 'done'
+                if self._active.get((tmp_item.ecosystem, tmp_item.key)) is tmp_item:
+                    del self._active[(tmp_item.ecosystem, tmp_item.key)]
+                for tmp_request in tmp_item.requests:
+                    if tmp_request not in tmp_finished and all(tmp_other.state == 'done' for tmp_other in tmp_request.items):
+                        tmp_finished.append(tmp_request)
+            if not input_dropped:
+                self.completed += len(items)
+        for tmp_request in tmp_finished:
+            if not tmp_request.done.is_set():
+                tmp_request.finish()
+                self.logger.info("Finished request %s (%s)", tmp_request.id,
+                                 "dropped" if tmp_request.dropped else
+                                 "ok" if all(tmp_item.success for tmp_item in tmp_request.items) else "failed")
+
+    def get(self, request_id):
+        with self._lock:
+            return self._requests.get(request_id)
+
+    def close(self):
+        # Items already running are left to finish.  The ones still queued are dropped: they fail at once so nobody
+        # waits on them, and their requests are marked dropped.
+        with self._ready:
+            self._closed = True
+            self._heap = []
+            tmp_dropped = [tmp_item for tmp_item in self._active.values() if tmp_item.state == 'queued']
+            for tmp_item in tmp_dropped:
+                tmp_item.success = False
+                tmp_item.detail = "dropped at shutdown"
+                for tmp_request in tmp_item.requests:
+                    tmp_request.dropped = True
+            self._ready.notify_all()
+        if tmp_dropped:
+            self.logger.warning("Dropping %d queued items", len(tmp_dropped))
+            self.finish(tmp_dropped, input_dropped = True)
+
+    def status(self):
+        with self._lock:
+            tmp_states = collections.Counter(tmp_item.state for tmp_item in self._active.values())
+            return {
+                'queued': tmp_states['queued'],
+                'running': tmp_states['running'],
+                'requests': self.submitted,
+                'merged': self.merged,
+                'completed': self.completed,
+            }
+
+class CurationService:
+    # Runs the curators on a shared pool of workers for every request the HTTP endpoint and the spool receive.  The
+    # Artifactory client, its connections and rate limiter, the copy scheduler, the ledger, the Docker login, the
+    # pip cache and the RPM repodata index are set up once and reused by every request.
+    def __init__(self, workers = SERVICE_WORKERS, batch_size = SERVICE_BATCH_SIZE):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.workers = max(1, workers)
+        self.queue = WorkQueue(batch_size)
+        self.started = time.time()
+        self.login_data = {}
+        self.login_data['user'] = os.environ['int_artifactory_user']
+        self.login_data['apikey'] = os.environ['int_artifactory_apikey']
+        self.login_data['arti_url'] = os.environ['int_artifactory_url']
+        self.login_data['docker_url'] = str(self.login_data['arti_url'].split('/')[2])
+        self.handlers = {
+            'docker': self._curate_docker,
+            'maven': self._curate_maven,
+            'pypi': self._curate_pypi,
+            'rpm': self._curate_rpm,
+        }
+        self._rpm_indexes = {}
+        self._rpm_lock = threading.Lock()
+        self._pip_prepped = None
+        self._pip_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        if curate_docker.DOCKER_PULL_MODE == 'docker':
+            curate_docker.docker_login(self.login_data)
+        curate_docker.prep_manifest_cache()
+        for tmp_number in range(self.workers):
+            tmp_thread = threading.Thread(target = self._work, name = "curation-worker-{}".format(tmp_number), daemon = True)
+            tmp_thread.start()
+            self._threads.append(tmp_thread)
+        self.logger.info("Started %d workers", self.workers)
+
+    def stop(self):
+        # Batches already running are finished, whatever is still queued is dropped (see WorkQueue.close()).  Dropped
+        # spool files stay in processing/ and are requeued on the next start.
+        self.queue.close()
+        for tmp_thread in self._threads:
+            tmp_thread.join()
+        self.logger.info("%s", curation_ledger.get_ledger().stats)
+
+    def submit(self, ecosystem, payload_json, priority = DEFAULT_PRIORITY, source = None):
+        # Raises ValueError, KeyError or TypeError for a payload the curator can't read.
+        if ecosystem not in self.handlers:
+            raise ValueError("unknown ecosystem '{}'".format(ecosystem))
+        return self.queue.submit(ecosystem, split_payload(ecosystem, payload_json), priority, source)
+
+    def status(self):
+        tmp_status = self.queue.status()
+        tmp_status['workers'] = self.workers
+        tmp_status['uptime'] = round(time.time() - self.started, 3)
+        return tmp_status
+
+    def _work(self):
+        while True:
+            tmp_items = self.queue.take()
+            if not tmp_items:
+                return
+            tmp_ecosystem = tmp_items[0].ecosystem
+            self.logger.info("Curating %d %s items", len(tmp_items), tmp_ecosystem)
+            try:
+                self.handlers[tmp_ecosystem](tmp_items)
+            except Exception as tmp_err:
+                self.logger.exception("Curation failed for a batch of %d %s items", len(tmp_items), tmp_ecosystem)
+                for tmp_item in tmp_items:
+                    if tmp_item.success is None:
+                        tmp_item.success = False
+                        tmp_item.detail = "{}: {}".format(type(tmp_err).__name__, tmp_err)
+            self.queue.finish(tmp_items)
+
+    def _curate_docker(self, items):
+        # Layers earlier batches copied are skipped through the ledger.
+        tmp_pullers = [
+            curate_docker.DockerImagePuller(self.login_data, tmp_item.target[0], tmp_item.target[1]) for tmp_item in items
+        ]
+        for tmp_item, (tmp_image, tmp_success) in zip(items, curate_docker.curate_images(tmp_pullers)):
+            tmp_item.success = tmp_success
+
+    def _curate_maven(self, items):
+        tmp_client = arti_client.get_client(self.login_data)
+        for tmp_item in items:
+            # Each pom.xml gets its own directory, 'mvn dependency:list' runs there.
+            with tempfile.TemporaryDirectory(prefix = 'curate-maven-') as tmp_dir:
+                with open(os.path.join(tmp_dir, 'pom.xml'), 'w', encoding='utf-8') as tmp_pomxml_file:
+                    tmp_pomxml_file.write(tmp_item.target)
+                tmp_successes, tmp_pull_failures, tmp_copy_failures = curate_maven.curate_pom(
+                    tmp_client, tmp_item.target, tmp_dir
+                )
+            tmp_item.success = not tmp_pull_failures and not tmp_copy_failures
+            tmp_item.detail = {
+                'curated': [str(tmp_coordinate) for tmp_coordinate in tmp_successes],
+                'pull_failures': tmp_pull_failures,
+                'copy_failures': tmp_copy_failures,
+            }
+
+    def _curate_pypi(self, items):
+        with self._pip_lock:
+            if self._pip_prepped is None or time.time() - self._pip_prepped > PIP_CACHE_PREP_INTERVAL:
+                curate_pypi.prep_pip_cache()
+                self._pip_prepped = time.time()
+        tmp_login_data = curate_pypi.get_login_data(*repo_names('pypi'))
+        tmp_results, tmp_copy_failures = curate_pypi.curate_packages(tmp_login_data, [tmp_item.target for tmp_item in items])
+        for tmp_item, (tmp_line, tmp_success) in zip(items, tmp_results):
+            tmp_item.success = tmp_success
+
+    def _curate_rpm(self, items):
+        tmp_login_data = curate_rpm.get_login_data(*repo_names('rpm'))
+        tmp_packages = [tmp_item.target for tmp_item in items]
+        tmp_results, tmp_copy_failures = curate_rpm.curate_packages(
+            tmp_login_data, tmp_packages, self._rpm_index(tmp_login_data, tmp_packages)
+        )
+        for tmp_item, (tmp_line, tmp_success) in zip(items, tmp_results):
+            tmp_item.success = tmp_success
+
+    def _rpm_index(self, login_data, packages):
+        # NOTE: The lock also keeps two batches from loading the same repodata at once.
+        with self._rpm_lock:
+            tmp_cached = self._rpm_indexes.get(login_data['remote_repo'])
+            if tmp_cached is not None and time.time() - tmp_cached[1] < RPM_INDEX_TTL:
+                return tmp_cached[0]
+            tmp_index = curate_rpm.prepare_resolver(login_data, packages)
+            if tmp_index is not None:
+                self._rpm_indexes[login_data['remote_repo']] = (tmp_index, time.time())
+            return tmp_index
+
+class ServiceRequestHandler(http.server.BaseHTTPRequestHandler):
+    # POST /curate/<ecosystem>[?priority=N&wait=SECONDS]   body: the webhook payload of the pipeline step
+    # GET  /requests/<id>                                   the request and the state of each of its items
+    # GET  /status                                          queue counters
+    # GET  /metrics                                         Prometheus text format
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, input_status, input_body, input_type = 'application/json'):
+        if input_type == 'application/json':
+            input_body = json.dumps(input_body, indent = 2) + "\n"
+        tmp_body = input_body.encode()
+        self.send_response(input_status)
+        self.send_header('Content-Type', input_type)
+        self.send_header('Content-Length', str(len(tmp_body)))
+        self.end_headers()
+        self.wfile.write(tmp_body)
+
+    def do_POST(self):
+        tmp_url = urllib.parse.urlsplit(self.path)
+        tmp_parts = tmp_url.path.strip('/').split('/')
+        tmp_body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if len(tmp_parts) != 2 or tmp_parts[0] != 'curate' or tmp_parts[1] not in ECOSYSTEMS:
+            self._reply(404, {'error': "expected /curate/<{}>".format("|".join(ECOSYSTEMS))})
+            return
+        tmp_query = urllib.parse.parse_qs(tmp_url.query)
+        try:
+            tmp_priority = int(tmp_query.get('priority', [DEFAULT_PRIORITY])[0])
+            tmp_wait = float(tmp_query.get('wait', ['0'])[0])
+            tmp_request = self.server.service.submit(tmp_parts[1], tmp_body.decode(), tmp_priority, 'http')
+        except (ValueError, KeyError, TypeError) as tmp_err:
+            self._reply(400, {'error': "{}: {}".format(type(tmp_err).__name__, tmp_err)})
+            return
+        except QueueClosed as tmp_err:
+            self._reply(503, {'error': str(tmp_err)})
+            return
+        if tmp_wait > 0:
+            tmp_request.done.wait(tmp_wait)
+        self._reply(200 if tmp_request.done.is_set() else 202, tmp_request.as_dict())
+
+    def do_GET(self):
+        tmp_parts = urllib.parse.urlsplit(self.path).path.strip('/').split('/')
+        if tmp_parts == ['status']:
+            self._reply(200, self.server.service.status())
+        elif tmp_parts == ['metrics']:
+            self._reply(200, self.server.metrics(), 'text/plain; version=0.0.4')
+        elif len(tmp_parts) == 2 and tmp_parts[0] == 'requests':
+            tmp_request = self.server.service.queue.get(tmp_parts[1])
+            if tmp_request is None:
+                self._reply(404, {'error': "unknown request '{}'".format(tmp_parts[1])})
+            else:
+                self._reply(200, tmp_request.as_dict())
+        else:
+            self._reply(404, {'error': "not found"})
+
+    def log_message(self, format, *args):
+        logging.getLogger(type(self).__name__).debug("%s %s", self.address_string(), format % args)
+
+class CurationServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service):
+        super().__init__(address, ServiceRequestHandler)
+        self.service = service
+
+    def metrics(self):
+        tmp_lines = [curation_metrics.get_recorder().textfile().rstrip("\n")]
+        tmp_status = self.service.status()
+        tmp_lines.append("# HELP curation_service_items Work items in the queue, by state.")
+        tmp_lines.append("# TYPE curation_service_items gauge")
+        for tmp_state in ('queued', 'running'):
+            tmp_lines.append('curation_service_items{{state="{}"}} {}'.format(tmp_state, tmp_status[tmp_state]))
+        tmp_counters = [
+            ('curation_service_requests_total', 'Requests received.', 'requests'),
+            ('curation_service_merged_total', 'Items that joined one already queued or running.', 'merged'),
+            ('curation_service_completed_total', 'Items curated.', 'completed'),
+        ]
+        for tmp_name, tmp_help, tmp_field in tmp_counters:
+            tmp_lines.append("# HELP {} {}".format(tmp_name, tmp_help))
+            tmp_lines.append("# TYPE {} counter".format(tmp_name))
+            tmp_lines.append("{} {}".format(tmp_name, tmp_status[tmp_field]))
+        return "\n".join(tmp_lines) + "\n"
+
+class SpoolWatcher:
+    # Picks up request files dropped in the spool directory:
+    #   <spool>/<ecosystem>-<anything>.json   the webhook payload, optionally with a "priority"
+    #   <spool>/processing/                   files claimed by the service (put back in the spool after a restart)
+    #   <spool>/done/                         the finished request, under the same name
+    # Write the file under another name (e.g. '.pypi-1.json' or 'pypi-1.json.tmp') and rename it into place, so a
+    # half written file is never picked up.
+    def __init__(self, service, spool_dir, poll_seconds = SPOOL_POLL_SECONDS):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.service = service
+        self.spool_dir = spool_dir
+        self.processing_dir = os.path.join(spool_dir, 'processing')
+        self.done_dir = os.path.join(spool_dir, 'done')
+        self.poll_seconds = poll_seconds
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        os.makedirs(self.processing_dir, exist_ok = True)
+        os.makedirs(self.done_dir, exist_ok = True)
+        for tmp_name in os.listdir(self.processing_dir):
+            self.logger.info("Requeueing '%s' left over from the last run", tmp_name)
+            os.replace(os.path.join(self.processing_dir, tmp_name), os.path.join(self.spool_dir, tmp_name))
+        self._thread = threading.Thread(target = self._watch, name = 'curation-spool', daemon = True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            try:
+                self.scan()
+            except OSError as tmp_err:
+                self.logger.warning("Failed to scan the spool directory '%s': %s", self.spool_dir, tmp_err)
+            self._stopped.wait(self.poll_seconds)
+
+    def scan(self):
+        tmp_names = sorted(
+            (tmp_name for tmp_name in os.listdir(self.spool_dir) if tmp_name.endswith('.json') and not tmp_name.startswith('.')),
+            key = lambda tmp_name: os.path.getmtime(os.path.join(self.spool_dir, tmp_name))
+        )
+        for tmp_name in tmp_names:
+            tmp_claimed = os.path.join(self.processing_dir, tmp_name)
+            try:
+                os.rename(os.path.join(self.spool_dir, tmp_name), tmp_claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                with open(tmp_claimed, 'r', encoding='utf-8') as tmp_file:
+                    tmp_payload_json = tmp_file.read()
+                tmp_ecosystem = tmp_name.split('-', 1)[0]
+                tmp_priority = int(json.loads(tmp_payload_json).get('priority', DEFAULT_PRIORITY))
+                tmp_request = self.service.submit(tmp_ecosystem, tmp_payload_json, tmp_priority, "spool:{}".format(tmp_name))
+            except QueueClosed:
+                # Left in processing/ for the next start, like a dropped request.
+                return
+            except (ValueError, KeyError, TypeError, AttributeError, OSError) as tmp_err:
+                self.logger.warning("Rejected spool file '%s': %s", tmp_name, tmp_err)
+                self._write_result(tmp_name, {'error': "{}: {}".format(type(tmp_err).__name__, tmp_err)})
+                continue
+            tmp_request.on_done(lambda tmp_done, tmp_name = tmp_name: self._request_done(tmp_name, tmp_done))
+
+    def _request_done(self, input_name, input_request):
+        if input_request.dropped:
+            # Left in processing/, so start() puts it back in the spool.
+            self.logger.info("Spool file '%s' was dropped at shutdown, it will be requeued", input_name)
+            return
+        self._write_result(input_name, input_request.as_dict())
+
+    def _write_result(self, input_name, input_result):
+        tmp_partial = os.path.join(self.done_dir, ".{}.tmp".format(input_name))
+        try:
+            with open(tmp_partial, 'w', encoding='utf-8') as tmp_file:
+                json.dump(input_result, tmp_file, indent = 2)
+            os.replace(tmp_partial, os.path.join(self.done_dir, input_name))
+            os.remove(os.path.join(self.processing_dir, input_name))
+        except OSError as tmp_err:
+            self.logger.warning("Failed to write the result of '%s': %s", input_name, tmp_err)
+
+### MAIN ###
+def main():
+    tmp_parser = argparse.ArgumentParser(
+        description = "Curate Docker, Maven, PyPI and RPM requests from an HTTP endpoint and a spool directory"
+    )
+    tmp_parser.add_argument('--listen', default = SERVICE_LISTEN, help = "HOST:PORT of the HTTP endpoint, '' for none")
+    tmp_parser.add_argument('--spool', default = SERVICE_SPOOL, help = "spool directory, '' for none")
+    tmp_parser.add_argument('--workers', type = int, default = SERVICE_WORKERS)
+    tmp_parser.add_argument('--batch-size', type = int, default = SERVICE_BATCH_SIZE)
+    tmp_args = tmp_parser.parse_args()
+    # Set up logging
+    logging.basicConfig(
+        format = "%(asctime)s:%(levelname)s:%(name)s:%(funcName)s: %(message)s",
+        level = os.environ.get('curate_service_log_level', 'INFO').upper()
+    )
+    if not tmp_args.listen and not tmp_args.spool:
+        tmp_parser.error("nothing to serve, set --listen or --spool")
+    curation_metrics.start_run('service')
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    tmp_service = CurationService(tmp_args.workers, tmp_args.batch_size)
+    tmp_service.start()
+    tmp_server = None
+    tmp_watcher = None
+    try:
+        if tmp_args.listen:
+            tmp_server = CurationServer(parse_address(tmp_args.listen), tmp_service)
+            threading.Thread(target = tmp_server.serve_forever, name = 'curation-http', daemon = True).start()
+            logging.info("Listening on http://%s:%d", *tmp_server.server_address[:2])
+        if tmp_args.spool:
+            tmp_watcher = SpoolWatcher(tmp_service, tmp_args.spool)
+            tmp_watcher.start()
+            logging.info("Watching the spool directory %s", tmp_args.spool)
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        logging.info("Shutting down")
+    finally:
+        if tmp_server is not None:
+            tmp_server.shutdown()
+            tmp_server.server_close()
+        if tmp_watcher is not None:
+            tmp_watcher.stop()
+        tmp_service.stop()
+        curation_metrics.finish_run()
+
+if __name__ == "__main__":
+    main()
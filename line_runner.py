@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import collections
+import os
+import subprocess
+import threading
+
+### GLOBALS ###
+# Output lines kept for the logs and error messages.  Every line is still handed to the caller as it's printed.
+TAIL_LINES = int(os.environ.get('curate_output_tail_lines', '200'))
+
+### FUNCTIONS ###
+def _drain(input_pipe, input_tail):
+    for tmp_raw in input_pipe:
+        input_tail.append(tmp_raw)
+    input_pipe.close()
+
+def run_lines(input_args, on_line, cwd = None, tail_lines = TAIL_LINES):
+    # Run a command and hand each line of its stdout to on_line as soon as it's printed, instead of buffering the
+    # whole output until the process exits.  stderr is drained on a thread so a chatty tool can't stall on a full
+    # pipe.  Returns a CompletedProcess like subprocess.run() does, with the last tail_lines lines of each stream.
+    # NOTE: pip and yum are Python programs, which only flush a pipe when their buffer fills unless they run
+    #       unbuffered.
+    tmp_env = dict(os.environ)
+    tmp_env['PYTHONUNBUFFERED'] = '1'
+    tmp_stdout_tail = collections.deque(maxlen = tail_lines)
+    tmp_stderr_tail = collections.deque(maxlen = tail_lines)
+    tmp_process = subprocess.Popen(input_args, cwd = cwd, env = tmp_env, stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+    tmp_drain = threading.Thread(target = _drain, args = (tmp_process.stderr, tmp_stderr_tail), daemon = True)
+    tmp_drain.start()
+    try:
+        for tmp_raw in tmp_process.stdout:
+            tmp_stdout_tail.append(tmp_raw)
+            on_line(tmp_raw.decode(errors = 'replace').rstrip('\r\n'))
+    except BaseException:
+        tmp_process.kill()
+        raise
+    finally:
+        tmp_process.stdout.close()
+        tmp_process.wait()
+        tmp_drain.join()
+    return subprocess.CompletedProcess(input_args, tmp_process.returncode, b"".join(tmp_stdout_tail),
+                                       b"".join(tmp_stderr_tail))
@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import argparse
+import concurrent.futures
+import logging
+import os
+import re
+import sys
+import threading
+import xml.etree.ElementTree as ET
+
+import curation_metrics
+
+### GLOBALS ###
+# Scope a transitive dependency ends up with, indexed by [scope of the dependency that pulled it in][its declared
+# scope].  Declared 'provided', 'test' and 'system' scopes are never transitive.
+SCOPE_MEDIATION = {
+    'compile': {'compile': 'compile', 'runtime': 'runtime'},
+    'provided': {'compile': 'provided', 'runtime': 'provided'},
+    'runtime': {'compile': 'runtime', 'runtime': 'runtime'},
+    'test': {'compile': 'test', 'runtime': 'test'},
+}
+# When one artifact is reached through several transitive paths, the widest scope wins.
+SCOPE_WIDTH = ['compile', 'runtime', 'provided', 'test', 'system']
+# Version item that a missing position or a 'ga'/'final' qualifier compares as.
+RELEASE_ITEM = (1, 0, '')
+PROPERTY_PATTERN = re.compile(r'\$\{([^}]+)\}')
+SCOPES = ['compile', 'provided', 'runtime', 'test', 'system', 'import']
+# Dependency types whose file extension (and implied classifier) differ from the type name.
+TYPE_FILES = {
+    'test-jar': ('jar', 'tests'),
+    'ejb-client': ('jar', 'client'),
+    'java-source': ('jar', 'sources'),
+    'javadoc': ('jar', 'javadoc'),
+    'maven-plugin': ('jar', None),
+    'ejb': ('jar', None),
+    'bundle': ('jar', None),
+}
+# Number of POMs fetched in parallel while a level of the dependency tree is resolved.
+POM_FETCH_WORKERS = int(os.environ.get('curate_maven_pom_workers', '8'))
+# Relocations followed from one dependency before giving up on a chain that doesn't end.
+MAX_RELOCATIONS = 10
+
+### FUNCTIONS ###
+def _local_name(input_tag):
+    return input_tag.rsplit('}', 1)[-1]
+
+def _child(input_elem, input_name):
+    if input_elem is None:
+        return None
+    for tmp_child in input_elem:
+        if _local_name(tmp_child.tag) == input_name:
+            return tmp_child
+    return None
+
+def _children(input_elem, input_name):
+    if input_elem is None:
+        return []
+    return [tmp_child for tmp_child in input_elem if _local_name(tmp_child.tag) == input_name]
+
+def _text(input_elem, input_name, input_default = None):
+    tmp_child = _child(input_elem, input_name)
+    if tmp_child is None or tmp_child.text is None:
+        return input_default
+    return tmp_child.text.strip()
+
+def _parse_dependency(input_elem):
+    return {
+        'groupId': _text(input_elem, 'groupId'),
+        'artifactId': _text(input_elem, 'artifactId'),
+        'version': _text(input_elem, 'version'),
+        'type': _text(input_elem, 'type'),
+        'classifier': _text(input_elem, 'classifier'),
+        'scope': _text(input_elem, 'scope'),
+        'optional': _text(input_elem, 'optional', 'false'),
+        'exclusions': [
+            (_text(tmp_excl, 'groupId', '*'), _text(tmp_excl, 'artifactId', '*'))
+            for tmp_excl in _children(_child(input_elem, 'exclusions'), 'exclusion')
+        ],
+    }
+
+def _parse_model_section(input_elem, input_pom):
+    # The parts of a POM that active profiles can contribute as well.
+    for tmp_prop in list(_child(input_elem, 'properties') if _child(input_elem, 'properties') is not None else []):
+        input_pom['properties'][_local_name(tmp_prop.tag)] = (tmp_prop.text or '').strip()
+    for tmp_dep in _children(_child(input_elem, 'dependencies'), 'dependency'):
+        input_pom['dependencies'].append(_parse_dependency(tmp_dep))
+    tmp_managed = _child(_child(input_elem, 'dependencyManagement'), 'dependencies')
+    for tmp_dep in _children(tmp_managed, 'dependency'):
+        input_pom['managed'].append(_parse_dependency(tmp_dep))
+
+def parse_pom(input_text):
+    tmp_root = ET.fromstring(input_text)
+    tmp_parent = _child(tmp_root, 'parent')
+    tmp_relocation = _child(_child(tmp_root, 'distributionManagement'), 'relocation')
+    tmp_pom = {
+        'groupId': _text(tmp_root, 'groupId'),
+        'artifactId': _text(tmp_root, 'artifactId'),
+        'version': _text(tmp_root, 'version'),
+        'packaging': _text(tmp_root, 'packaging', 'jar'),
+        'parent': None,
+        'relocation': None,
+        'properties': {},
+        'dependencies': [],
+        'managed': [],
+    }
+    if tmp_parent is not None:
+        tmp_pom['parent'] = (_text(tmp_parent, 'groupId'), _text(tmp_parent, 'artifactId'), _text(tmp_parent, 'version'))
+    if tmp_relocation is not None:
+        tmp_pom['relocation'] = (_text(tmp_relocation, 'groupId'), _text(tmp_relocation, 'artifactId'),
+                                 _text(tmp_relocation, 'version'))
+    _parse_model_section(tmp_root, tmp_pom)
+    # NOTE: Only profiles that are active by default are applied; JDK/OS/property activation isn't evaluated.
+    for tmp_profile in _children(_child(tmp_root, 'profiles'), 'profile'):
+        if _text(_child(tmp_profile, 'activation'), 'activeByDefault', 'false') == 'true':
+            _parse_model_section(tmp_profile, tmp_pom)
+    return tmp_pom
+
+def pom_path(group_id, artifact_id, version):
+    return "{}/{}/{}/{}-{}.pom".format(group_id.replace('.', '/'), artifact_id, version, artifact_id, version)
+
+def metadata_path(group_id, artifact_id):
+    return "{}/{}/maven-metadata.xml".format(group_id.replace('.', '/'), artifact_id)
+
+def _version_key(input_version):
+    # Approximation of Maven's ComparableVersion.  Each item orders as: pre-release qualifiers (alpha < beta <
+    # milestone < rc < snapshot) < release < other qualifiers (sp, then unknown ones alphabetically) < numbers.
+    tmp_qualifiers = {'alpha': 0, 'a': 0, 'beta': 1, 'b': 1, 'milestone': 2, 'm': 2, 'rc': 3, 'cr': 3,
+                      'snapshot': 4, 'ga': 5, 'final': 5, 'release': 5, 'sp': 6}
+    tmp_key = []
+    for tmp_token in re.findall(r'\d+|[a-zA-Z]+', input_version):
+        if tmp_token.isdigit():
+            tmp_key.append((3, int(tmp_token), ''))
+            continue
+        # Zeros before a qualifier are dropped as well, so '1.0-beta' compares like '1-beta'.
+        while tmp_key and tmp_key[-1] == (3, 0, ''):
+            tmp_key.pop()
+        tmp_rank = tmp_qualifiers.get(tmp_token.lower(), 7)
+        if tmp_rank < 5:
+            tmp_key.append((0, tmp_rank, ''))
+        elif tmp_rank == 5:
+            tmp_key.append(RELEASE_ITEM)
+        else:
+            tmp_key.append((2, tmp_rank, tmp_token.lower()))
+    # Trailing zeros and release qualifiers don't change the version ('1.0' == '1' == '1.0.final').
+    while tmp_key and tmp_key[-1] in (RELEASE_ITEM, (3, 0, '')):
+        tmp_key.pop()
+    return tmp_key
+
+def compare_versions(input_left, input_right):
+    tmp_left = _version_key(input_left)
+    tmp_right = _version_key(input_right)
+    # The shorter version is padded with release items, so '1.0' > '1.0-beta' but '1.0' < '1.0.1'.
+    tmp_length = max(len(tmp_left), len(tmp_right))
+    tmp_left += [RELEASE_ITEM] * (tmp_length - len(tmp_left))
+    tmp_right += [RELEASE_ITEM] * (tmp_length - len(tmp_right))
+    return (tmp_left > tmp_right) - (tmp_left < tmp_right)
+
+def version_in_range(input_version, input_range):
+    # '[1.0,2.0)', '[1.5,)', '(,1.0]', '[1.2]' and unions such as '[1,2),[3,4)'.
+    for tmp_match in re.finditer(r'([\[(])([^\])]*)([\])])', input_range):
+        tmp_lower_inclusive = tmp_match.group(1) == '['
+        tmp_upper_inclusive = tmp_match.group(3) == ']'
+        tmp_bounds = tmp_match.group(2).split(',')
+        if len(tmp_bounds) == 1:
+            if compare_versions(input_version, tmp_bounds[0].strip()) == 0:
+                return True
+            continue
+        tmp_lower, tmp_upper = tmp_bounds[0].strip(), tmp_bounds[1].strip()
+        if tmp_lower:
+            tmp_cmp = compare_versions(input_version, tmp_lower)
+            if tmp_cmp < 0 or (tmp_cmp == 0 and not tmp_lower_inclusive):
+                continue
+        if tmp_upper:
+            tmp_cmp = compare_versions(input_version, tmp_upper)
+            if tmp_cmp > 0 or (tmp_cmp == 0 and not tmp_upper_inclusive):
+                continue
+        return True
+    return False
+
+def format_dependency_line(group_id, artifact_id, dep_type, classifier, version, scope):
+    # Same shape as the entries printed by 'mvn dependency:list', so MavenCoordinate.parse() reads both the same way.
+    if classifier:
+        return "{}:{}:{}:{}:{}:{}".format(group_id, artifact_id, dep_type, classifier, version, scope)
+    return "{}:{}:{}:{}:{}".format(group_id, artifact_id, dep_type, version, scope)
+
+### CLASSES ###
+class MavenCoordinate:
+    def __init__(self, group_id, artifact_id, version, dep_type = 'jar', classifier = None, scope = None):
+        self.group_id = group_id
+        self.artifact_id = artifact_id
+        self.version = version
+        self.type = dep_type or 'jar'
+        self.classifier = classifier or None
+        self.scope = scope
+
+    @classmethod
+    def parse(cls, input_line):
+        # The entries 'mvn dependency:list' prints: 'g:a:type:version:scope' or 'g:a:type:classifier:version:scope',
+        # possibly followed by ' -- module ...'.  Scope-less 'g:a:version', 'g:a:type:version' and
+        # 'g:a:type:classifier:version' are accepted as well.
+        tmp_split = input_line.strip().split()[0].split(':')
+        tmp_scope = None
+        if len(tmp_split) >= 5 and tmp_split[-1] in SCOPES:
+            tmp_scope = tmp_split.pop()
+        if len(tmp_split) == 3:
+            return cls(tmp_split[0], tmp_split[1], tmp_split[2], scope = tmp_scope)
+        if len(tmp_split) == 4:
+            return cls(tmp_split[0], tmp_split[1], tmp_split[3], tmp_split[2], scope = tmp_scope)
+        if len(tmp_split) == 5:
+            return cls(tmp_split[0], tmp_split[1], tmp_split[4], tmp_split[2], tmp_split[3], tmp_scope)
+        raise ValueError("Not a Maven coordinate: {}".format(input_line))
+
+    @property
+    def extension(self):
+        return TYPE_FILES.get(self.type, (self.type, None))[0]
+
+    @property
+    def file_classifier(self):
+        return self.classifier or TYPE_FILES.get(self.type, (self.type, None))[1]
+
+    @property
+    def directory(self):
+        return "{}/{}/{}".format(self.group_id.replace('.', '/'), self.artifact_id, self.version)
+
+    @property
+    def artifact_path(self):
+        if self.file_classifier:
+            return "{}/{}-{}-{}.{}".format(self.directory, self.artifact_id, self.version, self.file_classifier,
+                                           self.extension)
+        return "{}/{}-{}.{}".format(self.directory, self.artifact_id, self.version, self.extension)
+
+    @property
+    def pom_path(self):
+        return pom_path(self.group_id, self.artifact_id, self.version)
+
+    def paths(self):
+        # The files a consumer downloads for this dependency: the artifact itself and the POM describing it.
+        # NOTE: The .sha1/.md5 siblings aren't listed, Artifactory keeps the checksums with each file and serves them
+        #       from the local repo once the file is there.
+        tmp_paths = [self.artifact_path]
+        if self.pom_path != self.artifact_path:
+            tmp_paths.append(self.pom_path)
+        return tmp_paths
+
+    def __str__(self):
+        return format_dependency_line(self.group_id, self.artifact_id, self.type, self.classifier, self.version,
+                                      self.scope or 'compile')
+
+    def __repr__(self):
+        return "<MavenCoordinate {}>".format(self)
+
+class ArtifactoryPomSource:
+    def __init__(self, client, repo):
+        self.client = client
+        self.repo = repo
+
+    def fetch(self, input_path):
+        tmp_response = self.client.get("{}/{}".format(self.repo, input_path))
+        if not tmp_response.ok:
+            logging.debug("  Failed to fetch '%s': %s", input_path, tmp_response.status)
+            return None
+        return tmp_response.text()
+
+class DirectoryPomSource:
+    # A Maven repository layout on disk, used by the fixture corpus.
+    def __init__(self, root):
+        self.root = root
+
+    def fetch(self, input_path):
+        tmp_path = os.path.join(self.root, input_path)
+        if not os.path.isfile(tmp_path):
+            return None
+        with open(tmp_path, 'r', encoding='utf-8') as tmp_file:
+            return tmp_file.read()
+
+class ResolutionError(Exception):
+    pass
+
+class PomResolver:
+    def __init__(self, source, fetch_workers = POM_FETCH_WORKERS):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.source = source
+        self.fetch_workers = max(1, fetch_workers)
+        self._lock = threading.Lock()
+        self._raw = {}
+        self._effective = {}
+        self._versions = {}
+        # Parent and BOM POMs that resolved models were built from, which a consumer needs as well.
+        self.support_poms = []
+
+    def _fetch_raw(self, input_coords):
+        with self._lock:
+            if input_coords in self._raw:
+                return self._raw[input_coords]
+        tmp_text = self.source.fetch(pom_path(*input_coords))
+        tmp_raw = parse_pom(tmp_text) if tmp_text is not None else None
+        with self._lock:
+            self._raw[input_coords] = tmp_raw
+        return tmp_raw
+
+    def _add_support_pom(self, input_coords):
+        with self._lock:
+            if input_coords not in self.support_poms:
+                self.support_poms.append(input_coords)
+
+    def _prefetch(self, input_coords_list):
+        with self._lock:
+            tmp_missing = sorted(set(tmp_coords for tmp_coords in input_coords_list if tmp_coords not in self._raw))
+        if len(tmp_missing) < 2:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers = self.fetch_workers) as tmp_executor:
+            list(tmp_executor.map(curation_metrics.in_current_stage(self._fetch_raw), tmp_missing))
+
+    def _available_versions(self, group_id, artifact_id):
+        tmp_key = (group_id, artifact_id)
+        if tmp_key not in self._versions:
+            tmp_text = self.source.fetch(metadata_path(group_id, artifact_id))
+            tmp_versions = []
+            if tmp_text is not None:
+                tmp_versions = [tmp_elem.text.strip() for tmp_elem in ET.fromstring(tmp_text).iter()
+                                if _local_name(tmp_elem.tag) == 'version' and tmp_elem.text]
+            self._versions[tmp_key] = tmp_versions
+        return self._versions[tmp_key]
+
+    def _select_version(self, group_id, artifact_id, input_version):
+        if not input_version or input_version[0] not in '[(':
+            return input_version
+        tmp_candidates = [tmp_version for tmp_version in self._available_versions(group_id, artifact_id)
+                          if version_in_range(tmp_version, input_version)]
+        if not tmp_candidates:
+            raise ResolutionError("No version of {}:{} matches {}".format(group_id, artifact_id, input_version))
+        tmp_best = tmp_candidates[0]
+        for tmp_version in tmp_candidates[1:]:
+            if compare_versions(tmp_version, tmp_best) > 0:
+                tmp_best = tmp_version
+        return tmp_best
+
+    def _interpolate(self, input_value, input_properties):
+        if input_value is None:
+            return None
+        for _ in range(10):
+            tmp_new = PROPERTY_PATTERN.sub(
+                lambda tmp_match: input_properties.get(tmp_match.group(1), tmp_match.group(0)), input_value
+            )
+            if tmp_new == input_value:
+                break
+            input_value = tmp_new
+        return input_value
+
+    def _interpolate_dependency(self, input_dep, input_properties):
+        tmp_dep = dict(input_dep)
+        for tmp_field in ('groupId', 'artifactId', 'version', 'type', 'classifier', 'scope', 'optional'):
+            tmp_dep[tmp_field] = self._interpolate(tmp_dep[tmp_field], input_properties)
+        tmp_dep['exclusions'] = [
+            (self._interpolate(tmp_g, input_properties), self._interpolate(tmp_a, input_properties))
+            for tmp_g, tmp_a in tmp_dep['exclusions']
+        ]
+        return tmp_dep
+
+    @staticmethod
+    def _key(input_dep):
+        return (input_dep['groupId'], input_dep['artifactId'], input_dep['type'] or 'jar', input_dep['classifier'] or '')
+
+    def effective_model(self, input_raw, input_stack = ()):
+        # Inherit from the parent chain, interpolate properties, import BOMs and apply dependencyManagement.
+        tmp_chain = [input_raw]
+        tmp_parent = input_raw['parent']
+        while tmp_parent is not None:
+            if tmp_parent in input_stack or len(tmp_chain) > 50:
+                raise ResolutionError("Parent cycle at {}".format(":".join(tmp_parent)))
+            tmp_parent_raw = self._fetch_raw(tmp_parent)
+            if tmp_parent_raw is None:
+                raise ResolutionError("Missing parent POM {}".format(":".join(tmp_parent)))
+            tmp_chain.append(tmp_parent_raw)
+            self._add_support_pom(tmp_parent)
+            tmp_parent = tmp_parent_raw['parent']
+        tmp_group = input_raw['groupId'] or (input_raw['parent'][0] if input_raw['parent'] else None)
+        tmp_version = input_raw['version'] or (input_raw['parent'][2] if input_raw['parent'] else None)
+        tmp_properties = {}
+        for tmp_raw in reversed(tmp_chain):
+            tmp_properties.update(tmp_raw['properties'])
+        for tmp_prefix in ('project.', 'pom.', ''):
+            tmp_properties[tmp_prefix + 'groupId'] = tmp_group
+            tmp_properties[tmp_prefix + 'artifactId'] = input_raw['artifactId']
+            tmp_properties[tmp_prefix + 'version'] = tmp_version
+            tmp_properties[tmp_prefix + 'packaging'] = input_raw['packaging']
+        if input_raw['parent'] is not None:
+            tmp_properties['project.parent.groupId'] = input_raw['parent'][0]
+            tmp_properties['project.parent.artifactId'] = input_raw['parent'][1]
+            tmp_properties['project.parent.version'] = input_raw['parent'][2]
+        tmp_group = self._interpolate(tmp_group, tmp_properties)
+        tmp_version = self._interpolate(tmp_version, tmp_properties)
+        tmp_properties['project.version'] = tmp_properties['pom.version'] = tmp_properties['version'] = tmp_version
+        tmp_coords = (tmp_group, self._interpolate(input_raw['artifactId'], tmp_properties), tmp_version)
+
+        # dependencyManagement: the nearest POM in the chain wins, then BOM imports in declaration order.
+        tmp_managed = {}
+        tmp_imports = []
+        for tmp_raw in tmp_chain:
+            for tmp_dep in tmp_raw['managed']:
+                tmp_dep = self._interpolate_dependency(tmp_dep, tmp_properties)
+                if tmp_dep['scope'] == 'import' and (tmp_dep['type'] or 'jar') == 'pom':
+                    tmp_imports.append(tmp_dep)
+                    continue
+                tmp_managed.setdefault(self._key(tmp_dep), tmp_dep)
+        for tmp_bom in tmp_imports:
+            tmp_bom_coords = (tmp_bom['groupId'], tmp_bom['artifactId'], tmp_bom['version'])
+            tmp_bom_model = self.effective(tmp_bom_coords, input_stack + (tmp_coords,))
+            if tmp_bom_model is None:
+                raise ResolutionError("Missing BOM {}".format(":".join(tmp_bom_coords)))
+            self._add_support_pom(tmp_bom_coords)
+            for tmp_key, tmp_dep in tmp_bom_model['managed'].items():
+                tmp_managed.setdefault(tmp_key, tmp_dep)
+
+        # Dependencies are inherited from the parents; the child's declaration wins for the same key.
+        tmp_dependencies = []
+        tmp_seen = set()
+        for tmp_raw in tmp_chain:
+            for tmp_dep in tmp_raw['dependencies']:
+                tmp_dep = self._interpolate_dependency(tmp_dep, tmp_properties)
+                if self._key(tmp_dep) in tmp_seen:
+                    continue
+                tmp_seen.add(self._key(tmp_dep))
+                tmp_managed_dep = tmp_managed.get(self._key(tmp_dep))
+                if tmp_managed_dep is not None:
+                    tmp_dep['version'] = tmp_dep['version'] or tmp_managed_dep['version']
+                    tmp_dep['scope'] = tmp_dep['scope'] or tmp_managed_dep['scope']
+                    if not tmp_dep['exclusions']:
+                        tmp_dep['exclusions'] = tmp_managed_dep['exclusions']
+                tmp_dependencies.append(tmp_dep)
+        return {
+            'coords': tmp_coords,
+            'relocation': input_raw['relocation'],
+            'dependencies': tmp_dependencies,
+            'managed': tmp_managed,
+        }
+
+    def effective(self, input_coords, input_stack = ()):
+        with self._lock:
+            if input_coords in self._effective:
+                return self._effective[input_coords]
+        tmp_raw = self._fetch_raw(input_coords)
+        tmp_model = self.effective_model(tmp_raw, input_stack) if tmp_raw is not None else None
+        with self._lock:
+            self._effective[input_coords] = tmp_model
+        return tmp_model
+
+    def resolve_model(self, input_model):
+        # Breadth first, so the nearest declaration of an artifact wins and, at equal depth, the first one.
+        tmp_root_managed = input_model['managed']
+        tmp_resolved = {}
+        tmp_order = []
+        tmp_level = []
+        for tmp_dep in input_model['dependencies']:
+            tmp_scope = tmp_dep['scope'] or 'compile'
+            tmp_level.append((tmp_dep, tmp_scope, frozenset(tmp_dep['exclusions']), True))
+        while tmp_level:
+            tmp_next_level = []
+            tmp_expand = []
+            for tmp_dep, tmp_scope, tmp_exclusions, tmp_direct in tmp_level:
+                tmp_key = self._key(tmp_dep)
+                if tmp_key in tmp_resolved:
+                    # Already resolved nearer (or earlier): the version stays, a transitive scope may widen.
+                    tmp_entry = tmp_resolved[tmp_key]
+                    if not tmp_entry['direct'] and SCOPE_WIDTH.index(tmp_scope) < SCOPE_WIDTH.index(tmp_entry['scope']):
+                        tmp_entry['scope'] = tmp_scope
+                    continue
+                tmp_version = self._select_version(tmp_dep['groupId'], tmp_dep['artifactId'], tmp_dep['version'])
+                if not tmp_version:
+                    raise ResolutionError("No version for {}:{}".format(tmp_dep['groupId'], tmp_dep['artifactId']))
+                tmp_resolved[tmp_key] = {'version': tmp_version, 'scope': tmp_scope, 'direct': tmp_direct}
+                tmp_order.append(tmp_key)
+                if tmp_scope != 'system':
+                    tmp_expand.append((tmp_key, tmp_scope, tmp_exclusions))
+            self._prefetch([(tmp_key[0], tmp_key[1], tmp_resolved[tmp_key]['version']) for tmp_key, _, _ in tmp_expand])
+            for tmp_key, tmp_scope, tmp_exclusions in tmp_expand:
+                tmp_coords = (tmp_key[0], tmp_key[1], tmp_resolved[tmp_key]['version'])
+                tmp_model = self.effective(tmp_coords)
+                # Like Maven, a relocated artifact is replaced by its new coordinates.  The POM announcing the
+                # relocation is still downloaded by consumers, so it's curated along with the other support POMs.
+                tmp_relocations = 0
+                while tmp_model is not None and tmp_model['relocation'] is not None:
+                    tmp_target = tuple(tmp_new or tmp_old for tmp_new, tmp_old in zip(tmp_model['relocation'], tmp_coords))
+                    tmp_relocations += 1
+                    if tmp_target == tmp_coords or tmp_relocations > MAX_RELOCATIONS:
+                        raise ResolutionError("Relocation of {} doesn't end".format(":".join(tmp_coords)))
+                    self.logger.info("%s has been relocated to %s", ":".join(tmp_coords), ":".join(tmp_target))
+                    self._add_support_pom(tmp_coords)
+                    tmp_entry = tmp_resolved.pop(tmp_key)
+                    tmp_target_key = (tmp_target[0], tmp_target[1], tmp_key[2], tmp_key[3])
+                    if tmp_target_key in tmp_resolved:
+                        # The target was already resolved on its own, which wins as it's nearer (or earlier).
+                        tmp_order.remove(tmp_key)
+                        tmp_coords = None
+                        break
+                    tmp_order[tmp_order.index(tmp_key)] = tmp_target_key
+                    tmp_entry['version'] = tmp_target[2]
+                    tmp_resolved[tmp_target_key] = tmp_entry
+                    tmp_key = tmp_target_key
+                    tmp_coords = tmp_target
+                    tmp_model = self.effective(tmp_coords)
+                if tmp_coords is None:
+                    continue
+                if tmp_model is None:
+                    self.logger.warning("Missing POM for %s, its dependencies are not resolved", ":".join(tmp_coords))
+                    continue
+                for tmp_child in tmp_model['dependencies']:
+                    if tmp_child['optional'] == 'true':
+                        continue
+                    tmp_child_scope = SCOPE_MEDIATION[tmp_scope].get(tmp_child['scope'] or 'compile')
+                    if tmp_child_scope is None:
+                        continue
+                    if any((tmp_g in ('*', tmp_child['groupId'])) and (tmp_a in ('*', tmp_child['artifactId']))
+                           for tmp_g, tmp_a in tmp_exclusions):
+                        continue
+                    tmp_child = dict(tmp_child)
+                    # The root POM's dependencyManagement also governs transitive versions and scopes.
+                    tmp_root_dep = tmp_root_managed.get(self._key(tmp_child))
+                    if tmp_root_dep is not None:
+                        tmp_child['version'] = tmp_root_dep['version'] or tmp_child['version']
+                        if tmp_root_dep['scope']:
+                            tmp_child_scope = tmp_root_dep['scope']
+                    tmp_next_level.append((tmp_child, tmp_child_scope,
+                                           tmp_exclusions | frozenset(tmp_child['exclusions']), False))
+            tmp_level = tmp_next_level
+        return [
+            format_dependency_line(tmp_key[0], tmp_key[1], tmp_key[2], tmp_key[3],
+                                   tmp_resolved[tmp_key]['version'], tmp_resolved[tmp_key]['scope'])
+            for tmp_key in tmp_order
+        ]
+
+    def resolve_pom_text(self, input_text):
+        self.logger.debug("Resolving dependencies of an in-memory pom.xml")
+        return self.resolve_model(self.effective_model(parse_pom(input_text)))
+
+def validate_corpus(input_dir):
+    # Each case in <input_dir>/cases/<name>/ has a pom.xml and the expected 'mvn dependency:list' entries in
+    # expected.txt, and all of them resolve against the repository layout in <input_dir>/repo.
+    tmp_source = DirectoryPomSource(os.path.join(input_dir, 'repo'))
+    tmp_failures = 0
+    tmp_cases_dir = os.path.join(input_dir, 'cases')
+    for tmp_case in sorted(os.listdir(tmp_cases_dir)):
+        with open(os.path.join(tmp_cases_dir, tmp_case, 'pom.xml'), 'r', encoding='utf-8') as tmp_file:
+            tmp_pom_text = tmp_file.read()
+        with open(os.path.join(tmp_cases_dir, tmp_case, 'expected.txt'), 'r', encoding='utf-8') as tmp_file:
+            tmp_expected = sorted(tmp_line.strip() for tmp_line in tmp_file if tmp_line.strip())
+        tmp_actual = sorted(PomResolver(tmp_source).resolve_pom_text(tmp_pom_text))
+        if tmp_actual == tmp_expected:
+            logging.info("PASS %s", tmp_case)
+            continue
+        tmp_failures += 1
+        logging.warning("FAIL %s", tmp_case)
+        for tmp_line in sorted(set(tmp_expected) - set(tmp_actual)):
+            logging.warning("  missing:    %s", tmp_line)
+        for tmp_line in sorted(set(tmp_actual) - set(tmp_expected)):
+            logging.warning("  unexpected: %s", tmp_line)
+    return tmp_failures
+
+### MAIN ###
+def main():
+    tmp_parser = argparse.ArgumentParser(description = "Resolve the dependencies of a pom.xml without Maven")
+    tmp_parser.add_argument('pom', nargs = '?', help = "pom.xml to resolve")
+    tmp_parser.add_argument('--repo-dir', help = "local directory in Maven repository layout to read POMs from")
+    tmp_parser.add_argument('--validate', metavar = 'CORPUS_DIR', help = "check the resolver against a fixture corpus")
+    tmp_args = tmp_parser.parse_args()
+    logging.basicConfig(format = "%(levelname)s: %(message)s", level = logging.INFO)
+    if tmp_args.validate:
+        sys.exit(1 if validate_corpus(tmp_args.validate) else 0)
+    if not tmp_args.pom or not tmp_args.repo_dir:
+        tmp_parser.error("a pom.xml and --repo-dir are required unless --validate is used")
+    with open(tmp_args.pom, 'r', encoding='utf-8') as tmp_file:
+        for tmp_line in PomResolver(DirectoryPomSource(tmp_args.repo_dir)).resolve_pom_text(tmp_file.read()):
+            print(tmp_line)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+
+### IMPORTS ###
+import argparse
+import bz2
+import gzip
+import io
+import logging
+import lzma
+import os
+import re
+import xml.etree.ElementTree as ET
+
+### GLOBALS ###
+REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+COMMON_NS = '{http://linux.duke.edu/metadata/common}'
+RPM_NS = '{http://linux.duke.edu/metadata/rpm}'
+DECOMPRESSORS = {'.gz': gzip.decompress, '.xz': lzma.decompress, '.bz2': bz2.decompress}
+# Repo layout of the remote: one repo per section under <releasever>/<section>/<basearch>/, e.g. '7/os/x86_64/'.
+RPM_RELEASEVER = os.environ.get('curate_rpm_releasever', '7')
+RPM_BASEARCH = os.environ.get('curate_rpm_basearch', 'x86_64')
+RPM_SECTIONS = [tmp_section.strip() for tmp_section in os.environ.get('curate_rpm_sections', 'os,updates,extras').split(',')
+                if tmp_section.strip()]
+# 'name', 'name.arch', 'name-version', 'name-version-release' and 'name-version-release.arch' package specs.
+ARCH_SUFFIX_PATTERN = re.compile(r'^(.+)\.(noarch|x86_64|i686|i386|aarch64|ppc64le|ppc64|s390x|armv7hl|src)$')
+VERSION_TOKEN_PATTERN = re.compile(r'~|\^|[a-zA-Z]+|\d+')
+
+### FUNCTIONS ###
+def rpmvercmp(input_left, input_right):
+    # rpm's version segment comparison: digits and letters are compared in runs, digits beat letters, '~' sorts
+    # before anything (even the end of the string) and '^' sorts after the end of the string but before anything else.
+    if input_left == input_right:
+        return 0
+    tmp_left = VERSION_TOKEN_PATTERN.findall(input_left)
+    tmp_right = VERSION_TOKEN_PATTERN.findall(input_right)
+    for tmp_idx in range(max(len(tmp_left), len(tmp_right))):
+        tmp_l = tmp_left[tmp_idx] if tmp_idx < len(tmp_left) else None
+        tmp_r = tmp_right[tmp_idx] if tmp_idx < len(tmp_right) else None
+        if tmp_l == '~' or tmp_r == '~':
+            if tmp_l != '~':
+                return 1
+            if tmp_r != '~':
+                return -1
+            continue
+        if tmp_l == '^' or tmp_r == '^':
+            if tmp_l is None:
+                return -1
+            if tmp_r is None:
+                return 1
+            if tmp_l != '^':
+                return 1
+            if tmp_r != '^':
+                return -1
+            continue
+        if tmp_l is None:
+            return -1
+        if tmp_r is None:
+            return 1
+        if tmp_l.isdigit() != tmp_r.isdigit():
+            return 1 if tmp_l.isdigit() else -1
+        if tmp_l.isdigit():
+            tmp_l, tmp_r = int(tmp_l), int(tmp_r)
+        if tmp_l != tmp_r:
+            return 1 if tmp_l > tmp_r else -1
+    return 0
+
+def evrcmp(input_left, input_right):
+    # (epoch, version, release) tuples.  A missing release on either side only compares epoch and version, the way
+    # 'Requires: foo >= 1.2' matches every release of 1.2.
+    tmp_cmp = (int(input_left[0] or 0) > int(input_right[0] or 0)) - (int(input_left[0] or 0) < int(input_right[0] or 0))
+    if tmp_cmp:
+        return tmp_cmp
+    tmp_cmp = rpmvercmp(input_left[1] or '', input_right[1] or '')
+    if tmp_cmp or not input_left[2] or not input_right[2]:
+        return tmp_cmp
+    return rpmvercmp(input_left[2], input_right[2])
+
+def _flag_matches(input_flags, input_cmp):
+    return {
+        'EQ': input_cmp == 0, 'LT': input_cmp < 0, 'LE': input_cmp <= 0, 'GT': input_cmp > 0, 'GE': input_cmp >= 0,
+    }.get(input_flags, True)
+
+def _parse_entries(input_elem):
+    tmp_entries = []
+    if input_elem is None:
+        return tmp_entries
+    for tmp_entry in input_elem.findall(RPM_NS + 'entry'):
+        tmp_entries.append((
+            tmp_entry.get('name'),
+            tmp_entry.get('flags'),
+            (tmp_entry.get('epoch'), tmp_entry.get('ver'), tmp_entry.get('rel')),
+        ))
+    return tmp_entries
+
+def parse_primary(input_data, input_prefix):
+    # Stream through primary.xml, keeping only what the closure needs from each <package>.
+    tmp_packages = []
+    for tmp_event, tmp_elem in ET.iterparse(input_data, events = ('end',)):
+        if tmp_elem.tag != COMMON_NS + 'package':
+            continue
+        if tmp_elem.get('type') == 'rpm':
+            tmp_version = tmp_elem.find(COMMON_NS + 'version')
+            tmp_format = tmp_elem.find(COMMON_NS + 'format')
+            tmp_packages.append(RpmPackage(
+                tmp_elem.findtext(COMMON_NS + 'name'),
+                tmp_elem.findtext(COMMON_NS + 'arch'),
+                (tmp_version.get('epoch'), tmp_version.get('ver'), tmp_version.get('rel')),
+                "{}/{}".format(input_prefix, tmp_elem.find(COMMON_NS + 'location').get('href')),
+                _parse_entries(tmp_format.find(RPM_NS + 'provides')),
+                _parse_entries(tmp_format.find(RPM_NS + 'requires')),
+                [tmp_file.text for tmp_file in tmp_format.findall(COMMON_NS + 'file')],
+            ))
+        tmp_elem.clear()
+    return tmp_packages
+
+def split_package_spec(input_spec):
+    # Candidate (name, version, release, arch) readings of a package spec, most literal first.
+    tmp_arch = None
+    tmp_spec = input_spec.strip()
+    tmp_match = ARCH_SUFFIX_PATTERN.match(tmp_spec)
+    tmp_candidates = [(tmp_spec, None, None, None)]
+    if tmp_match:
+        tmp_spec, tmp_arch = tmp_match.group(1), tmp_match.group(2)
+        tmp_candidates.append((tmp_spec, None, None, tmp_arch))
+    tmp_parts = tmp_spec.rsplit('-', 2)
+    if len(tmp_parts) >= 2:
+        tmp_candidates.append(("-".join(tmp_parts[:-1]), tmp_parts[-1], None, tmp_arch))
+    if len(tmp_parts) == 3:
+        tmp_candidates.append((tmp_parts[0], tmp_parts[1], tmp_parts[2], tmp_arch))
+    return tmp_candidates
+
+### CLASSES ###
+class RpmPackage:
+    def __init__(self, name, arch, evr, location, provides, requires, files):
+        self.name = name
+        self.arch = arch
+        self.evr = evr
+        # Path relative to the remote repo, e.g. '7/os/x86_64/Packages/bash-4.2.46-34.el7.x86_64.rpm'.
+        self.location = location
+        self.provides = provides
+        self.requires = requires
+        self.files = files
+
+    @property
+    def nevra(self):
+        tmp_epoch = "{}:".format(self.evr[0]) if self.evr[0] not in (None, '0') else ''
+        return "{}-{}{}-{}.{}".format(self.name, tmp_epoch, self.evr[1], self.evr[2], self.arch)
+
+    def __repr__(self):
+        return "<RpmPackage {}>".format(self.nevra)
+
+class ArtifactoryRepoSource:
+    def __init__(self, client, repo):
+        self.client = client
+        self.repo = repo
+
+    def fetch(self, input_path):
+        tmp_response = self.client.get("{}/{}".format(self.repo, input_path))
+        if not tmp_response.ok:
+            logging.debug("  Failed to fetch '%s': %s", input_path, tmp_response.status)
+            return None
+        return tmp_response.body
+
+class DirectoryRepoSource:
+    def __init__(self, root):
+        self.root = root
+
+    def fetch(self, input_path):
+        tmp_path = os.path.join(self.root, input_path)
+        if not os.path.isfile(tmp_path):
+            return None
+        with open(tmp_path, 'rb') as tmp_file:
+            return tmp_file.read()
+
+class ResolutionError(Exception):
+    pass
+
+class RepodataIndex:
+    # Provides/requires index over the primary metadata of one or more repos.  Loading reads repomd.xml and the
+    # primary file of each repo once; nothing is installed and no RPM is downloaded.
+    def __init__(self, source, basearch = RPM_BASEARCH):
+        self.logger = logging.getLogger(type(self).__name__)
+        self.source = source
+        self.basearch = basearch
+        self.packages = []
+        self._by_name = {}
+        self._provides = {}
+        self._files = {}
+
+    def load(self, input_prefix):
+        tmp_repomd = self.source.fetch("{}/repodata/repomd.xml".format(input_prefix))
+        if tmp_repomd is None:
+            raise ResolutionError("No repomd.xml under '{}'".format(input_prefix))
+        tmp_href = None
+        for tmp_data in ET.fromstring(tmp_repomd).findall(REPO_NS + 'data'):
+            if tmp_data.get('type') == 'primary':
+                tmp_href = tmp_data.find(REPO_NS + 'location').get('href')
+        if tmp_href is None:
+            raise ResolutionError("No primary metadata in '{}/repodata/repomd.xml'".format(input_prefix))
+        tmp_primary = self.source.fetch("{}/{}".format(input_prefix, tmp_href))
+        if tmp_primary is None:
+            raise ResolutionError("Failed to fetch '{}/{}'".format(input_prefix, tmp_href))
+        tmp_ext = os.path.splitext(tmp_href)[1]
+        if tmp_ext in DECOMPRESSORS:
+            tmp_primary = DECOMPRESSORS[tmp_ext](tmp_primary)
+        elif tmp_ext != '.xml':
+            raise ResolutionError("Unsupported compression for '{}'".format(tmp_href))
+        tmp_packages = parse_primary(io.BytesIO(tmp_primary), input_prefix)
+        for tmp_package in tmp_packages:
+            self._add(tmp_package)
+        self.logger.info("Loaded %d packages from '%s'", len(tmp_packages), input_prefix)
+        return len(tmp_packages)
+
+    def _add(self, input_package):
+        self.packages.append(input_package)
+        self._by_name.setdefault(input_package.name, []).append(input_package)
+        for tmp_name, tmp_flags, tmp_evr in input_package.provides:
+            self._provides.setdefault(tmp_name, []).append((input_package, tmp_flags, tmp_evr))
+        for tmp_file in input_package.files:
+            self._files.setdefault(tmp_file, []).append(input_package)
+
+    def _arch_rank(self, input_package):
+        if input_package.arch in (self.basearch, 'noarch'):
+            return 0
+        if input_package.arch == 'src':
+            return 2
+        return 1
+
+    def _best(self, input_packages):
+        # Native/noarch before multilib arches, then the highest EVR.  Ties keep the first loaded repo.
+        tmp_best = None
+        for tmp_package in input_packages:
+            if tmp_package.arch == 'src':
+                continue
+            if tmp_best is None:
+                tmp_best = tmp_package
+                continue
+            tmp_rank = (self._arch_rank(tmp_package), self._arch_rank(tmp_best))
+            if tmp_rank[0] < tmp_rank[1] or (tmp_rank[0] == tmp_rank[1] and evrcmp(tmp_package.evr, tmp_best.evr) > 0):
+                tmp_best = tmp_package
+        return tmp_best
+
+    def providers(self, input_name, input_flags = None, input_evr = None):
+        tmp_providers = []
+        for tmp_package, tmp_flags, tmp_evr in self._provides.get(input_name, []):
+            # An unversioned provide satisfies any version of the requirement.
+            if input_flags and tmp_flags == 'EQ' and not _flag_matches(input_flags, evrcmp(tmp_evr, input_evr)):
+                continue
+            if tmp_package not in tmp_providers:
+                tmp_providers.append(tmp_package)
+        if input_name.startswith('/'):
+            for tmp_package in self._files.get(input_name, []):
+                if tmp_package not in tmp_providers:
+                    tmp_providers.append(tmp_package)
+        return tmp_providers
+
+    def find(self, input_spec):
+        # The package a 'yum install <spec>' would pick: by name (optionally with version/release/arch), then by
+        # anything the package provides, e.g. 'perl(JSON)' or '/usr/bin/python3'.
+        for tmp_name, tmp_version, tmp_release, tmp_arch in split_package_spec(input_spec):
+            tmp_matches = [
+                tmp_package for tmp_package in self._by_name.get(tmp_name, [])
+                if (tmp_version is None or rpmvercmp(tmp_package.evr[1], tmp_version) == 0)
+                and (tmp_release is None or rpmvercmp(tmp_package.evr[2], tmp_release) == 0)
+                and (tmp_arch is None or tmp_package.arch == tmp_arch)
+            ]
+            if tmp_matches:
+                return self._best(tmp_matches)
+        return self._best(self.providers(input_spec.strip()))
+
+    def closure(self, input_package):
+        # Every package needed to install input_package, itself included, and the requirements nothing satisfies.
+        return self.closure_many([input_package])[0]
+
+    def closure_many(self, input_packages):
+        # One solve for several packages, like a single 'yum install a b c' transaction: a requirement that a
+        # package already in the combined set provides isn't looked up again, so shared dependencies (glibc...) are
+        # picked once for everyone.  Returns a (closure, missing) pair per requested package, in order, where each
+        # closure holds what that package reaches through the shared choices.
+        tmp_selected = set()
+        tmp_queue = []
+        for tmp_package in input_packages:
+            if id(tmp_package) not in tmp_selected:
+                tmp_selected.add(id(tmp_package))
+                tmp_queue.append(tmp_package)
+        tmp_edges = {}
+        tmp_missing = {}
+        tmp_idx = 0
+        while tmp_idx < len(tmp_queue):
+            tmp_package = tmp_queue[tmp_idx]
+            tmp_idx += 1
+            tmp_edges[id(tmp_package)] = []
+            for tmp_name, tmp_flags, tmp_evr in tmp_package.requires:
+                if tmp_name.startswith('rpmlib('):
+                    continue
+                tmp_providers = self.providers(tmp_name, tmp_flags, tmp_evr)
+                tmp_chosen = next((tmp_provider for tmp_provider in tmp_providers if id(tmp_provider) in tmp_selected), None)
+                if tmp_chosen is None:
+                    tmp_chosen = self._best(tmp_providers)
+                    if tmp_chosen is None:
+                        tmp_missing.setdefault(id(tmp_package), []).append(
+                            "{} (required by {})".format(tmp_name, tmp_package.nevra)
+                        )
+                        continue
+                    tmp_selected.add(id(tmp_chosen))
+                    tmp_queue.append(tmp_chosen)
+                if tmp_chosen is not tmp_package:
+                    tmp_edges[id(tmp_package)].append(tmp_chosen)
+        tmp_results = []
+        for tmp_package in input_packages:
+            tmp_closure = [tmp_package]
+            tmp_reached = set([id(tmp_package)])
+            tmp_closure_missing = []
+            tmp_idx = 0
+            while tmp_idx < len(tmp_closure):
+                tmp_member = tmp_closure[tmp_idx]
+                tmp_idx += 1
+                tmp_closure_missing.extend(tmp_missing.get(id(tmp_member), []))
+                for tmp_next in tmp_edges[id(tmp_member)]:
+                    if id(tmp_next) not in tmp_reached:
+                        tmp_reached.add(id(tmp_next))
+                        tmp_closure.append(tmp_next)
+            tmp_results.append((tmp_closure, tmp_closure_missing))
+        return tmp_results
+
+def load_index(source, sections = RPM_SECTIONS, releasever = RPM_RELEASEVER, basearch = RPM_BASEARCH):
+    tmp_index = RepodataIndex(source, basearch)
+    for tmp_section in sections:
+        tmp_index.load("{}/{}/{}".format(releasever, tmp_section, basearch))
+    return tmp_index
+
+### MAIN ###
+def main():
+    tmp_parser = argparse.ArgumentParser(description = "Resolve RPM install closures from repodata")
+    tmp_parser.add_argument('packages', nargs = '+', help = "package specs, as given to 'yum install'")
+    tmp_parser.add_argument('--repo-dir', required = True, help = "local mirror laid out like the remote repo")
+    tmp_args = tmp_parser.parse_args()
+    logging.basicConfig(format = "%(levelname)s: %(message)s", level = logging.INFO)
+    tmp_index = load_index(DirectoryRepoSource(tmp_args.repo_dir))
+    for tmp_spec in tmp_args.packages:
+        tmp_package = tmp_index.find(tmp_spec)
+        if tmp_package is None:
+            logging.warning("No package matches '%s'", tmp_spec)
+            continue
+        tmp_closure, tmp_missing = tmp_index.closure(tmp_package)
+        for tmp_member in tmp_closure:
+            print(tmp_member.location)
+        for tmp_requirement in tmp_missing:
+            logging.warning("Unresolved: %s", tmp_requirement)
+
+if __name__ == "__main__":
+    main()